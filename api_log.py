@@ -0,0 +1,261 @@
+"""
+Compressed, query-indexed log of the Places API responses.
+
+Callers only put the record on a queue; a background thread takes it from
+there, so no file I/O happens on the request path. The thread writes the
+records in batches as JSON lines, each batch one gzip member appended to the
+current segment (`api_log-<start>-<pid>.jsonl.gz`, a plain gzip file any tool
+can read). A segment is closed and a new one started above `max_bytes`, and
+if `keep` is set each process only keeps its own last `keep` segments (the
+segments of other processes may still be open).
+
+Every record is indexed in `index.sqlite` by query (keyword, lat, lng,
+radius, page) and time, with the segment and byte offset of its batch, so
+looking a query up only decompresses the batch that holds it. Several
+processes can log into the same directory: segment names carry the pid.
+
+Record: {"ts", "keyword", "lat", "lng", "radius", "page", "status", "response"}
+"""
+import atexit
+import glob
+import gzip
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import zlib
+from datetime import datetime
+
+from loguru import logger
+
+DEFAULT_DIR = "api_logs"
+DEFAULT_MAX_BYTES = 64 * 1024 ** 2   # per segment, compressed
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 1.0
+# Records waiting for the writer; past this, new records are dropped rather
+# than slowing the crawl down.
+MAX_PENDING = 100000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    keyword TEXT    NOT NULL,
+    lat     REAL    NOT NULL,
+    lng     REAL    NOT NULL,
+    radius  REAL    NOT NULL,
+    page    INTEGER NOT NULL,
+    ts      REAL    NOT NULL,
+    status  TEXT,
+    segment TEXT    NOT NULL,
+    offset  INTEGER NOT NULL,
+    line    INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_query ON entries (keyword, lat, lng, radius, page);
+CREATE INDEX IF NOT EXISTS entries_ts ON entries (ts);
+"""
+
+_FLUSH = object()
+_STOP = object()
+
+
+def _query_key(keyword: str, lat: float, lng: float, radius: float, page: int) -> tuple:
+    # Same rounding as the response cache, so both agree on what a query is.
+    return (keyword.strip().lower(), round(float(lat), 7), round(float(lng), 7), round(float(radius), 2), int(page))
+
+
+def list_segments(directory: str) -> list:
+    """Segment files of a log directory, oldest first (their names start with their start time)."""
+    return sorted(glob.glob(os.path.join(directory, "api_log-*.jsonl.gz")))
+
+
+def read_segment(path: str):
+    """Yields the records of a segment file, index or not."""
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _read_member(path: str, offset: int) -> list:
+    """The lines of the gzip member starting at `offset`."""
+    decompressor = zlib.decompressobj(wbits=31)
+    chunks = []
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        while not decompressor.eof:
+            data = f.read(65536)
+            if not data:
+                break
+            chunks.append(decompressor.decompress(data))
+    return b"".join(chunks).decode('utf-8').splitlines()
+
+
+class ApiLog:
+    def __init__(self, directory: str = DEFAULT_DIR, max_bytes: int = DEFAULT_MAX_BYTES, keep: int = None,
+                 batch_size: int = BATCH_SIZE, flush_interval: float = FLUSH_INTERVAL):
+        """
+        max_bytes      -- compressed size at which a segment is rotated
+        keep           -- segments kept (None: all of them)
+        batch_size     -- records written at most per batch
+        flush_interval -- seconds a record waits at most before being written
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.dropped = 0
+        os.makedirs(directory, exist_ok=True)
+        self._queue = queue.Queue(MAX_PENDING)
+        self._segment = None
+        self._conn = None
+        self._thread = threading.Thread(target=self._run, name="api-log", daemon=True)
+        self._thread.start()
+
+    # --- PRODUCER SIDE ---
+    def record(self, keyword: str, lat: float, lng: float, radius: float, response: dict, page: int = 0):
+        """Queues one response; never blocks."""
+        entry = {'ts': time.time(), 'keyword': keyword, 'lat': lat, 'lng': lng, 'radius': radius, 'page': page,
+                 'status': response.get('status') if response else None, 'response': response}
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            if not self.dropped:
+                logger.warning(f"API log: writer behind by {MAX_PENDING} records, dropping new ones")
+            self.dropped += 1
+
+    def flush(self, timeout: float = None) -> bool:
+        """Waits until every record queued so far is on disk."""
+        if not self._thread.is_alive():
+            return True
+        done = threading.Event()
+        self._queue.put((_FLUSH, done))
+        return done.wait(timeout)
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+
+    # --- WRITER THREAD ---
+    def _run(self):
+        self._conn = sqlite3.connect(os.path.join(self.directory, "index.sqlite"), timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        try:
+            while True:
+                batch, waiters, stop = [], [], False
+                item = self._queue.get()
+                deadline = time.monotonic() + self.flush_interval
+                while True:
+                    if item is _STOP:
+                        stop = True
+                        break
+                    if isinstance(item, tuple) and item[0] is _FLUSH:
+                        waiters.append(item[1])
+                        break
+                    batch.append(item)
+                    if len(batch) >= self.batch_size:
+                        break
+                    try:
+                        item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                    except queue.Empty:
+                        break
+                if batch:
+                    try:
+                        self._write(batch)
+                    except Exception as e:
+                        # Whatever went wrong, the writer must outlive it.
+                        logger.error(f"API log: {len(batch)} records lost: {e!r}")
+                for waiter in waiters: waiter.set()
+                if stop:
+                    return
+        finally:
+            self._conn.close()
+
+    def _write(self, batch: list):
+        if self._segment is None or os.path.getsize(self._segment) >= self.max_bytes:
+            self._rotate()
+        data = "".join(json.dumps(e, separators=(',', ':'), ensure_ascii=False, default=str) + "\n" for e in batch)
+        member = gzip.compress(data.encode('utf-8'))
+        with open(self._segment, 'ab') as f:
+            offset = f.tell()
+            f.write(member)
+        name = os.path.basename(self._segment)
+        with self._conn:
+            self._conn.executemany("INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", [
+                _query_key(e['keyword'], e['lat'], e['lng'], e['radius'], e['page']) + (e['ts'], e['status'], name, offset, i)
+                for i, e in enumerate(batch)])
+        self.written += len(batch)
+
+    def _rotate(self):
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        self._segment = os.path.join(self.directory, f"api_log-{stamp}-{os.getpid()}.jsonl.gz")
+        open(self._segment, 'ab').close()
+        if self.keep:
+            suffix = f"-{os.getpid()}.jsonl.gz"
+            others = [path for path in self.segments() if path != self._segment and path.endswith(suffix)]
+            for old in others[:max(len(others) - self.keep + 1, 0)]:
+                with self._conn:
+                    self._conn.execute("DELETE FROM entries WHERE segment=?", (os.path.basename(old),))
+                os.remove(old)
+
+    # --- READING ---
+    def segments(self) -> list:
+        return list_segments(self.directory)
+
+    def find(self, keyword: str, lat: float, lng: float, radius: float, page: int = None) -> list:
+        """Logged records of one query (every page unless `page`), oldest first."""
+        key = _query_key(keyword, lat, lng, radius, page or 0)
+        sql = "SELECT segment, offset, line FROM entries WHERE keyword=? AND lat=? AND lng=? AND radius=?"
+        params = key[:4]
+        if page is not None:
+            sql += " AND page=?"
+            params += (key[4],)
+        return list(self._fetch(sql + " ORDER BY ts", params))
+
+    def records(self, keyword: str = None, since: float = None):
+        """
+        Yields the logged records segment by segment, optionally only those of
+        one keyword or logged after `since` (epoch seconds).
+        """
+        sql, params, where = "SELECT segment, offset, line FROM entries", (), []
+        if keyword is not None:
+            where.append("keyword=?")
+            params += (keyword.strip().lower(),)
+        if since is not None:
+            where.append("ts>=?")
+            params += (since,)
+        if where: sql += " WHERE " + " AND ".join(where)
+        yield from self._fetch(sql + " ORDER BY segment, offset, line", params)
+
+    def _fetch(self, sql: str, params: tuple):
+        conn = sqlite3.connect(os.path.join(self.directory, "index.sqlite"), timeout=30)
+        try:
+            rows = conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+        member, lines = None, None
+        for segment, offset, line in rows:
+            if (segment, offset) != member:
+                member = (segment, offset)
+                path = os.path.join(self.directory, segment)
+                lines = _read_member(path, offset) if os.path.exists(path) else []
+            if line < len(lines):
+                yield json.loads(lines[line])
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_log() -> ApiLog:
+    """The process-wide log in DEFAULT_DIR, started on first use and flushed at exit."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = ApiLog(DEFAULT_DIR)
+            atexit.register(_default.close)
+        return _default
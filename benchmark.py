@@ -0,0 +1,166 @@
+"""
+Offline crawl benchmark against the local Places API stand-in.
+
+Starts mock_places_api.py in a subprocess on a free port, crawls its
+synthetic (or population-based) places with CrawlEngine exactly as the app
+does, and reports:
+  - places/sec        unique places found per second of wall time
+  - calls per place   billed calls (as counted by the mock) per unique place
+  - box latency       p50 / p99 time to query one box, rate-limiter waits
+                      included, pagination excluded, as the engine's own
+                      metrics record it (see metrics.py)
+  - peak RSS          of the crawler process (the mock runs in its own)
+and the share of the mock's places the crawl found (synthetic clusters spill
+a little over the grid). No key is billed: the mock accepts any key. The
+mock's responses are logged to a temporary directory (or --api-log), never
+to the app's api_logs/, so they cannot end up in the response cache.
+
+  python benchmark.py --blocks 2 --places 100000 --rps 200
+  python benchmark.py --population france_population.csv --center 45.76,4.84 --json > after.json
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+import api_log
+import crawler
+import hex_coverage
+import metrics
+import places_client
+import utils
+from crawler import CrawlEngine
+from frontier import ORDERS
+from mock_places_api import NEARBY_PATH
+from splitting import STRATEGIES
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_mock(args, port: int) -> subprocess.Popen:
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mock_places_api.py")
+    cmd = [sys.executable, script, "--port", str(port), "--center", args.center,
+           "--size-km", str(args.blocks * utils.BLOCK_SIZE_KM), "--places", str(args.places),
+           "--token-delay", str(args.token_delay), "--latency", str(args.latency),
+           "--quota-rate", str(args.quota_rate), "--seed", str(args.seed)]
+    if args.population: cmd += ["--population", args.population]
+    if args.qps: cmd += ["--qps", str(args.qps)]
+    proc = subprocess.Popen(cmd)
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f"http://127.0.0.1:{port}/stats", timeout=1)
+            return proc
+        except requests.ConnectionError:
+            if proc.poll() is not None: break
+            time.sleep(0.2)
+    proc.kill()
+    sys.exit("The mock Places API did not start")
+
+
+def run(args) -> dict:
+    # Must be set before the first call starts the process-wide log.
+    api_log.DEFAULT_DIR = args.api_log or tempfile.mkdtemp(prefix="benchmark-api-log-")
+    port = _free_port()
+    mock = start_mock(args, port)
+    try:
+        # The crawler waits this long before asking for a next page.
+        crawler.PAGE_TOKEN_DELAY = places_client.PAGE_TOKEN_DELAY = args.token_delay
+        lat, lng = (float(v) for v in args.center.split(","))
+        lattice = None
+        if args.hex:
+            lattice, boxes = hex_coverage.hex_grid(lat, lng, args.blocks, utils.BLOCK_SIZE_KM)
+        else:
+            boxes = utils.get_grid_boxes(lat, lng, args.blocks)
+        engine = CrawlEngine("benchmark", args.keyword, min_radius=args.min_radius, max_rps=args.rps,
+                             workers=args.workers, order=args.order, split=args.split,
+                             lattice=lattice.params() if lattice else None, keywords=args.keywords,
+                             base_url=f"http://127.0.0.1:{port}{NEARBY_PATH}")
+        engine.seed(boxes)
+        start = time.perf_counter()
+        engine.start()
+        engine.wait()
+        elapsed = time.perf_counter() - start
+        stats = requests.get(f"http://127.0.0.1:{port}/stats", timeout=5).json()
+    finally:
+        mock.terminate()
+        mock.wait()
+        api_log.default_log().close()
+        if not args.api_log: shutil.rmtree(api_log.DEFAULT_DIR, ignore_errors=True)
+
+    snap = engine.snapshot(queue_preview=0)
+    if args.summary: metrics.write_summary(snap['metrics'], args.summary)
+    found = len(snap['results'])
+    # Same histogram as a production run (see metrics.py): quantiles are
+    # interpolated inside its buckets.
+    box_latency = snap['metrics']['box_latency']
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 ** 2 if sys.platform == 'darwin' else 1024)
+    return {
+        'places': found,
+        'places_in_mock': stats['places'],
+        'recall': found / stats['places'] if stats['places'] else None,
+        'seconds': round(elapsed, 2),
+        'places_per_sec': round(found / elapsed, 1) if elapsed else None,
+        'billed_calls': stats['billed'],
+        'engine_calls': snap['total_calls'],
+        'calls_per_place': round(stats['billed'] / found, 4) if found else None,
+        'boxes': len(snap['processed']),
+        'box_p50_ms': round(box_latency['p50'] * 1000, 1) if box_latency['count'] else None,
+        'box_p99_ms': round(box_latency['p99'] * 1000, 1) if box_latency['count'] else None,
+        'quota_errors': stats['quota_errors'],
+        'early_page_tokens': stats['early_tokens'],
+        'failed_boxes': snap['failed'],
+        'duplicate_ratio': snap['metrics']['duplicate_ratio'],
+        'worker_utilisation': snap['metrics']['worker_utilisation'],
+        'limiter_utilisation': snap['metrics']['limiter_utilisation'],
+        'peak_rss_mb': round(rss, 1),
+    }
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description="Offline crawl benchmark against a local Places API stand-in")
+    parser.add_argument("--center", default="48.8566,2.3522")
+    parser.add_argument("--blocks", type=int, default=1, help=f"grid of N x N blocks of {utils.BLOCK_SIZE_KM:g} km")
+    parser.add_argument("--places", type=int, default=50000, help="synthetic places in the mock")
+    parser.add_argument("--population", help="population CSV (X/Y/Z) the mock draws its places from instead")
+    parser.add_argument("--keyword", default="Restaurants")
+    parser.add_argument("--keywords", nargs="*", default=[], help="other keywords crawled over the same boxes")
+    parser.add_argument("--min-radius", type=float, default=100)
+    parser.add_argument("--order", choices=ORDERS, default='dfs')
+    parser.add_argument("--split", choices=STRATEGIES, default='quadrant')
+    parser.add_argument("--hex", action="store_true", help="hexagonal zones (see hex_coverage.py)")
+    parser.add_argument("--rps", type=int, default=100, help="crawler requests per second")
+    parser.add_argument("--workers", type=int, help="crawler workers (default: 4 x rps, at least 16)")
+    parser.add_argument("--latency", type=float, default=0.05, help="median mock response time (s)")
+    parser.add_argument("--quota-rate", type=float, default=0.0, help="share of random OVER_QUERY_LIMIT")
+    parser.add_argument("--qps", type=float, help="mock quota in queries per second")
+    parser.add_argument("--token-delay", type=float, default=2.0, help="seconds before a page token is valid")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--summary", help="also write the engine's run summary (see metrics.py) to this file")
+    parser.add_argument("--api-log", help="keep the mock's API log in this directory (default: a temporary one)")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    for name, value in report.items():
+        print(f"{name:<20} {value}")
+
+
+if __name__ == "__main__":
+    main()
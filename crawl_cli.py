@@ -0,0 +1,199 @@
+"""
+Headless crawler, for extractions too large for one browser tab.
+
+  python crawl_cli.py create Restaurants --center 48.8566,2.3522 --blocks 10 --keywords Bars Cafés
+  python crawl_cli.py work CRAWL_ID --processes 4 --keys-file keys.txt --rps-per-key 10
+  python crawl_cli.py status CRAWL_ID
+  python crawl_cli.py export CRAWL_ID resultats.parquet
+  python crawl_cli.py refresh CRAWL_ID --max-age-days 7 && python crawl_cli.py work CRAWL_ID
+
+`create` stores a crawl and its seed grid (the same grid as the Streamlit
+app, optionally hexagonal and pre-split by population) and prints its ID.
+`work` starts worker processes that share the crawl's frontier through the
+crawl store: each one leases a few boxes at a time, keeps the children of
+its boxes up to about a second of its calls, leaves the others pending for
+the other processes and hands back what it did not get to, so more
+processes can join or leave at any time by starting `work` again. The
+stores are SQLite files: the workers must run on the machine that holds
+them. The API keys are split between the processes, each key keeping its
+own quota. `refresh` puts the boxes of a finished crawl not queried for a
+given time back to pending, so that the next `work` only re-queries those
+and upserts what changed.
+
+Keys come from --keys-file (one per line), else GOOGLE_KEYS (comma-separated)
+or GOOGLE_KEY in the environment / .env file.
+"""
+import argparse
+import math
+import multiprocessing
+import os
+import socket
+import sys
+
+from loguru import logger
+
+import hex_coverage
+import metrics
+import planner
+import splitting
+import utils
+from crawl_store import CrawlStore
+from crawler import CrawlEngine
+from frontier import ORDERS
+from key_pool import KeyPool
+from place_store import PlaceStore
+from response_cache import ResponseCache
+
+# Seconds between two progress lines of a worker.
+PROGRESS_INTERVAL = 30
+
+
+def create(args) -> str:
+    lat, lng = (float(v) for v in args.center.split(","))
+    lattice = None
+    if args.hex:
+        lattice, boxes = hex_coverage.hex_grid(lat, lng, args.blocks, utils.BLOCK_SIZE_KM)
+    else:
+        boxes = utils.get_grid_boxes(lat, lng, args.blocks)
+    depths = None
+    if args.plan:
+        analyzer = utils.PopulationAnalyzer(args.population)
+        boxes, depths, stats = planner.plan_boxes(boxes, analyzer, args.people_per_place, min_radius=args.min_radius,
+                                                  lattice=lattice)
+        logger.info(f"Plan: {stats}")
+    engine = CrawlEngine(None, args.keyword, min_radius=args.min_radius, max_rps=args.max_rps, order=args.order,
+                         split=args.split, lattice=lattice.params() if lattice else None, keywords=args.keywords,
+                         store=CrawlStore(args.store))
+    engine.seed(boxes, depths)
+    logger.info(f"Crawl {engine.crawl_id}: {len(boxes)} seed boxes")
+    print(engine.crawl_id)
+    return engine.crawl_id
+
+
+def write_metrics(engine: CrawlEngine, worker_id: str, directory: str):
+    """Run summary (JSON) and Prometheus textfile of a worker, rewritten at each progress line."""
+    summary = engine.metrics_summary()
+    os.makedirs(directory, exist_ok=True)
+    metrics.write_summary(summary, os.path.join(directory, f"{worker_id}.json"))
+    prom = os.path.join(directory, f"{worker_id}.prom")
+    # Written aside and renamed, so a collector never reads half a file.
+    with open(prom + ".tmp", 'w', encoding='utf-8') as f:
+        f.write(metrics.to_prometheus(summary, {'crawl_id': engine.crawl_id, 'worker': worker_id}))
+    os.replace(prom + ".tmp", prom)
+
+
+def run_worker(crawl_id: str, index: int, count: int, keys: list, args):
+    """One worker process: shard `index` of `count` of the key pool."""
+    pool = KeyPool(keys, args.rps_per_key).shard(index, count)
+    worker_id = f"{socket.gethostname()}-{os.getpid()}"
+    store, places = CrawlStore(args.store), PlaceStore(args.places)
+    engine = CrawlEngine.join(store, crawl_id, pool.keys[0], worker_id, places=places,
+                              cache=None if args.no_cache else ResponseCache(),
+                              key_pool=pool, max_rps=math.ceil(pool.rate))
+    logger.info(f"Worker {worker_id}: {len(pool)} keys, {pool.rate:.1f} req/s")
+    engine.start()
+    try:
+        while not engine.wait(PROGRESS_INTERVAL):
+            snap = engine.snapshot(queue_preview=0)
+            logger.info(f"Worker {worker_id}: {len(snap['processed'])} boxes, {len(snap['results'])} places, "
+                        f"{snap['total_calls']} calls, {snap['queue_len']} queued, {snap['current_rps']:.1f} req/s")
+            if args.metrics_dir: write_metrics(engine, worker_id, args.metrics_dir)
+    except KeyboardInterrupt:
+        logger.info(f"Worker {worker_id}: stopping, handing back its boxes")
+        engine.stop(wait=True)
+    if args.metrics_dir: write_metrics(engine, worker_id, args.metrics_dir)
+    for error in engine.snapshot(queue_preview=0)['errors'][-5:]:
+        logger.warning(f"Worker {worker_id}: {error}")
+
+
+def work(args):
+    keys = utils.load_keys(args.keys_file)
+    if not keys:
+        sys.exit("No API key: use --keys-file, GOOGLE_KEYS or GOOGLE_KEY")
+    if args.processes == 1:
+        run_worker(args.crawl_id, 0, 1, keys, args)
+        return
+    # Spawned, not forked: SQLite connections must not cross a fork.
+    ctx = multiprocessing.get_context('spawn')
+    procs = [ctx.Process(target=run_worker, args=(args.crawl_id, i, args.processes, keys, args), name=f"worker-{i}")
+             for i in range(args.processes)]
+    for proc in procs: proc.start()
+    try:
+        for proc in procs: proc.join()
+    except KeyboardInterrupt:
+        # The workers got the interrupt too and are handing back their boxes.
+        for proc in procs: proc.join()
+
+
+def status(args):
+    store = CrawlStore(args.store)
+    info = store.crawl_info(args.crawl_id)
+    counts = store.box_counts(args.crawl_id)
+    found = PlaceStore(args.places).count_by_crawl().get(args.crawl_id, 0)
+    keywords = ", ".join([info['keyword']] + info['params'].get('keywords', []))
+    print(f"{args.crawl_id} · {keywords}")
+    print("Boxes: " + ", ".join(f"{state} {n}" for state, n in sorted(counts.items())))
+    print(f"Places: {found} · API calls: {info['total_calls']}" +
+          (f" · {info['total_calls'] / found:.3f} calls per place" if found else ""))
+
+
+def refresh(args):
+    stale = CrawlStore(args.store).mark_stale(args.crawl_id, args.max_age_days * 86400)
+    print(f"{stale} boxes to query again: python crawl_cli.py work {args.crawl_id}")
+
+
+def export(args):
+    n = PlaceStore(args.places).export(args.filename, crawl_id=args.crawl_id)
+    print(f"{n} places exported to {args.filename}")
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--store", default="crawls.sqlite", help="crawl store shared by the workers")
+    parser.add_argument("--places", default="places.sqlite", help="place store shared by the workers")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("create", help="store a new crawl and its seed grid")
+    p.add_argument("keyword")
+    p.add_argument("--keywords", nargs="*", default=[], help="other keywords crawled over the same boxes")
+    p.add_argument("--center", required=True, help="lat,lng of the grid centre")
+    p.add_argument("--blocks", type=int, default=1, help=f"grid of N x N blocks of {utils.BLOCK_SIZE_KM:g} km")
+    p.add_argument("--min-radius", type=float, default=100)
+    p.add_argument("--max-rps", type=int, default=2, help="stored default; workers use their key pool's rate")
+    p.add_argument("--order", choices=ORDERS, default='dfs')
+    p.add_argument("--split", choices=splitting.STRATEGIES, default='quadrant')
+    p.add_argument("--hex", action="store_true", help="hexagonal zones (see hex_coverage.py)")
+    p.add_argument("--plan", action="store_true", help="pre-split the grid by population")
+    p.add_argument("--population", default="france_population.csv")
+    p.add_argument("--people-per-place", type=float, default=planner.DEFAULT_PEOPLE_PER_PLACE)
+    p.set_defaults(func=create)
+
+    p = commands.add_parser("work", help="crawl a stored crawl with worker processes")
+    p.add_argument("crawl_id")
+    p.add_argument("--processes", type=int, default=1)
+    p.add_argument("--keys-file", help="API keys, one per line")
+    p.add_argument("--rps-per-key", type=float, default=10, help="requests per second allowed on each key")
+    p.add_argument("--no-cache", action="store_true", help="do not use the local response cache")
+    p.add_argument("--metrics-dir", help="write each worker's run summary (.json) and metrics (.prom) here")
+    p.set_defaults(func=work)
+
+    p = commands.add_parser("status", help="progress of a crawl")
+    p.add_argument("crawl_id")
+    p.set_defaults(func=status)
+
+    p = commands.add_parser("refresh", help="mark the boxes of a crawl older than an age for a new pass")
+    p.add_argument("crawl_id")
+    p.add_argument("--max-age-days", type=float, default=7)
+    p.set_defaults(func=refresh)
+
+    p = commands.add_parser("export", help="export the places of a crawl (.csv, .parquet or .geojson)")
+    p.add_argument("crawl_id")
+    p.add_argument("filename")
+    p.set_defaults(func=export)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
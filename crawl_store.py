@@ -0,0 +1,315 @@
+"""
+Durable crawl state.
+
+Every crawl gets an ID and its frontier is stored in SQLite, one row per box
+with its state (pending, in_flight, done, split, failed); the places found
+are kept in the PlaceStore (place_store.py). The engine journals state changes and flushes them in
+one transaction per checkpoint, so a checkpoint only writes what changed
+since the previous one. After a crash, boxes left in flight go back to
+pending when the crawl is loaded.
+
+Several worker processes can share one crawl: each leases batches of pending
+boxes, which stay in flight under its name until it reports them or its lease
+expires (a dead worker's boxes go back to the others). Sector numbers are
+reserved in blocks so workers never hand out the same one, and call counts
+are added up rather than overwritten.
+
+A finished crawl can be refreshed in place: `mark_stale` puts its leaves
+older than a given age back to pending, and resuming the crawl re-queries
+them only, splitting those that have become saturated since.
+"""
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+
+PENDING = 'pending'
+IN_FLIGHT = 'in_flight'
+DONE = 'done'
+SPLIT = 'split'
+FAILED = 'failed'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS crawls (
+    crawl_id       TEXT PRIMARY KEY,
+    keyword        TEXT NOT NULL,
+    params         TEXT NOT NULL,
+    created_at     REAL NOT NULL,
+    updated_at     REAL NOT NULL,
+    sector_counter INTEGER NOT NULL DEFAULT 0,
+    total_calls    INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS boxes (
+    crawl_id   TEXT    NOT NULL,
+    sector_id  INTEGER NOT NULL,
+    min_lat    REAL    NOT NULL,
+    min_lng    REAL    NOT NULL,
+    max_lat    REAL    NOT NULL,
+    max_lng    REAL    NOT NULL,
+    parent_id  INTEGER,
+    depth      INTEGER NOT NULL DEFAULT 0,
+    keywords   INTEGER,
+    state      TEXT    NOT NULL,
+    lease_owner TEXT,
+    lease_until REAL,
+    count      INTEGER,
+    attempts   INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL    NOT NULL,
+    PRIMARY KEY (crawl_id, sector_id)
+);
+CREATE INDEX IF NOT EXISTS boxes_state ON boxes (crawl_id, state);
+CREATE INDEX IF NOT EXISTS boxes_parent ON boxes (crawl_id, parent_id);
+"""
+
+
+def new_crawl_id() -> str:
+    return f"{datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:6]}"
+
+
+class CrawlStore:
+    def __init__(self, path: str = "crawls.sqlite"):
+        self.path = path
+        self._lock = threading.Lock()
+        # Other worker processes may hold the write lock for a moment.
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(boxes)")]
+        # Stores from before multi-keyword crawls: NULL means every keyword.
+        for column, sql_type in (('keywords', 'INTEGER'), ('lease_owner', 'TEXT'), ('lease_until', 'REAL')):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE boxes ADD COLUMN {column} {sql_type}")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # --- CRAWLS ---
+    def create_crawl(self, keyword: str, params: dict = None, crawl_id: str = None) -> str:
+        crawl_id = crawl_id or new_crawl_id()
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO crawls (crawl_id, keyword, params, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (crawl_id, keyword, json.dumps(params or {}), now, now))
+        return crawl_id
+
+    def list_crawls(self) -> list:
+        """Returns one dict per crawl, most recent first, with its box counts by state."""
+        with self._lock:
+            crawls = self._conn.execute(
+                "SELECT crawl_id, keyword, params, created_at, updated_at, total_calls "
+                "FROM crawls ORDER BY updated_at DESC").fetchall()
+            counts = self._conn.execute(
+                "SELECT crawl_id, state, COUNT(*) FROM boxes GROUP BY crawl_id, state").fetchall()
+        by_crawl = {}
+        for crawl_id, state, n in counts:
+            by_crawl.setdefault(crawl_id, {})[state] = n
+        return [{'crawl_id': c[0], 'keyword': c[1], 'params': json.loads(c[2]), 'created_at': c[3],
+                 'updated_at': c[4], 'total_calls': c[5], 'boxes': by_crawl.get(c[0], {})} for c in crawls]
+
+    def crawl_info(self, crawl_id: str) -> dict:
+        """Keyword, params and counters of a crawl, without its boxes."""
+        with self._lock:
+            crawl = self._conn.execute(
+                "SELECT keyword, params, sector_counter, total_calls FROM crawls WHERE crawl_id=?",
+                (crawl_id,)).fetchone()
+        if crawl is None:
+            raise KeyError(f"Unknown crawl: {crawl_id}")
+        return {'crawl_id': crawl_id, 'keyword': crawl[0], 'params': json.loads(crawl[1]),
+                'sector_counter': crawl[2], 'total_calls': crawl[3]}
+
+    def box_counts(self, crawl_id: str) -> dict:
+        """Number of boxes of a crawl by state."""
+        with self._lock:
+            return dict(self._conn.execute("SELECT state, COUNT(*) FROM boxes WHERE crawl_id=? GROUP BY state",
+                                           (crawl_id,)))
+
+    def load(self, crawl_id: str) -> dict:
+        """
+        Loads a crawl for resuming. Boxes that were in flight when the process
+        died are returned to pending first (boxes leased by a live worker
+        process are left alone).
+        """
+        with self._lock, self._conn:
+            crawl = self._conn.execute(
+                "SELECT keyword, params, sector_counter, total_calls FROM crawls WHERE crawl_id=?",
+                (crawl_id,)).fetchone()
+            if crawl is None:
+                raise KeyError(f"Unknown crawl: {crawl_id}")
+            self._conn.execute("UPDATE boxes SET state=?, lease_owner=NULL WHERE crawl_id=? AND state=? "
+                               "AND (lease_until IS NULL OR lease_until < ?)",
+                               (PENDING, crawl_id, IN_FLIGHT, time.time()))
+            boxes = self._conn.execute(
+                "SELECT sector_id, min_lat, min_lng, max_lat, max_lng, depth, state, count, attempts, keywords "
+                "FROM boxes WHERE crawl_id=? AND state != ? ORDER BY depth DESC, sector_id",
+                (crawl_id, IN_FLIGHT)).fetchall()
+
+        return {
+            'crawl_id': crawl_id,
+            'keyword': crawl[0],
+            'params': json.loads(crawl[1]),
+            'sector_counter': crawl[2],
+            'total_calls': crawl[3],
+            'boxes': [{'sector_id': b[0], 'coords': tuple(b[1:5]), 'depth': b[5], 'state': b[6],
+                       'count': b[7], 'attempts': b[8], 'keywords': b[9]} for b in boxes],
+        }
+
+    def mark_stale(self, crawl_id: str, max_age: float) -> int:
+        """
+        Prepares a refresh: the leaves of the crawl (done or failed boxes)
+        last queried more than `max_age` seconds ago go back to pending, and
+        the crawl can be resumed to re-query them. A split box also counts as
+        a leaf for the keywords it did not split for (they were not
+        saturated there): a pending copy of it is added for those keywords.
+        Fresh leaves and split boxes are kept as they are, and until the
+        refresh is over (see `end_refresh`) the crawl does not use cached
+        responses older than the cutoff. Returns the number of boxes to
+        query again.
+        """
+        cutoff = time.time() - max_age
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            crawl = self._conn.execute("SELECT params FROM crawls WHERE crawl_id=?", (crawl_id,)).fetchone()
+            if crawl is None:
+                raise KeyError(f"Unknown crawl: {crawl_id}")
+            params = json.loads(crawl[0])
+            # Responses cached before the cutoff are as stale as the boxes.
+            # Stored so that the workers and resumes of this refresh use it.
+            params['fresh_after'] = cutoff
+            self._conn.execute("UPDATE crawls SET params=? WHERE crawl_id=?", (json.dumps(params), crawl_id))
+            all_keywords = (1 << (1 + len(params.get('keywords', [])))) - 1
+            stale = self._conn.execute(
+                "UPDATE boxes SET state=?, attempts=0, lease_owner=NULL, lease_until=NULL "
+                "WHERE crawl_id=? AND ((state=? AND updated_at < ?) OR state=?)",
+                (PENDING, crawl_id, DONE, cutoff, FAILED)).rowcount
+            # Keywords a split box was queried for minus those its children
+            # are, unless an earlier refresh already added its copy.
+            rows = [] if all_keywords == 1 else self._conn.execute(
+                "SELECT b.sector_id, b.min_lat, b.min_lng, b.max_lat, b.max_lng, b.parent_id, b.depth, b.keywords, "
+                "(SELECT c.keywords FROM boxes c WHERE c.crawl_id=b.crawl_id AND c.parent_id=b.sector_id LIMIT 1) "
+                "FROM boxes b WHERE b.crawl_id=? AND b.state=? AND b.updated_at < ? AND NOT EXISTS ("
+                "SELECT 1 FROM boxes d WHERE d.crawl_id=b.crawl_id AND d.parent_id IS b.parent_id "
+                "AND d.sector_id != b.sector_id AND d.depth=b.depth AND d.min_lat=b.min_lat AND d.min_lng=b.min_lng)",
+                (crawl_id, SPLIT, cutoff)).fetchall()
+            leftovers = []
+            for row in rows:
+                mask = row[7] if row[7] is not None else all_keywords
+                children = row[8] if row[8] is not None else all_keywords
+                if mask & ~children:
+                    leftovers.append(row[1:7] + (mask & ~children,))
+            if leftovers:
+                self._conn.execute("UPDATE crawls SET sector_counter=sector_counter+? WHERE crawl_id=?",
+                                   (len(leftovers), crawl_id))
+                top = self._conn.execute("SELECT sector_counter FROM crawls WHERE crawl_id=?",
+                                         (crawl_id,)).fetchone()[0]
+                now = time.time()
+                self._conn.executemany(
+                    "INSERT INTO boxes (crawl_id, sector_id, min_lat, min_lng, max_lat, max_lng, parent_id, depth, "
+                    "keywords, state, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(crawl_id, sector_id) + box + (PENDING, now)
+                     for sector_id, box in zip(range(top - len(leftovers) + 1, top + 1), leftovers)])
+        return stale + len(leftovers)
+
+    def end_refresh(self, crawl_id: str) -> bool:
+        """
+        Drops the refresh cutoff of a crawl once none of its boxes is pending
+        or in flight any more; later resumes use the cache normally again.
+        Returns whether the crawl has no refresh going on.
+        """
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            busy = self._conn.execute("SELECT 1 FROM boxes WHERE crawl_id=? AND state IN (?, ?) LIMIT 1",
+                                      (crawl_id, PENDING, IN_FLIGHT)).fetchone()
+            if busy:
+                return False
+            crawl = self._conn.execute("SELECT params FROM crawls WHERE crawl_id=?", (crawl_id,)).fetchone()
+            params = json.loads(crawl[0]) if crawl else {}
+            if params.pop('fresh_after', None) is not None:
+                self._conn.execute("UPDATE crawls SET params=? WHERE crawl_id=?", (json.dumps(params), crawl_id))
+        return True
+
+    # --- LEASES ---
+    def reserve_sector_ids(self, crawl_id: str, count: int) -> range:
+        """Reserves `count` sector numbers no other worker of the crawl will use."""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE crawls SET sector_counter=sector_counter+? WHERE crawl_id=?", (count, crawl_id))
+            top = self._conn.execute("SELECT sector_counter FROM crawls WHERE crawl_id=?", (crawl_id,)).fetchone()[0]
+        return range(top - count + 1, top + 1)
+
+    def lease(self, crawl_id: str, owner: str, limit: int, ttl: float) -> list:
+        """
+        Moves up to `limit` pending boxes (or boxes whose lease expired) in
+        flight under `owner` for `ttl` seconds, deepest first, and returns
+        them as (min_lat, min_lng, max_lat, max_lng, sector_id, depth,
+        keywords, attempts) tuples. `keywords` is None for every keyword.
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            # Take the write lock first so two workers cannot lease the same boxes.
+            self._conn.execute("BEGIN IMMEDIATE")
+            rows = self._conn.execute(
+                "SELECT min_lat, min_lng, max_lat, max_lng, sector_id, depth, keywords, attempts FROM boxes "
+                "WHERE crawl_id=? AND (state=? OR (state=? AND lease_until < ?)) "
+                "ORDER BY depth DESC, sector_id LIMIT ?", (crawl_id, PENDING, IN_FLIGHT, now, limit)).fetchall()
+            self._conn.executemany(
+                "UPDATE boxes SET state=?, lease_owner=?, lease_until=?, updated_at=? WHERE crawl_id=? AND sector_id=?",
+                [(IN_FLIGHT, owner, now + ttl, now, crawl_id, row[4]) for row in rows])
+        return rows
+
+    def renew(self, crawl_id: str, owner: str, ttl: float):
+        """Extends the leases of every box `owner` has in flight."""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE boxes SET lease_until=? WHERE crawl_id=? AND lease_owner=? AND state=?",
+                               (time.time() + ttl, crawl_id, owner, IN_FLIGHT))
+
+    def release(self, crawl_id: str, owner: str) -> int:
+        """Returns the boxes `owner` still has in flight to pending; returns how many."""
+        with self._lock, self._conn:
+            return self._conn.execute(
+                "UPDATE boxes SET state=?, lease_owner=NULL, lease_until=NULL WHERE crawl_id=? AND lease_owner=? "
+                "AND state=?", (PENDING, crawl_id, owner, IN_FLIGHT)).rowcount
+
+    # --- CHECKPOINTS ---
+    def apply(self, crawl_id: str, ops: list, sector_counter: int, new_calls: int, owner: str = None,
+              ttl: float = None):
+        """
+        Writes a batch of journaled changes in one transaction:
+          ('add', sector_id, coords, parent_id, depth, keywords, leased) -- new pending box
+          ('state', sector_id, state, count, attempts)                   -- state change
+        `new_calls` are added to the crawl's call count. With an `owner`, new
+        boxes are leased to it for `ttl` seconds unless not `leased` (left for
+        the other workers), and so are boxes it puts back to pending (they
+        are back in its own queue).
+        """
+        now = time.time()
+        lease_until = now + ttl if owner is not None else None
+        adds, states = [], []
+        for op in ops:
+            if op[0] == 'add':
+                _, sector_id, coords, parent_id, depth, keywords, leased = op
+                if owner is not None and leased:
+                    adds.append((crawl_id, sector_id) + tuple(coords) +
+                                (parent_id, depth, keywords, IN_FLIGHT, owner, lease_until, now))
+                else:
+                    adds.append((crawl_id, sector_id) + tuple(coords) +
+                                (parent_id, depth, keywords, PENDING, None, None, now))
+            elif op[0] == 'state':
+                _, sector_id, state, count, attempts = op
+                if owner is not None and state == PENDING: state = IN_FLIGHT
+                states.append((state, count, attempts, now, crawl_id, sector_id))
+
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO boxes (crawl_id, sector_id, min_lat, min_lng, max_lat, max_lng, parent_id, "
+                "depth, keywords, state, lease_owner, lease_until, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", adds)
+            self._conn.executemany(
+                "UPDATE boxes SET state=?, count=COALESCE(?, count), attempts=?, updated_at=? "
+                "WHERE crawl_id=? AND sector_id=?", states)
+            self._conn.execute(
+                "UPDATE crawls SET sector_counter=MAX(sector_counter, ?), total_calls=total_calls+?, updated_at=? "
+                "WHERE crawl_id=?", (sector_counter, new_calls, now, crawl_id))
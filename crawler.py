@@ -0,0 +1,872 @@
+"""
+Headless crawl engine.
+
+The engine owns the frontier and a long-lived pool of workers. Workers pull the
+next box as soon as they are free, so a slow box never stalls the others, and
+the children of a split box are scheduled the moment their parent finishes.
+It does not depend on Streamlit: `main.py` only polls `snapshot()`.
+
+Workers are asyncio tasks running on one background thread and sharing one
+pooled PlacesClient, so hundreds of boxes can be in flight without one OS
+thread per call. Every API call, pagination pages included, goes through one
+shared AdaptiveTokenBucket; boxes whose calls fail are requeued, not dropped.
+
+Pagination never holds a worker: the next_page_token of a dense box goes into
+a delay queue with a "ready at" time, and whichever worker is free once it is
+due fetches the next page.
+
+With a CrawlStore attached, every state change is journaled and flushed to
+disk at each checkpoint, so a crawl can be resumed by its ID after a refresh,
+a restart or a crash. With a PlaceStore attached, the places found since the
+previous checkpoint are upserted at the same time.
+
+Boxes are (min_lat, min_lng, max_lat, max_lng, sector, depth, keywords)
+tuples held in an array-backed BoxFrontier; sector labels are only formatted
+for display.
+
+Several keywords can share one crawl: each box carries the mask of the
+keywords still to query in it, is queried once per keyword and split once
+for all the keywords it saturated. The lead keyword is queried first, and the
+others skip the boxes the DensityModel expects them to saturate as well
+(see density_model.py).
+
+Several engines, in separate processes, can work on one stored crawl: each
+`join`s it under a worker ID, leases batches of pending boxes from the
+CrawlStore into its own frontier and keeps the children of its boxes leased
+to itself. Leases are renewed at each checkpoint; those of a dead worker
+expire and its boxes go back to the others. API calls can be spread over a
+KeyPool of keys with one quota each.
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import threading
+import time
+
+import crawl_store
+import frontier
+import splitting
+import utils
+from loguru import logger
+
+from crawl_store import CrawlStore
+from density_model import DensityModel
+from frontier import BoxFrontier, BoxLog
+from hex_coverage import HexLattice
+from key_pool import KeyPool
+from metrics import CrawlMetrics
+from place_index import PlaceIndex
+from place_store import PlaceStore
+from places_client import NEARBY_SEARCH_URL, PAGE_TOKEN_DELAY, PlacesClient
+from rate_limiter import AdaptiveTokenBucket
+from response_cache import ResponseCache
+
+# A box whose calls keep failing is parked in `failed` after this many tries.
+MAX_BOX_ATTEMPTS = 5
+
+# Google returns at most 3 pages (60 results) per query.
+MAX_PAGES = 3
+
+# Seconds between two checkpoints of the journal to the crawl store.
+CHECKPOINT_INTERVAL = 2.0
+
+# Shared crawls: seconds a leased box stays with a worker that stops renewing
+# it, seconds an idle worker waits before asking the store again, and boxes
+# leased at a time. A worker holds (queued or in flight) at most about
+# LEASE_BACKLOG seconds of calls at its current rate, whatever its number of
+# coroutines, so that one worker cannot take the whole crawl.
+LEASE_TTL = 60.0
+LEASE_POLL = 0.5
+LEASE_SIZE = 4
+LEASE_BACKLOG = 1.0
+
+
+def format_sector_id(n: int) -> str:
+    return f"S-{n:06d}"
+
+
+def empty_snapshot() -> dict:
+    """What `CrawlEngine.snapshot()` looks like before any crawl exists."""
+    return {
+        'queue_len': 0, 'queue_preview': [], 'processed': BoxLog(0).view(), 'results': [], 'raw_results': 0, 'errors': [], 'failed': 0,
+        'total_calls': 0, 'calls_per_place': None, 'cache_hits': 0, 'current_rps': 0.0, 'quota_errors': 0,
+        'in_flight': 0, 'pending_pages': 0, 'running': False, 'crawl_id': None,
+        'keywords': [], 'by_keyword': {}, 'skipped_queries': 0, 'places_written': 0, 'metrics': None,
+    }
+
+
+def place_density(places: list, box: tuple) -> float:
+    """Places of `places` located inside `box`, per square degree."""
+    min_lat, min_lng, max_lat, max_lng = box[:4]
+    inside = 0
+    for p in places:
+        loc = p.get('geometry', {}).get('location')
+        if loc and min_lat <= loc['lat'] < max_lat and min_lng <= loc['lng'] < max_lng:
+            inside += 1
+    return inside / max((max_lat - min_lat) * (max_lng - min_lng), 1e-12)
+
+
+# --- WORKER FUNCTIONS ---
+async def process_single_box_logic(box_data, client, keyword, min_radius_limit, lattice: HexLattice = None):
+    """
+    Queries the first page of a box and decides what to do with it. A dense
+    box at the minimum radius comes back as "paginate" with its page token,
+    so the remaining pages continue from this response instead of re-querying.
+    With a `lattice`, the box is a hexagonal cell and is queried with the
+    circle around the hexagon rather than around the box corners.
+    """
+    min_lat, min_lng, max_lat, max_lng = box_data[:4]
+    if lattice is not None:
+        radius = lattice.radius(box_data[:4], box_data[5])
+    else:
+        radius = utils.get_box_radius(min_lat, min_lng, max_lat, max_lng)
+    center_lat, center_lng = (min_lat + max_lat) / 2, (min_lng + max_lng) / 2
+
+    try:
+        data = await client.fetch_page(keyword, center_lat, center_lng, radius)
+        places = data.get('results', [])
+        count = len(places)
+        action = "save"
+        if count >= 20 and radius > min_radius_limit: action = "split"
+        elif count >= 20 and radius <= min_radius_limit:
+            action = "paginate" if data.get('next_page_token') else "save_dense"
+        return {"status": "ok", "action": action, "places": places, "box_data": box_data, "radius": radius,
+                "count": count, "keyword": keyword, "pages": 1, "next_page_token": data.get('next_page_token'),
+                "from_cache": data.get('from_cache', False)}
+    except Exception as e:
+        return {"status": "error", "error": str(e), "error_status": getattr(e, 'status', None),
+                "retryable": getattr(e, 'retryable', True), "box_data": box_data}
+
+
+async def process_next_page(page, client):
+    """
+    Fetches the page behind `page['next_page_token']` for a dense box. Pages
+    of a cached chain come from the cache too; if one is missing, the chain
+    restarts live from page 1 since the cached token has long expired.
+    """
+    min_lat, min_lng, max_lat, max_lng = page['box_data'][:4]
+    center_lat, center_lng = (min_lat + max_lat) / 2, (min_lng + max_lng) / 2
+    keyword, radius = page['keyword'], page['radius']
+
+    try:
+        if page['from_cache']:
+            data = await client.cached_page(keyword, center_lat, center_lng, radius, page['pages'])
+            if data is None:
+                data = await client.fetch_page(keyword, center_lat, center_lng, radius, use_cache=False)
+                token = data.get('next_page_token')
+                return dict(page, status="ok", action="paginate" if token else "save_dense",
+                            places=data.get('results', []), pages=1, next_page_token=token, from_cache=False)
+        else:
+            data = await client.fetch_page(keyword, center_lat, center_lng, radius,
+                                           pagetoken=page['next_page_token'], page=page['pages'])
+        places = page['places'] + data.get('results', [])
+        pages = page['pages'] + 1
+        token = data.get('next_page_token') if pages < MAX_PAGES else None
+        return dict(page, status="ok", action="paginate" if token else "save_dense",
+                    places=places, pages=pages, next_page_token=token, from_cache=data.get('from_cache', False))
+    except Exception as e:
+        return {"status": "error", "error": str(e), "error_status": getattr(e, 'status', None),
+                "retryable": getattr(e, 'retryable', True), "box_data": page['box_data']}
+
+
+class CrawlEngine:
+    """
+    Continuous scheduler: `workers` coroutines share one frontier and each
+    takes the next box as soon as it is idle. API calls are limited to
+    `max_rps` by a shared token bucket; `max_connections` caps the HTTP
+    requests in flight. `order` is the frontier scheduling order (see
+    frontier.ORDERS) and `split` the strategy used to split saturated boxes
+    (see splitting.STRATEGIES). With `lattice` (HexLattice.params()), boxes
+    are hexagonal cells refined on the lattice instead, and `split` is unused
+    (see hex_coverage.py). `keywords` are crawled over the same boxes as the
+    lead `keyword`. `key_pool` spreads the calls over several API keys, and
+    `worker_id` makes the engine one worker of a crawl shared through the
+    store (see `join`), leasing `lease_size` boxes at a time while it holds
+    less than LEASE_BACKLOG seconds of calls; it keeps the children of its
+    boxes up to that backlog and leaves the rest pending in the store for any
+    worker. `base_url` points the client at another endpoint (see
+    mock_places_api.py). `metrics` records latencies, waits, queue depth and
+    utilisation along the way (see metrics.py). Cached responses fetched
+    before `fresh_after` (epoch seconds) are not used: a refresh sets it to
+    its staleness cutoff until its last stale box is done (see `refresh`).
+    """
+
+    def __init__(self, api_key: str, keyword: str, min_radius: float = 100, max_rps: int = 2,
+                 workers: int = None, max_connections: int = 32, cache: ResponseCache = None,
+                 store: CrawlStore = None, crawl_id: str = None, order: str = 'dfs',
+                 places: PlaceStore = None, split: str = 'quadrant', lattice: dict = None, keywords: list = None,
+                 key_pool: KeyPool = None, worker_id: str = None, lease_size: int = None,
+                 base_url: str = NEARBY_SEARCH_URL, fresh_after: float = None):
+        if split not in splitting.STRATEGIES:
+            raise ValueError(f"Unknown split strategy: {split} (expected one of {splitting.STRATEGIES})")
+        keywords = [k for k in keywords or [] if k != keyword]
+        if len(keywords) >= frontier.MAX_KEYWORDS:
+            raise ValueError(f"Too many keywords: at most {frontier.MAX_KEYWORDS} per crawl")
+        self.api_key = api_key
+        self.keyword = keyword
+        # The lead keyword first; boxes hold a mask over this list.
+        self.keywords = [keyword] + keywords
+        self.all_keywords = (1 << len(self.keywords)) - 1
+        self.model = DensityModel(len(self.keywords))
+        self.min_radius = min_radius
+        self.max_rps = max_rps
+        self.workers = workers or max(16, 4 * max_rps)
+        self.max_connections = max_connections
+        self.split = split
+        self.lattice = HexLattice(**lattice) if lattice else None
+        self.cache = cache
+        self.store = store
+        self.places = places
+        self.crawl_id = crawl_id
+        self.key_pool = key_pool
+        self.base_url = base_url
+        self.fresh_after = fresh_after
+        self.worker_id = worker_id
+        if worker_id is not None and (store is None or crawl_id is None):
+            raise ValueError("A worker needs the store and the ID of the crawl it joins")
+        self.lease_size = lease_size or LEASE_SIZE
+        if store is not None and crawl_id is None:
+            self.crawl_id = store.create_crawl(keyword, {'min_radius': min_radius, 'max_rps': max_rps, 'order': order,
+                                                          'split': split, 'lattice': lattice, 'keywords': keywords})
+
+        # Guards the state below: written from the loop thread, read by the UI.
+        self._lock = threading.Lock()
+        self._thread = None
+        self._loop = None
+        self._wakeup = None
+        self._stopping = False
+        self._budget = None
+        self._client = None
+        self._counter_base = (0, 0)
+        self.limiter = AdaptiveTokenBucket(max_rps)
+        self.metrics = CrawlMetrics()
+
+        self.queue = BoxFrontier(order)
+        self.processed = BoxLog()
+        self.results = PlaceIndex()
+        self.errors = []
+        self.failed = []
+        self.attempts = {}
+        self.total_calls = 0
+        self._calls_checkpointed = 0
+        self.cache_hits = 0
+        # Place rows the checkpoints inserted or changed in the PlaceStore
+        self.places_written = 0
+        self.sector_counter = 0
+        # Shared crawls: sector numbers reserved in the store, lease state
+        self._sector_ids = range(0)
+        self._leasing = False
+        self._next_lease = 0.0
+        self._crawl_done = False
+        self.in_flight = 0
+        # Dense boxes waiting for their next page: (ready_at, seq, page)
+        self.delayed = []
+        self._delay_seq = itertools.count()
+        # Boxes waiting for their last pagination chains: sector -> [chain, chains left, count]
+        self._paginating = {}
+        # Changes and places not checkpointed yet
+        self._journal = []
+        self._new_places = []
+        # Hexagonal cells already queued, with the keywords they were queued
+        # for: neighbouring cells share children.
+        self._hex_seen = {}
+        self._checkpoint_lock = threading.Lock()
+
+    @classmethod
+    def resume(cls, store: CrawlStore, crawl_id: str, api_key: str, places: PlaceStore = None,
+               **kwargs) -> 'CrawlEngine':
+        """Rebuilds an engine from the last checkpoint of a stored crawl."""
+        state = store.load(crawl_id)
+        params = dict(state['params'], **kwargs)
+        engine = cls(api_key, state['keyword'], store=store, crawl_id=crawl_id, places=places, **params)
+        engine.sector_counter = state['sector_counter']
+        engine.total_calls = engine._calls_checkpointed = state['total_calls']
+        for box in state['boxes']:
+            sector_id = box['sector_id']
+            mask = box['keywords'] if box['keywords'] is not None else engine.all_keywords
+            box_data = box['coords'] + (sector_id, box['depth'], mask)
+            if engine.lattice is not None:
+                key = engine.lattice.key(box['coords'], box['depth'])
+                engine._hex_seen[key] = engine._hex_seen.get(key, 0) | mask
+            if box['state'] == crawl_store.PENDING:
+                engine.queue.push(box_data)
+                if box['attempts']: engine.attempts[sector_id] = box['attempts']
+            elif box['state'] == crawl_store.FAILED:
+                engine.failed.append(box_data)
+                engine.processed.append(box_data, frontier.FAILED)
+            elif box['state'] == crawl_store.SPLIT:
+                engine.processed.append(box_data, frontier.SPLIT, box['count'] or 0)
+            else:
+                engine.processed.append(box_data, frontier.SAVED, box['count'] or 0)
+        if places is not None:
+            tags = places.keywords_by_place(crawl_id)
+            for sector_id, place in places.load_crawl(crawl_id):
+                engine.results.add([place], sector_id, tags.get(place['place_id']) or (engine.keyword,))
+        return engine
+
+    @classmethod
+    def refresh(cls, store: CrawlStore, crawl_id: str, api_key: str, max_age: float, places: PlaceStore = None,
+                **kwargs) -> 'CrawlEngine':
+        """
+        Resumes a stored crawl to refresh it: only its leaves older than
+        `max_age` seconds are queried again (see CrawlStore.mark_stale), and
+        the places found are upserted into the crawl's dataset by place_id.
+        """
+        store.mark_stale(crawl_id, max_age)
+        return cls.resume(store, crawl_id, api_key, places=places, **kwargs)
+
+    @classmethod
+    def join(cls, store: CrawlStore, crawl_id: str, api_key: str, worker_id: str, places: PlaceStore = None,
+             **kwargs) -> 'CrawlEngine':
+        """
+        Joins a stored crawl as one of its worker processes. The engine starts
+        empty and leases its boxes from the store as it goes; `kwargs`
+        override the stored crawl params.
+        """
+        info = store.crawl_info(crawl_id)
+        params = dict(info['params'], **kwargs)
+        return cls(api_key, info['keyword'], store=store, crawl_id=crawl_id, places=places, worker_id=worker_id,
+                   **params)
+
+    # --- FRONTIER ---
+    def next_sector_ids(self, count: int = 4) -> range:
+        if self.worker_id is not None:
+            # Other workers number their boxes too: draw from reserved blocks.
+            if len(self._sector_ids) < count:
+                self._sector_ids = self.store.reserve_sector_ids(self.crawl_id, max(count, 256))
+                self.sector_counter = self._sector_ids[-1]
+            ids, self._sector_ids = self._sector_ids[:count], self._sector_ids[count:]
+            return ids
+        first = self.sector_counter + 1
+        self.sector_counter += count
+        return range(first, first + count)
+
+    def seed(self, boxes: list, depths: list = None):
+        """
+        Appends raw (min_lat, min_lng, max_lat, max_lng) boxes to the frontier.
+        `depths` gives the split depth of pre-split boxes (see planner.py).
+        """
+        depths = depths or [0] * len(boxes)
+        with self._lock:
+            for box, depth, sec_id in zip(boxes, depths, self.next_sector_ids(len(boxes))):
+                box_data = tuple(box) + (sec_id, depth, self.all_keywords)
+                if self.lattice is not None: self._hex_seen[self.lattice.key(box, depth)] = self.all_keywords
+                self.queue.push(box_data)
+                self._journal_add(box_data, None)
+        self.checkpoint()
+        self._notify()
+
+    def configure(self, api_key: str = None, keyword: str = None, min_radius: float = None, max_rps: int = None):
+        """Updates crawl parameters; running workers pick them up on their next box."""
+        with self._lock:
+            if api_key is not None: self.api_key = api_key
+            if keyword is not None: self.keyword = self.keywords[0] = keyword
+            if min_radius is not None: self.min_radius = min_radius
+            if max_rps is not None and max_rps != self.max_rps:
+                self.max_rps = max_rps
+                self.limiter.set_target(max_rps)
+
+    # --- LIFECYCLE ---
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def finished(self) -> bool:
+        with self._lock:
+            idle = not self.queue and not self.delayed and self.in_flight == 0
+            return idle and (self.worker_id is None or self._crawl_done)
+
+    def retry_failed(self):
+        """Puts the boxes parked after MAX_BOX_ATTEMPTS failures back in the frontier."""
+        with self._lock:
+            for box in self.failed:
+                self.attempts.pop(box[4], None)
+                self.queue.push(box)
+                self._journal_state(box[4], crawl_store.PENDING)
+            self.failed = []
+        self._notify()
+
+    @property
+    def stepping(self) -> bool:
+        return self._budget is not None
+
+    def start(self, max_boxes: int = None):
+        """
+        Starts the worker pool. With `max_boxes`, the pool stops on its own
+        after dispatching that many boxes (step mode).
+        """
+        with self._lock:
+            self._budget = max_boxes
+            self._stopping = False
+            if self._loop is not None:
+                self._notify_locked()
+                return
+            # Claim the loop before the thread starts so a second start() call
+            # cannot spawn a second engine thread.
+            self._loop, self._wakeup = asyncio.new_event_loop(), None
+            self._thread = threading.Thread(target=self._run_loop, args=(self._loop,), name="crawl-engine", daemon=True)
+            self._thread.start()
+
+    def stop(self, wait: bool = False):
+        """Stops dispatching new boxes. Boxes already in flight still complete."""
+        with self._lock:
+            self._stopping = True
+        self._notify()
+        if wait: self.wait()
+
+    def wait(self, timeout: float = None) -> bool:
+        if self._thread is not None: self._thread.join(timeout)
+        return not self.running
+
+    def snapshot(self, queue_preview: int = 50) -> dict:
+        """Cheap, thread-safe view of the crawl progress for the UI."""
+        with self._lock:
+            return {
+                'queue_len': len(self.queue),
+                'queue_preview': self.queue.peek(queue_preview),
+                'processed': self.processed.view(),
+                'results': self.results.records(),
+                'raw_results': self.results.raw_count,
+                'errors': list(self.errors),
+                'failed': len(self.failed),
+                'total_calls': self.total_calls,
+                'calls_per_place': self.total_calls / len(self.results) if len(self.results) else None,
+                'cache_hits': self.cache_hits,
+                'current_rps': min(self.limiter.rate, self.key_pool.rate) if self.key_pool else self.limiter.rate,
+                'quota_errors': self.limiter.quota_errors + (self.key_pool.quota_errors if self.key_pool else 0),
+                'in_flight': self.in_flight + len(self.delayed),
+                'pending_pages': len(self.delayed),
+                'running': self._thread is not None and self._thread.is_alive(),
+                'crawl_id': self.crawl_id,
+                'keywords': list(self.keywords),
+                'by_keyword': self.results.count_by_keyword(),
+                'skipped_queries': sum(self.model.skipped),
+                'places_written': self.places_written,
+                'metrics': self._metrics_summary(),
+            }
+
+    def _metrics_summary(self) -> dict:
+        return self.metrics.summary({
+            'total_calls': self.total_calls, 'places': len(self.results), 'raw_places': self.results.raw_count,
+            'queue_len': len(self.queue), 'in_flight': self.in_flight, 'pending_pages': len(self.delayed),
+        })
+
+    def metrics_summary(self) -> dict:
+        """Run metrics (see metrics.py), for the run summary file or a Prometheus export."""
+        with self._lock:
+            return self._metrics_summary()
+
+    # --- CHECKPOINTS ---
+    def _journal_add(self, box_data, parent_id, leased: bool = True):
+        if self.store is not None:
+            self._journal.append(('add', box_data[4], box_data[:4], parent_id, box_data[5], box_data[6], leased))
+
+    def _journal_state(self, sector_id, state, count=None):
+        if self.store is not None:
+            self._journal.append(('state', sector_id, state, count, self.attempts.get(sector_id, 0)))
+
+    def checkpoint(self):
+        """
+        Flushes the changes journaled since the previous checkpoint in one
+        transaction. If writing fails, they go back to the front of the
+        journal for the next checkpoint, and the error is raised.
+        """
+        if self.store is None and self.places is None:
+            return
+        with self._checkpoint_lock:
+            with self._lock:
+                ops, self._journal = self._journal, []
+                found, self._new_places = self._new_places, []
+                calls = self.total_calls
+                counters = (self.sector_counter, calls - self._calls_checkpointed)
+            done = False
+            try:
+                # Places first: if the process dies in between, the boxes are
+                # simply crawled again and their places upserted as unchanged.
+                by_keyword = {}
+                for sector_id, keyword, places in found:
+                    by_keyword.setdefault(keyword, []).append((sector_id, places))
+                written = sum(self.places.upsert(batch, keyword, self.crawl_id)
+                              for keyword, batch in by_keyword.items())
+                if written:
+                    with self._lock:
+                        self.places_written += written
+                found = []
+                if ops:
+                    self.store.apply(self.crawl_id, ops, *counters, owner=self.worker_id, ttl=LEASE_TTL)
+                    with self._lock:
+                        self._calls_checkpointed = calls
+                done = True
+            finally:
+                if not done:
+                    # Upserts are idempotent and the ops were not applied:
+                    # both are simply written again next time.
+                    with self._lock:
+                        self._journal[:0] = ops
+                        self._new_places[:0] = found
+            if self.worker_id is not None:
+                self.store.renew(self.crawl_id, self.worker_id, LEASE_TTL)
+
+    async def _checkpointer(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(CHECKPOINT_INTERVAL)
+            with self._lock:
+                rate = min(self.limiter.rate, self.key_pool.rate) if self.key_pool else self.limiter.rate
+                self.metrics.sample(len(self.queue), self.in_flight, len(self.delayed), rate)
+            try:
+                await loop.run_in_executor(None, self.checkpoint)
+            except Exception as e:
+                # e.g. "database is locked" by another process: the journal
+                # was kept, the next checkpoint retries.
+                logger.warning(f"Checkpoint of {self.crawl_id} failed, retrying in {CHECKPOINT_INTERVAL:g} s: {e}")
+
+    # --- WORKERS ---
+    def _notify(self):
+        with self._lock:
+            self._notify_locked()
+
+    def _notify_locked(self):
+        # Wakes idle workers; safe to call from any thread.
+        if self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _run_loop(self, loop):
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self._main(loop))
+        finally:
+            loop.close()
+
+    async def _main(self, loop):
+        with self._lock:
+            self._wakeup = asyncio.Event()
+            api_key = self.api_key
+        try:
+            async with PlacesClient(api_key, max_concurrency=self.max_connections, limiter=self.limiter,
+                                    cache=self.cache, keys=self.key_pool, base_url=self.base_url,
+                                    metrics=self.metrics, fresh_after=self.fresh_after) as client:
+                with self._lock:
+                    # Counters carry over across restarts and resumed crawls.
+                    self._client = client
+                    self._counter_base = (self.total_calls, self.cache_hits)
+                checkpointer = asyncio.ensure_future(self._checkpointer())
+                with self._lock:
+                    burst = min(self.limiter.burst, self.key_pool.burst) if self.key_pool else self.limiter.burst
+                self.metrics.run_started(self.workers, burst)
+                try:
+                    while True:
+                        await asyncio.gather(*(self._worker(client) for _ in range(self.workers)))
+                        with self._lock:
+                            # start() may have handed out a new budget while the
+                            # last workers were returning: keep going if so.
+                            if self._stopping or self._budget == 0 or not self.queue:
+                                self._loop, self._wakeup = None, None
+                                return
+                finally:
+                    self.metrics.run_stopped()
+                    checkpointer.cancel()
+                    try:
+                        self.checkpoint()
+                    except Exception as e:
+                        # Kept in the journal: the next checkpoint() writes it.
+                        logger.error(f"Final checkpoint of {self.crawl_id} failed: {e}")
+                    if self.worker_id is not None: self._release()
+                    if self.fresh_after is not None and self.store is not None:
+                        self._end_refresh()
+        finally:
+            with self._lock:
+                if self._loop is loop:
+                    self._loop, self._wakeup = None, None
+
+    async def _take(self):
+        """
+        Returns the next unit of work: a due page continuation first, then a
+        new box from the frontier. Pending pages are finished even when the
+        engine is stopping, since their boxes were already dispatched. A
+        worker of a shared crawl leases more boxes when its frontier is empty
+        and it holds less than its backlog.
+        """
+        while True:
+            timeout = None
+            lease = False
+            with self._lock:
+                if self.delayed:
+                    timeout = self.delayed[0][0] - time.monotonic()
+                    if timeout <= 0:
+                        self.in_flight += 1
+                        page = heapq.heappop(self.delayed)[2]
+                        self.metrics.observe_page_wait(time.monotonic() - page['delayed_at'])
+                        return page
+                if not (self._stopping or self._budget == 0) and self.queue:
+                    if self._budget is not None: self._budget -= 1
+                    self.in_flight += 1
+                    box = self.queue.pop()
+                    self._journal_state(box[4], crawl_store.IN_FLIGHT)
+                    return box
+                dispatching = not (self._stopping or self._budget == 0)
+                room = self._backlog_locked() - self.in_flight if self.worker_id is not None else 0
+                if room > 0 and dispatching and not self._leasing:
+                    wait = self._next_lease - time.monotonic()
+                    if wait <= 0:
+                        self._leasing = lease = True
+                    elif not self._crawl_done:
+                        timeout = wait if timeout is None else min(timeout, wait)
+                if lease:
+                    pass
+                elif self.in_flight == 0 and not self.delayed and (
+                        self.worker_id is None or self._crawl_done or not dispatching):
+                    # Nothing queued and nobody can produce more work: done.
+                    self._wakeup.set()
+                    return None
+                elif timeout is None and not dispatching:
+                    return None
+                else:
+                    self._wakeup.clear()
+            if lease:
+                await self._lease(min(self.lease_size, room))
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _backlog_locked(self) -> int:
+        rate = min(self.limiter.rate, self.key_pool.rate) if self.key_pool else self.limiter.rate
+        return max(self.lease_size, math.ceil(rate * LEASE_BACKLOG))
+
+    async def _lease(self, count: int):
+        loop = asyncio.get_running_loop()
+        rows, counts = [], {}
+        try:
+            with self._lock:
+                shared = bool(self._journal)
+            if shared:
+                # Children left for the other workers only reach the store at
+                # a checkpoint: write them before asking for more.
+                try:
+                    await loop.run_in_executor(None, self.checkpoint)
+                except Exception as e:
+                    logger.warning(f"Checkpoint of {self.crawl_id} before leasing failed: {e}")
+            rows = await loop.run_in_executor(None, self.store.lease, self.crawl_id, self.worker_id,
+                                              count, LEASE_TTL)
+            if not rows:
+                counts = await loop.run_in_executor(None, self.store.box_counts, self.crawl_id)
+        finally:
+            with self._lock:
+                self._leasing = False
+                for row in rows:
+                    mask = row[6] if row[6] is not None else self.all_keywords
+                    self.queue.push(tuple(row[:6]) + (mask,))
+                    if row[7]: self.attempts[row[4]] = row[7]
+                self._crawl_done = False
+                if not rows:
+                    # Other workers may still split their boxes, or die and
+                    # let their leases expire: ask again in a moment.
+                    self._next_lease = time.monotonic() + LEASE_POLL
+                    self._crawl_done = not counts.get(crawl_store.PENDING) and not counts.get(crawl_store.IN_FLIGHT)
+            self._wakeup.set()
+
+    def _end_refresh(self):
+        # The refresh cutoff only holds until every stale box is done again.
+        try:
+            ended = self.store.end_refresh(self.crawl_id)
+        except Exception as e:
+            logger.warning(f"Could not end the refresh of {self.crawl_id}: {e}")
+            return
+        if ended:
+            with self._lock:
+                self.fresh_after = None
+                if self._client is not None: self._client.fresh_after = None
+
+    def _release(self):
+        # Boxes still queued here go back to the other workers.
+        with self._lock:
+            self.queue = BoxFrontier(self.queue.order)
+        self.store.release(self.crawl_id, self.worker_id)
+
+    async def _worker(self, client: PlacesClient):
+        while True:
+            item = await self._take()
+            if item is None:
+                return
+            start = time.perf_counter()
+            try:
+                with self._lock:
+                    client.api_key = self.api_key
+                    keywords, min_radius = list(self.keywords), self.min_radius
+                if isinstance(item, dict):
+                    res = await process_next_page(item, client)
+                else:
+                    res = await self._query_box(item, client, keywords, min_radius)
+                    self.metrics.observe_box(time.perf_counter() - start)
+                self._handle(res)
+            finally:
+                self.metrics.observe_busy(time.perf_counter() - start)
+                with self._lock:
+                    self.in_flight -= 1
+                self._wakeup.set()
+
+    async def _query_box(self, box_data, client: PlacesClient, keywords: list, min_radius: float) -> dict:
+        """
+        Queries a box for each keyword of its mask. The lead keyword goes
+        first: where it saturates, the keywords expected to saturate too skip
+        the box and go straight to its children.
+        """
+        todo = [i for i in range(len(keywords)) if box_data[6] >> i & 1]
+        results, skipped = [], []
+        if todo and todo[0] == 0:
+            lead = await process_single_box_logic(box_data, client, keywords[0], min_radius, self.lattice)
+            if lead['status'] == 'error':
+                return lead
+            results.append(dict(lead, keyword_index=0))
+            todo = todo[1:]
+            if lead['action'] == "split":
+                with self._lock:
+                    skipped = [i for i in todo if self.model.should_skip(i, box_data[5])]
+                todo = [i for i in todo if i not in skipped]
+        others = await asyncio.gather(*(process_single_box_logic(box_data, client, keywords[i], min_radius, self.lattice)
+                                        for i in todo))
+        for i, res in zip(todo, others):
+            if res['status'] == 'error':
+                # The whole box is retried; the keywords that succeeded come
+                # back from the cache when it is enabled.
+                return res
+            results.append(dict(res, keyword_index=i))
+        return {'status': "ok", 'box_data': box_data, 'results': results, 'skipped': skipped}
+
+    def _handle(self, res: dict):
+        with self._lock:
+            self.total_calls = self._counter_base[0] + self._client.calls
+            self.cache_hits = self._counter_base[1] + self._client.cache_hits
+            if res['status'] == 'error':
+                self._requeue_failed(res)
+            elif 'results' in res:
+                self._handle_box(res)
+            else:
+                self._handle_page(res)
+
+    def _delay(self, page: dict):
+        # The token needs a moment before Google accepts it: park the box in
+        # the delay queue and let the worker move on (cached pages need no wait).
+        now = time.monotonic()
+        ready_at = now + (0 if page['from_cache'] else PAGE_TOKEN_DELAY)
+        page['delayed_at'] = now
+        heapq.heappush(self.delayed, (ready_at, next(self._delay_seq), page))
+
+    def _add_places(self, sector_id: int, keyword: str, places: list):
+        self.results.add(places, sector_id, (keyword,))
+        if self.places is not None: self._new_places.append((sector_id, keyword, places))
+
+    def _handle_box(self, res: dict):
+        box_data, sector_id = res['box_data'], res['box_data'][4]
+        results = res['results']
+        saturated = sum(1 << i for i in res['skipped'])
+        lead_saturated = any(r['keyword_index'] == 0 and r['action'] == "split" for r in results)
+        chains, count, places = 0, 0, []
+        chain_id = next(self._delay_seq)
+        for r in results:
+            if lead_saturated and r['keyword_index']:
+                self.model.observe(r['keyword_index'], box_data[5], r['action'] == "split")
+            if r['action'] == "paginate":
+                self._delay(dict(r, chain_id=chain_id))
+                chains += 1
+                continue
+            # A saturated box is split, but the places it returned are kept:
+            # they were paid for, and the index drops the duplicates.
+            self._add_places(sector_id, r['keyword'], r['places'])
+            count += r['count']
+            places += r['places']
+            if r['action'] == "split": saturated |= 1 << r['keyword_index']
+
+        if saturated:
+            self.attempts.pop(sector_id, None)
+            new_coords = self._split_coords(box_data, places, saturated)
+            depth = box_data[5] + 1
+            # Children are only queried for the keywords that saturated.
+            children = [tuple(coords) + (sec_id, depth, mask)
+                        for (coords, mask), sec_id in zip(new_coords, self.next_sector_ids(len(new_coords)))]
+            # Children are scheduled right away; with the default dfs order
+            # they go to the front and the next idle worker picks them up.
+            # A worker of a shared crawl keeps no more than its backlog,
+            # however many coroutines it runs: the others are left pending
+            # for whichever process is idle first.
+            kept = children
+            if self.worker_id is not None:
+                kept = children[:max(self._backlog_locked() - len(self.queue) - self.in_flight, 0)]
+            self.queue.push_children(kept, [place_density(places, c) for c in kept])
+            self._journal_state(sector_id, crawl_store.SPLIT, count)
+            for i, child in enumerate(children): self._journal_add(child, sector_id, leased=i < len(kept))
+            self.processed.append(box_data, frontier.SPLIT, count)
+            self.metrics.observe_outcome('split', box_data[5])
+        elif chains:
+            # Dense box at the minimum radius: done once all its keywords
+            # are through their pages.
+            self._paginating[sector_id] = [chain_id, chains, count]
+        else:
+            self.attempts.pop(sector_id, None)
+            self._journal_state(sector_id, crawl_store.DONE, count)
+            self.processed.append(box_data, frontier.SAVED, count)
+            self.metrics.observe_outcome('saved', box_data[5])
+
+    def _handle_page(self, res: dict):
+        if res['action'] == "paginate":
+            self._delay(res)
+            return
+        box_data, sector_id = res['box_data'], res['box_data'][4]
+        self._add_places(sector_id, res['keyword'], res['places'])
+        pending = self._paginating.get(sector_id)
+        if pending is None or pending[0] != res['chain_id']:
+            # Another chain of the box failed and the box was requeued.
+            return
+        pending[1] -= 1
+        pending[2] += len(res['places'])
+        if pending[1] == 0:
+            del self._paginating[sector_id]
+            self.attempts.pop(sector_id, None)
+            self._journal_state(sector_id, crawl_store.DONE, pending[2])
+            self.processed.append(box_data, frontier.SAVED, pending[2])
+            self.metrics.observe_outcome('saved', box_data[5])
+
+    def _split_coords(self, box_data, places: list, saturated: int) -> list:
+        """(coords, keywords mask) of the children of a box split for the `saturated` keywords."""
+        if self.lattice is None:
+            return [(coords, saturated) for coords in splitting.split_box(box_data, places, self.split)]
+        # Vertex children shared with a neighbour that split first are
+        # already queued, maybe for other keywords: only the keywords they
+        # were not queued for get a copy.
+        new_coords = []
+        for key, coords in self.lattice.children(box_data[:4], box_data[5]):
+            queued = self._hex_seen.get(key, 0)
+            missing = saturated & ~queued
+            if missing:
+                self._hex_seen[key] = queued | missing
+                new_coords.append((coords, missing))
+        return new_coords
+
+    def _requeue_failed(self, res: dict):
+        box_data = res['box_data']
+        sector_id = box_data[4]
+        self._paginating.pop(sector_id, None)
+        self.errors.append(f"{format_sector_id(sector_id)}: {res['error']}")
+        if res.get('error_status') == 'REQUEST_DENIED':
+            # Bad key or API not enabled: every other box would fail the same way.
+            self.queue.push_front(box_data)
+            self._journal_state(sector_id, crawl_store.PENDING)
+            self._stopping = True
+            return
+        attempts = self.attempts.get(sector_id, 0) + 1
+        # A replay cache miss or an HTTP 4xx will not fix itself by retrying.
+        if attempts >= MAX_BOX_ATTEMPTS or not res.get('retryable', True):
+            self.attempts.pop(sector_id, None)
+            self.failed.append(box_data)
+            self._journal_state(sector_id, crawl_store.FAILED)
+            self.processed.append(box_data, frontier.FAILED)
+            self.metrics.observe_outcome('failed', box_data[5])
+            return
+        self.attempts[sector_id] = attempts
+        # Back of the frontier: give the quota time to recover before retrying.
+        self.queue.push(box_data)
+        self._journal_state(sector_id, crawl_store.PENDING)
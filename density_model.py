@@ -0,0 +1,59 @@
+"""
+Saturation model shared by the keywords of a multi-keyword crawl.
+
+The keywords of one crawl are dense in the same places: where "Restaurants"
+saturates a large box, "Bars" almost always does too. The lead keyword (the
+first one) is queried in every box; for each other keyword and each split
+depth, the model counts how often it saturated the boxes the lead saturated.
+Once that is likely enough, the keyword skips those boxes and goes straight
+to their children, which cover the box anyway: the split call is saved, and
+nothing is missed. Skipping a box the keyword would not have saturated costs
+its children's calls instead of one, so the bar is high.
+
+The estimate depends on the depth: large boxes saturate for every keyword,
+small ones only where the keywords really overlap. One box in EXPLORE of the
+ones that could be skipped is still queried, so the estimate keeps learning.
+"""
+
+# Samples needed at a depth before a keyword skips anything there.
+MIN_SAMPLES = 3
+# Estimated probability (Laplace smoothed) above which a box is skipped.
+SKIP_THRESHOLD = 0.8
+EXPLORE = 10
+
+
+class DensityModel:
+    def __init__(self, n_keywords: int, min_samples: int = MIN_SAMPLES, threshold: float = SKIP_THRESHOLD):
+        self.min_samples = min_samples
+        self.threshold = threshold
+        # (keyword, depth) -> [boxes the lead saturated where the keyword was
+        # queried too, how many of them it saturated as well]. Keyword 0 is the lead.
+        self._counts = {}
+        self._candidates = {}
+        self.skipped = [0] * n_keywords
+
+    def observe(self, keyword: int, depth: int, saturated: bool):
+        """Records whether `keyword` saturated a box the lead saturated."""
+        counts = self._counts.setdefault((keyword, depth), [0, 0])
+        counts[0] += 1
+        counts[1] += bool(saturated)
+
+    def samples(self, keyword: int, depth: int) -> int:
+        return self._counts.get((keyword, depth), (0, 0))[0]
+
+    def probability(self, keyword: int, depth: int) -> float:
+        """P(keyword saturated | lead saturated) at a depth."""
+        samples, saturated = self._counts.get((keyword, depth), (0, 0))
+        return (saturated + 1) / (samples + 2)
+
+    def should_skip(self, keyword: int, depth: int) -> bool:
+        """Whether `keyword` can go straight to the children of a box the lead saturated."""
+        if keyword == 0 or self.samples(keyword, depth) < self.min_samples:
+            return False
+        if self.probability(keyword, depth) < self.threshold:
+            return False
+        n = self._candidates[keyword, depth] = self._candidates.get((keyword, depth), 0) + 1
+        if n % EXPLORE == 0:
+            return False
+        self.skipped[keyword] += 1
+        return True
@@ -0,0 +1,198 @@
+"""
+Compact, array-backed crawl frontier.
+
+Boxes are stored as records of a NumPy structured array: four float64
+coordinates, an int64 sector number, an int32 depth and a uint32 mask of the
+keywords still to query in the box (bit i for keyword i). Nothing per box is a
+Python object until it is popped, and sector labels ("S-000123") are only
+formatted for display.
+
+Scheduling orders:
+  dfs      -- children go to the front (depth-first, keeps locality)
+  bfs      -- children go to the back (breadth-first)
+  densest  -- highest estimated place density first (priority heap)
+All push/pop operations are O(1) amortized (O(log n) for `densest`).
+"""
+import heapq
+import itertools
+
+import numpy as np
+
+BOX_DTYPE = np.dtype([
+    ('min_lat', 'f8'), ('min_lng', 'f8'), ('max_lat', 'f8'), ('max_lng', 'f8'),
+    ('sector', 'i8'), ('depth', 'i4'), ('keywords', 'u4'),
+])
+
+# Keywords a box mask can hold.
+MAX_KEYWORDS = 32
+
+ORDERS = ('dfs', 'bfs', 'densest')
+
+
+class _BoxRing:
+    """Growable ring buffer of BOX_DTYPE records with O(1) push/pop at both ends."""
+
+    def __init__(self, capacity: int = 1024):
+        self._buf = np.zeros(capacity, dtype=BOX_DTYPE)
+        self._head = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _grow(self):
+        cap = len(self._buf)
+        buf = np.zeros(cap * 2, dtype=BOX_DTYPE)
+        idx = (self._head + np.arange(self._size)) % cap
+        buf[:self._size] = self._buf[idx]
+        self._buf, self._head = buf, 0
+
+    def push_back(self, box: tuple):
+        if self._size == len(self._buf): self._grow()
+        self._buf[(self._head + self._size) % len(self._buf)] = box
+        self._size += 1
+
+    def push_front(self, box: tuple):
+        if self._size == len(self._buf): self._grow()
+        self._head = (self._head - 1) % len(self._buf)
+        self._buf[self._head] = box
+        self._size += 1
+
+    def pop_front(self) -> tuple:
+        if not self._size:
+            raise IndexError("pop from an empty frontier")
+        box = self._buf[self._head].item()
+        self._head = (self._head + 1) % len(self._buf)
+        self._size -= 1
+        return box
+
+    def peek(self, n: int) -> list:
+        n = min(n, self._size)
+        idx = (self._head + np.arange(n)) % len(self._buf)
+        return [rec.item() for rec in self._buf[idx]]
+
+
+class _BoxHeap:
+    """Records in a slab with a free-slot stack; a heap orders the slots by priority."""
+
+    def __init__(self, capacity: int = 1024):
+        self._slab = np.zeros(capacity, dtype=BOX_DTYPE)
+        self._free = np.arange(capacity - 1, -1, -1, dtype=np.int64)
+        self._free_top = capacity
+        self._heap = []
+        self._seq = itertools.count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def _grow(self):
+        cap = len(self._slab)
+        self._slab = np.concatenate([self._slab, np.zeros(cap, dtype=BOX_DTYPE)])
+        self._free = np.concatenate([np.arange(2 * cap - 1, cap - 1, -1, dtype=np.int64), self._free])
+        self._free_top = cap
+
+    def push(self, box: tuple, priority: float):
+        if not self._free_top: self._grow()
+        self._free_top -= 1
+        slot = int(self._free[self._free_top])
+        self._slab[slot] = box
+        # heapq is a min-heap: negate so the densest box comes out first
+        heapq.heappush(self._heap, (-priority, next(self._seq), slot))
+
+    def pop(self) -> tuple:
+        _, _, slot = heapq.heappop(self._heap)
+        box = self._slab[slot].item()
+        self._free[self._free_top] = slot
+        self._free_top += 1
+        return box
+
+    def peek(self, n: int) -> list:
+        return [self._slab[slot].item() for _, _, slot in heapq.nsmallest(n, self._heap)]
+
+
+class BoxFrontier:
+    """
+    Frontier of (min_lat, min_lng, max_lat, max_lng, sector, depth, keywords) boxes.
+    `priority` is only used by the `densest` order.
+    """
+
+    def __init__(self, order: str = 'dfs', capacity: int = 1024):
+        if order not in ORDERS:
+            raise ValueError(f"Unknown frontier order: {order} (expected one of {ORDERS})")
+        self.order = order
+        self._store = _BoxHeap(capacity) if order == 'densest' else _BoxRing(capacity)
+
+    def __len__(self):
+        return len(self._store)
+
+    def __bool__(self):
+        return len(self._store) > 0
+
+    def push(self, box: tuple, priority: float = 0.0):
+        """Enqueues a seed or a retried box behind the current work."""
+        if self.order == 'densest':
+            self._store.push(box, priority)
+        else:
+            self._store.push_back(box)
+
+    def push_front(self, box: tuple):
+        """Puts a box back to be picked up first (dfs/bfs) or with top priority (densest)."""
+        if self.order == 'densest':
+            self._store.push(box, float('inf'))
+        else:
+            self._store.push_front(box)
+
+    def push_children(self, boxes: list, priorities: list = None):
+        priorities = priorities or [0.0] * len(boxes)
+        if self.order == 'dfs':
+            # Reversed so the first child is the first one popped.
+            for box in reversed(boxes): self._store.push_front(box)
+        elif self.order == 'bfs':
+            for box in boxes: self._store.push_back(box)
+        else:
+            for box, priority in zip(boxes, priorities): self._store.push(box, priority)
+
+    def pop(self) -> tuple:
+        return self._store.pop() if self.order == 'densest' else self._store.pop_front()
+
+    def peek(self, n: int = 50) -> list:
+        """The next `n` boxes in pop order, for display."""
+        return self._store.peek(n)
+
+
+# --- PROCESSED BOXES ---
+SPLIT, SAVED, FAILED = 0, 1, 2
+
+LOG_DTYPE = np.dtype([
+    ('min_lat', 'f8'), ('min_lng', 'f8'), ('max_lat', 'f8'), ('max_lng', 'f8'),
+    ('sector', 'i8'), ('state', 'i1'), ('count', 'i4'),
+])
+
+
+class BoxLog:
+    """
+    Array-backed log of the boxes the crawl is done with, one row per box:
+    a box done again (re-leased, refreshed) replaces its row.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self._buf = np.zeros(capacity, dtype=LOG_DTYPE)
+        self._size = 0
+        # sector id -> row
+        self._rows = {}
+
+    def __len__(self):
+        return self._size
+
+    def append(self, box: tuple, state: int, count: int = 0):
+        row = self._rows.get(box[4])
+        if row is None:
+            if self._size == len(self._buf):
+                self._buf = np.concatenate([self._buf, np.zeros(max(len(self._buf), 1), dtype=LOG_DTYPE)])
+            row = self._rows[box[4]] = self._size
+            self._size += 1
+        self._buf[row] = box[:5] + (state, count)
+
+    def view(self) -> np.ndarray:
+        """Copy of the filled part, safe to hand to another thread."""
+        return self._buf[:self._size].copy()
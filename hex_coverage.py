@@ -0,0 +1,132 @@
+"""
+Hexagonal coverage geometry.
+
+A square box queried with the circle through its corners pays for 1.57x its
+area; a hexagonal cell queried with its circumscribed circle only for 1.21x,
+so neighbouring queries re-fetch far fewer of the same places.
+
+Cells live on a hierarchy of hexagonal lattices (aperture 3): the cells of
+level L+1 are centred on the centres and the vertices of the level L cells,
+with a radius divided by sqrt(3) and rotated by 30 degrees. A cell is
+covered exactly by its centre child and the six children on its vertices
+(each shared by the three cells meeting there), so refining neighbouring
+cells shares those vertex children instead of querying them twice.
+
+Cells are handed to the rest of the crawler as the bounding box of the
+hexagon, with the level as the box depth: the centre of the box is the
+centre of the cell, and `HexLattice` recovers the cell from both. Positions
+use an equirectangular projection around the lattice origin; query radii are
+widened where that projection shrinks distances.
+"""
+import math
+
+# Metres per degree of latitude
+_M_PER_DEG = 111320.0
+_SQRT3 = math.sqrt(3)
+
+
+class HexLattice:
+    def __init__(self, lat0: float, lng0: float, radius0: float):
+        """
+        lat0, lng0 -- origin of the lattice (the centre of a level 0 cell)
+        radius0    -- circumradius of the level 0 cells, in metres
+        """
+        self.lat0 = float(lat0)
+        self.lng0 = float(lng0)
+        self.radius0 = float(radius0)
+        self._cos0 = math.cos(math.radians(self.lat0))
+
+    def params(self) -> dict:
+        """JSON-able arguments to rebuild the same lattice (stored with the crawl)."""
+        return {'lat0': self.lat0, 'lng0': self.lng0, 'radius0': self.radius0}
+
+    # --- PROJECTION ---
+    def to_xy(self, lat: float, lng: float) -> tuple:
+        return ((lng - self.lng0) * _M_PER_DEG * self._cos0, (lat - self.lat0) * _M_PER_DEG)
+
+    def to_latlng(self, x: float, y: float) -> tuple:
+        return (self.lat0 + y / _M_PER_DEG, self.lng0 + x / (_M_PER_DEG * self._cos0))
+
+    # --- LATTICE ---
+    def cell_radius(self, level: int) -> float:
+        return self.radius0 / _SQRT3 ** level
+
+    def _basis(self, level: int) -> tuple:
+        # Centre spacing is sqrt(3) x the circumradius; each level turns 30 degrees.
+        spacing = _SQRT3 * self.cell_radius(level)
+        theta = math.radians(30 * level)
+        return ((spacing * math.cos(theta), spacing * math.sin(theta)),
+                (spacing * math.cos(theta + math.pi / 3), spacing * math.sin(theta + math.pi / 3)))
+
+    def center(self, level: int, q: int, r: int) -> tuple:
+        (ax, ay), (bx, by) = self._basis(level)
+        return (q * ax + r * bx, q * ay + r * by)
+
+    def cell_at(self, level: int, x: float, y: float) -> tuple:
+        """Lattice coordinates (q, r) of the cell centre nearest to a point known to be a centre."""
+        (ax, ay), (bx, by) = self._basis(level)
+        det = ax * by - ay * bx
+        return (round((x * by - y * bx) / det), round((y * ax - x * ay) / det))
+
+    def cell_box(self, level: int, q: int, r: int) -> tuple:
+        """(min_lat, min_lng, max_lat, max_lng) bounding box of the hexagon."""
+        cx, cy = self.center(level, q, r)
+        radius = self.cell_radius(level)
+        theta = math.radians(30 * level + 30)
+        xs = [cx + radius * math.cos(theta + k * math.pi / 3) for k in range(6)]
+        ys = [cy + radius * math.sin(theta + k * math.pi / 3) for k in range(6)]
+        min_lat, min_lng = self.to_latlng(min(xs), min(ys))
+        max_lat, max_lng = self.to_latlng(max(xs), max(ys))
+        return (min_lat, min_lng, max_lat, max_lng)
+
+    def key(self, box: tuple, level: int) -> tuple:
+        """(level, q, r) of the cell a box was built from."""
+        x, y = self.to_xy((box[0] + box[2]) / 2, (box[1] + box[3]) / 2)
+        return (level,) + self.cell_at(level, x, y)
+
+    # --- QUERIES ---
+    def radius(self, box: tuple, level: int) -> float:
+        """Search radius (metres) of the circle covering the cell."""
+        # Longitude degrees are longer towards the equator than at lat0.
+        if box[0] <= 0 <= box[2]:
+            widest = 1.0
+        else:
+            widest = math.cos(math.radians(min(abs(box[0]), abs(box[2]))))
+        return self.cell_radius(level) * max(1.0, widest / self._cos0) * 1.001
+
+    def cover(self, region: tuple) -> list:
+        """Level 0 cells covering a (min_lat, min_lng, max_lat, max_lng) region."""
+        x1, y1 = self.to_xy(region[0], region[1])
+        x2, y2 = self.to_xy(region[2], region[3])
+        radius = self.radius0
+        # Level 0 hexagons have a vertex up: sqrt(3) R wide, 2 R tall.
+        half_w, half_h = radius * _SQRT3 / 2, radius
+        (ax, _), (bx, by) = self._basis(0)
+        boxes = []
+        for r in range(math.floor((y1 - radius) / by), math.ceil((y2 + radius) / by) + 1):
+            for q in range(math.floor((x1 - radius - r * bx) / ax), math.ceil((x2 + radius - r * bx) / ax) + 1):
+                cx, cy = self.center(0, q, r)
+                if x1 - half_w < cx < x2 + half_w and y1 - half_h < cy < y2 + half_h:
+                    boxes.append(self.cell_box(0, q, r))
+        return boxes
+
+    def children(self, box: tuple, level: int) -> list:
+        """(key, box) of the 7 level+1 cells covering a cell: its centre, then its vertices."""
+        _, q, r = self.key(box, level)
+        # A level L centre in level L+1 coordinates
+        cq, cr = 2 * q + r, r - q
+        offsets = ((0, 0), (1, 0), (0, 1), (-1, 1), (-1, 0), (0, -1), (1, -1))
+        return [((level + 1, cq + dq, cr + dr), self.cell_box(level + 1, cq + dq, cr + dr)) for dq, dr in offsets]
+
+
+def hex_grid(center_lat: float, center_lng: float, n_blocks: int, block_size_km: float = 70.0) -> tuple:
+    """
+    The lattice and level 0 cells covering the same region as
+    utils.get_grid_boxes, with cells about as wide as a block.
+    Returns (lattice, boxes).
+    """
+    lattice = HexLattice(center_lat, center_lng, block_size_km * 1000 / _SQRT3)
+    half_lat = n_blocks * block_size_km / 2 / 111.32
+    half_lng = n_blocks * block_size_km / 2 / (111.32 * math.cos(math.radians(center_lat)))
+    region = (center_lat - half_lat, center_lng - half_lng, center_lat + half_lat, center_lng + half_lng)
+    return lattice, lattice.cover(region)
@@ -0,0 +1,97 @@
+"""
+Pool of Google API keys, each with its own quota.
+
+Every key gets its own AdaptiveTokenBucket: a quota response only slows down
+the key that got it, and the other keys keep their pace. Calls go to the key
+whose bucket has a token first (round robin between ready keys). A key
+Google rejects (REQUEST_DENIED: bad key, API not enabled, billing) is
+disabled and the call is retried on another one.
+"""
+import asyncio
+import itertools
+
+from rate_limiter import AdaptiveTokenBucket
+
+
+class NoUsableKeyError(Exception):
+    """Raised when every key of the pool has been disabled."""
+
+
+class KeyPool:
+    def __init__(self, keys: list, rate_per_key: float, **bucket_kwargs):
+        """
+        keys         -- API keys (duplicates are ignored)
+        rate_per_key -- target calls per second of each key
+        bucket_kwargs are passed to each AdaptiveTokenBucket.
+        """
+        keys = list(dict.fromkeys(k for k in keys if k))
+        if not keys:
+            raise ValueError("KeyPool needs at least one API key")
+        self.rate_per_key = rate_per_key
+        self.bucket_kwargs = bucket_kwargs
+        self.limiters = {key: AdaptiveTokenBucket(rate_per_key, **bucket_kwargs) for key in keys}
+        self.disabled = {}
+        self._turn = itertools.count()
+
+    def __len__(self):
+        return len(self.limiters) - len(self.disabled)
+
+    @property
+    def keys(self) -> list:
+        return [k for k in self.limiters if k not in self.disabled]
+
+    @property
+    def rate(self) -> float:
+        """Current combined rate of the usable keys."""
+        return sum(self.limiters[k].rate for k in self.keys)
+
+    @property
+    def burst(self) -> float:
+        """Calls the usable keys can send at once."""
+        return sum(self.limiters[k].burst for k in self.keys)
+
+    @property
+    def quota_errors(self) -> int:
+        return sum(limiter.quota_errors for limiter in self.limiters.values())
+
+    def shard(self, index: int, count: int) -> 'KeyPool':
+        """
+        The part of the pool process `index` of `count` may use, so that
+        processes sharing the keys stay within each key's quota together:
+        with enough keys each process gets its own, otherwise processes
+        share a key and split its rate (and its burst, if set). The shards
+        keep the pool's bucket settings.
+        """
+        keys = self.keys
+        if len(keys) >= count:
+            return KeyPool(keys[index::count], self.rate_per_key, **self.bucket_kwargs)
+        key = keys[index % len(keys)]
+        sharers = len(range(index % len(keys), count, len(keys)))
+        kwargs = dict(self.bucket_kwargs)
+        if kwargs.get('burst'): kwargs['burst'] = kwargs['burst'] / sharers
+        return KeyPool([key], self.rate_per_key / sharers, **kwargs)
+
+    async def acquire(self) -> str:
+        """Waits for a token on any usable key and returns that key."""
+        while True:
+            keys = self.keys
+            if not keys:
+                raise NoUsableKeyError(f"All {len(self.limiters)} API keys are disabled: {self.disabled}")
+            start = next(self._turn)
+            delays = []
+            for i in range(len(keys)):
+                key = keys[(start + i) % len(keys)]
+                delay = self.limiters[key].try_take()
+                if delay <= 0:
+                    return key
+                delays.append(delay)
+            await asyncio.sleep(min(delays))
+
+    def on_success(self, key: str):
+        self.limiters[key].on_success()
+
+    def on_quota_error(self, key: str):
+        self.limiters[key].on_quota_error()
+
+    def disable(self, key: str, reason: str):
+        self.disabled[key] = reason
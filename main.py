@@ -1,14 +1,23 @@
 import streamlit as st
 import folium
 from streamlit_folium import st_folium
+import os
+import api_log
+import hex_coverage
 import utils
+import map_render
+import planner
+import splitting
 import time
-import math
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import json
+from crawl_store import CrawlStore
+from crawler import CrawlEngine, empty_snapshot
+from frontier import ORDERS
+from metrics import to_prometheus
+from place_store import EXPORT_FORMATS, PlaceStore
+from response_cache import ResponseCache
 
 # --- CONFIGURATION ---
-BLOCK_SIZE_KM = 70.0 
-
 PRESET_ZONES = {
     # Europe
     "Paris, France": (48.8566, 2.3522),
@@ -29,120 +38,93 @@ PRESET_ZONES = {
     "Dubai, UAE": (25.2048, 55.2708),
 }
 
+POPULATION_CSV = "france_population.csv"
+
 st.set_page_config(layout="wide", page_title="Google Place Extractor")
 
 # --- SESSION STATE ---
-if 'queue' not in st.session_state: st.session_state['queue'] = [] 
-if 'processed' not in st.session_state: st.session_state['processed'] = []
-if 'results' not in st.session_state: st.session_state['results'] = []
-if 'total_calls' not in st.session_state: st.session_state['total_calls'] = 0
-if 'sector_counter' not in st.session_state: st.session_state['sector_counter'] = 0
+# The crawl itself lives in a headless CrawlEngine; the page only polls it.
+if 'engine' not in st.session_state: st.session_state['engine'] = None
+if 'cache' not in st.session_state: st.session_state['cache'] = None
+if 'store' not in st.session_state: st.session_state['store'] = CrawlStore()
+if 'places' not in st.session_state: st.session_state['places'] = PlaceStore()
+if 'population' not in st.session_state: st.session_state['population'] = None
+if 'plan_stats' not in st.session_state: st.session_state['plan_stats'] = None
+if 'refreshing' not in st.session_state: st.session_state['refreshing'] = False
+# Map layers are cached between polls and only rebuilt every few of them.
+if 'map_layers' not in st.session_state: st.session_state['map_layers'] = None
+if 'render_tick' not in st.session_state: st.session_state['render_tick'] = 0
+if 'map_view' not in st.session_state: st.session_state['map_view'] = {'zoom': 10, 'bounds': None}
 
 if 'selected_center' not in st.session_state:
     st.session_state['selected_center'] = list(PRESET_ZONES["Paris, France"])
 if 'last_zone_selection' not in st.session_state:
     st.session_state['last_zone_selection'] = "Paris, France"
 
-# --- GEOMETRY HELPERS ---
-def get_grid_boxes(center_lat, center_lng, n_blocks):
-    boxes = []
-    d_lat_deg = BLOCK_SIZE_KM / 111.32
-    d_lng_deg = BLOCK_SIZE_KM / (111.32 * math.cos(math.radians(center_lat)))
-    offset = (n_blocks - 1) / 2.0
-    start_lat = center_lat + (offset * d_lat_deg)
-    start_lng = center_lng - (offset * d_lng_deg)
-    
-    for row in range(n_blocks):
-        for col in range(n_blocks):
-            b_lat = start_lat - (row * d_lat_deg)
-            b_lng = start_lng + (col * d_lng_deg)
-            half_lat = d_lat_deg / 2
-            half_lng = d_lng_deg / 2
-            boxes.append((b_lat - half_lat, b_lng - half_lng, b_lat + half_lat, b_lng + half_lng))
-    return boxes
-
-def reset_search(n_blocks):
-    st.session_state['sector_counter'] = 0
-    st.session_state['queue'] = []
+def get_cache():
+    if st.session_state['cache'] is None:
+        st.session_state['cache'] = ResponseCache()
+    return st.session_state['cache']
+
+def get_population():
+    if st.session_state['population'] is None:
+        st.session_state['population'] = utils.PopulationAnalyzer(POPULATION_CSV)
+    return st.session_state['population']
+
+def reset_search(n_blocks, api_key, keyword, min_radius, max_rps, cache=None, order='dfs', plan=None, split='quadrant',
+                 geometry='square', keywords=None):
+    """
+    `plan`: planner.plan_boxes options to pre-split the grid by population (None: uniform grid).
+    `geometry`: 'square' boxes or 'hex' cells (see hex_coverage.py).
+    `keywords`: other keywords crawled over the same boxes as `keyword`.
+    """
+    old = st.session_state['engine']
+    # Attendre les boîtes en vol : sinon elles seraient rechargées comme à faire
+    if old is not None: old.stop(wait=True)
     lat, lng = st.session_state['selected_center']
-    initial_boxes = get_grid_boxes(lat, lng, n_blocks)
-    
-    for box in initial_boxes:
-        st.session_state['sector_counter'] += 1
-        sec_id = f"S-{st.session_state['sector_counter']:06d}"
-        st.session_state['queue'].append(box + (sec_id,))
-        
-    st.session_state['processed'] = []
-    st.session_state['results'] = []
-    st.session_state['total_calls'] = 0
-
-def get_next_sector_ids(count=4):
-    ids = []
-    for _ in range(count):
-        st.session_state['sector_counter'] += 1
-        ids.append(f"S-{st.session_state['sector_counter']:06d}")
-    return ids
-
-# --- WORKER FUNCTION ---
-def process_single_box_logic(box_data, api_key, keyword, min_radius_limit):
-    min_lat, min_lng, max_lat, max_lng, sector_id = box_data
-    radius = utils.get_box_radius(min_lat, min_lng, max_lat, max_lng)
-    center_lat, center_lng = (min_lat + max_lat) / 2, (min_lng + max_lng) / 2
-    
-    try:
-        places = utils.search_places(api_key, keyword, center_lat, center_lng, radius, max_pages=1)
-        count = len(places)
-        action = "save"
-        if count >= 20 and radius > min_radius_limit: action = "split"
-        elif count >= 20 and radius <= min_radius_limit:
-            places = utils.search_places(api_key, keyword, center_lat, center_lng, radius, max_pages=3)
-            action = "save_dense" 
-        return {"status": "ok", "action": action, "places": places, "box_data": box_data, "radius": radius, "count": count}
-    except Exception as e: return {"status": "error", "error": str(e), "box_data": box_data}
-
-# --- BATCH MANAGER ---
-def run_batch(api_key, keyword, min_radius, max_rps):
-    if not st.session_state['queue']: return False
-    batch_size = max_rps
-    batch_items = [st.session_state['queue'].pop(0) for _ in range(batch_size) if st.session_state['queue']]
-    if not batch_items: return False
-
-    results = []
-    start_time = time.time()
-    with ThreadPoolExecutor(max_workers=batch_size) as executor:
-        future_to_box = {executor.submit(process_single_box_logic, item, api_key, keyword, min_radius): item for item in batch_items}
-        for future in as_completed(future_to_box): results.append(future.result())
-            
-    for res in results:
-        if res['status'] == 'error':
-            st.error(f"Error: {res['error']}")
-            continue
-        action, box_data, sector_id = res['action'], res['box_data'], res['box_data'][4]
-        places, count = res['places'], res['count']
-        
-        st.session_state['total_calls'] += (1 if action != "save_dense" else 3)
-        
-        if action == "split":
-            min_lat, min_lng, max_lat, max_lng = box_data[:4]
-            new_coords = utils.subdivide_box(min_lat, min_lng, max_lat, max_lng)
-            new_ids = get_next_sector_ids(4)
-            new_boxes = [new_coords[i] + (new_ids[i],) for i in range(4)]
-            st.session_state['queue'] = new_boxes + st.session_state['queue']
-            st.session_state['processed'].append({'coords': box_data, 'color': '#ff4b4b', 'status': f"Split {sector_id} ({count}+)"})
-        else: 
-            for p in places: p['source_sector_id'] = sector_id
-            st.session_state['results'].extend(places)
-            st.session_state['processed'].append({'coords': box_data, 'color': '#0df2c9', 'status': f"Saved {sector_id} ({len(places)})"})
-
-    elapsed = time.time() - start_time
-    if elapsed < 1.0: time.sleep(1.0 - elapsed)
-    return True
+    lattice = None
+    if geometry == 'hex':
+        lattice, boxes = hex_coverage.hex_grid(lat, lng, n_blocks, utils.BLOCK_SIZE_KM)
+    else:
+        boxes = utils.get_grid_boxes(lat, lng, n_blocks)
+    engine = CrawlEngine(api_key, keyword, min_radius=min_radius, max_rps=max_rps, cache=cache,
+                         store=st.session_state['store'], order=order, places=st.session_state['places'], split=split,
+                         lattice=lattice.params() if lattice else None, keywords=keywords)
+    depths = None
+    st.session_state['refreshing'] = False
+    st.session_state['plan_stats'] = None
+    if plan is not None:
+        boxes, depths, st.session_state['plan_stats'] = planner.plan_boxes(boxes, get_population(), min_radius=min_radius,
+                                                                           lattice=lattice, **plan)
+    engine.seed(boxes, depths)
+    st.session_state['engine'] = engine
+    st.session_state['map_layers'] = None
+
+def resume_search(crawl_id, api_key, cache=None, max_age=None):
+    old = st.session_state['engine']
+    if old is not None: old.stop(wait=True)
+    if max_age is not None:
+        # Rafraîchissement : seules les zones périmées sont ré-interrogées
+        st.session_state['engine'] = CrawlEngine.refresh(st.session_state['store'], crawl_id, api_key, max_age,
+                                                         cache=cache, places=st.session_state['places'])
+    else:
+        st.session_state['engine'] = CrawlEngine.resume(st.session_state['store'], crawl_id, api_key, cache=cache,
+                                                        places=st.session_state['places'])
+    st.session_state['refreshing'] = max_age is not None
+    st.session_state['map_layers'] = None
+    st.session_state['plan_stats'] = None
 
 # --- SIDEBAR UI ---
+engine = st.session_state['engine']
+snap = engine.snapshot() if engine is not None else empty_snapshot()
+
 with st.sidebar:
     st.title("⚙️ Paramètres")
     api_key = st.text_input("Clé API Google", type="password", value=utils.load_key())
-    keyword = st.text_input("Mot-clé", value="Restaurants")
+    keywords = [k.strip() for k in st.text_input("Mots-clés", value="Restaurants",
+                                                 help="Plusieurs mots-clés séparés par des virgules : une seule exploration, "
+                                                      "le premier guide le découpage des autres").split(",") if k.strip()]
+    keyword, other_keywords = (keywords[0], keywords[1:]) if keywords else ("", [])
     
     st.divider()
     st.subheader("📍 Zone Géographique")
@@ -165,32 +147,125 @@ with st.sidebar:
     st.divider()
     st.subheader("🚀 Vitesse & Grille")
     min_radius = st.number_input("Rayon Min (m)", value=100)
-    limit_rps = st.slider("Requêtes / Seconde", 1, 10, 2)
+    limit_rps = st.slider("Requêtes / Seconde", 1, 50, 2)
     grid_n = st.number_input("Taille Grille (N x 70km)", 1,50, 1)
+    order = st.selectbox("Ordre de parcours", ORDERS, help="dfs : profondeur d'abord · bfs : largeur d'abord · densest : zones les plus denses d'abord")
+    geometry = st.selectbox("Géométrie des zones", ('square', 'hex'), format_func={'square': "Carrés", 'hex': "Hexagones"}.get,
+                            help="Les hexagones recouvrent moins leurs voisins : moins de lieux payés deux fois")
+    split = st.selectbox("Découpage des zones saturées", splitting.STRATEGIES, disabled=geometry == 'hex',
+                         format_func={'quadrant': "Quadrants égaux", 'kd': "Médiane des lieux (k-d)", 'cluster': "Isoler le groupe de lieux"}.get)
+    has_population = os.path.exists(POPULATION_CSV)
+    use_planner = st.checkbox("Pré-découpage selon la population", value=has_population, disabled=not has_population,
+                              help=f"Découpe d'avance les zones denses et ignore les zones vides (nécessite {POPULATION_CSV})")
+    plan = None
+    if use_planner and has_population:
+        plan = {
+            'people_per_place': st.number_input("Habitants par lieu (estimation)", 1, 100000, planner.DEFAULT_PEOPLE_PER_PLACE),
+            'drop_empty': st.checkbox("Ignorer les zones sans population", value=True),
+        }
     
-    csv_name = st.text_input("Nom fichier CSV", value="resultats.csv")
-    if not csv_name.endswith(".csv"): csv_name += ".csv"
-        
-    c1, c2 = st.columns(2)
+    st.divider()
+    st.subheader("🗺️ Carte")
+    place_mode = st.selectbox("Affichage des lieux", map_render.PLACE_MODES, format_func={'clusters': "Groupes", 'heatmap': "Carte de chaleur", 'points': "Points"}.get)
+    render_every = st.number_input("Rafraîchir la carte tous les N lots", 1, 50, 5)
+    follow = st.checkbox("Suivre la progression", value=True)
+
+    st.divider()
+    st.subheader("🗄️ Cache")
+    use_cache = st.checkbox("Cache local des réponses", value=True)
+    cache = get_cache() if use_cache else None
+    if cache is not None:
+        cache.ttl = st.number_input("Validité du cache (jours)", 1, 365, 30) * 86400
+        cache.replay = st.checkbox("Mode hors-ligne (replay)", value=False)
+        if st.button("📥 Importer les journaux d'API"):
+            # The API log directory, and the CSV log of older versions.
+            api_log.default_log().flush(10)
+            logs = [path for path in (api_log.DEFAULT_DIR, 'api_logs.csv') if os.path.exists(path)]
+            if logs:
+                st.success(f"{sum(cache.import_api_logs(path) for path in logs)} réponses importées")
+            else:
+                st.error(f"Aucun journal trouvé ({api_log.DEFAULT_DIR}/, api_logs.csv)")
+        st.caption(f"{len(cache):,} réponses en cache ({cache.size_bytes / 1024 ** 2:.1f} Mo)")
+
+    st.divider()
+    st.subheader("💾 Données")
+    export_name = st.text_input("Fichier d'export", value="resultats.csv", help="Format selon l'extension : .csv, .parquet ou .geojson")
+    if not export_name.lower().endswith(tuple('.' + fmt for fmt in EXPORT_FORMATS)): export_name += ".csv"
+    export_all = st.checkbox("Exporter toutes les recherches", value=False)
+
+    c1, c2, c3 = st.columns(3)
     with c1:
         if st.button("🔄 Réinitialiser"):
-            reset_search(grid_n)
+            reset_search(grid_n, api_key, keyword, min_radius, limit_rps, cache=cache, order=order, plan=plan, split=split,
+                         geometry=geometry, keywords=other_keywords)
             st.rerun()
     with c2:
+        # The engine upserts its places at every checkpoint: saving only
+        # flushes what was found since the last one.
         if st.button("💾 Sauvegarder"):
-             utils.register_full_dataset_to_csv(st.session_state['results'], csv_name)
-             st.success(f"Sauvegardé!")
+            if engine is not None: engine.checkpoint()
+            st.success(f"Sauvegardé! ({len(st.session_state['places']):,} lieux en base)")
+    with c3:
+        if st.button("📤 Exporter"):
+            if engine is not None: engine.checkpoint()
+            crawl_id = None if export_all else snap['crawl_id']
+            n = st.session_state['places'].export(export_name, crawl_id=crawl_id)
+            st.success(f"{n:,} lieux exportés vers {export_name}")
+
+    past_crawls = st.session_state['store'].list_crawls()
+    if past_crawls:
+        with st.expander("⏯️ Reprendre un crawl"):
+            labels = {c['crawl_id']: f"{c['crawl_id']} · {', '.join([c['keyword']] + c['params'].get('keywords', []))} · "
+                                     f"{c['boxes'].get('pending', 0) + c['boxes'].get('in_flight', 0)} en attente"
+                      for c in past_crawls}
+            chosen = st.selectbox("Crawl", list(labels), format_func=labels.get)
+            if st.button("Reprendre"):
+                resume_search(chosen, api_key, cache=cache)
+                st.rerun()
+            max_age_days = st.number_input("Rafraîchir les zones de plus de (jours)", 1, 365, 7)
+            if st.button("🔄 Rafraîchir", help="Ré-interroge seulement les zones périmées et redécoupe celles devenues saturées"):
+                resume_search(chosen, api_key, cache=cache, max_age=max_age_days * 86400)
+                st.rerun()
+
+        # Coût de chaque stratégie de découpage sur les crawls enregistrés
+        found = st.session_state['places'].count_by_crawl()
+        by_split = {}
+        for c in past_crawls:
+            name = 'hex' if c['params'].get('lattice') else c['params'].get('split', 'quadrant')
+            calls, places = by_split.get(name, (0, 0))
+            by_split[name] = (calls + c['total_calls'], places + found.get(c['crawl_id'], 0))
+        with st.expander("📈 Appels par lieu unique"):
+            st.dataframe([{'Découpage': name, 'Appels': calls, 'Lieux uniques': places,
+                           'Appels / lieu': round(calls / places, 3) if places else None}
+                          for name, (calls, places) in by_split.items()], hide_index=True)
 
     st.divider()
-    st.metric("File d'attente", len(st.session_state['queue']))
-    st.metric("Lieux trouvés", len(st.session_state['results']))
-    st.metric("Appels API", st.session_state['total_calls'])
+    if snap['crawl_id']: st.caption(f"Crawl `{snap['crawl_id']}`")
+    plan_stats = st.session_state['plan_stats']
+    if plan_stats and engine is not None:
+        st.caption(f"Planification : {plan_stats['presplit']} découpages anticipés, {plan_stats['dropped']} zones vides ignorées")
+    if st.session_state['refreshing'] and engine is not None:
+        st.caption(f"Rafraîchissement : {snap['places_written']:,} lieux nouveaux ou modifiés en base")
+    st.metric("File d'attente", snap['queue_len'])
+    duplicates = snap['raw_results'] - len(snap['results'])
+    st.metric("Lieux trouvés", len(snap['results']), delta=f"{duplicates} doublons ignorés" if duplicates else None, delta_color="off")
+    st.metric("Appels API", snap['total_calls'], delta=f"{snap['cache_hits']} en cache" if snap['cache_hits'] else None, delta_color="off")
+    if snap['calls_per_place'] is not None: st.caption(f"{snap['calls_per_place']:.3f} appel par lieu unique")
+    if len(snap['keywords']) > 1:
+        st.caption(" · ".join(f"{k} : {snap['by_keyword'].get(k, 0):,}" for k in snap['keywords']) +
+                   (f" — {snap['skipped_queries']} requêtes évitées" if snap['skipped_queries'] else ""))
+    st.metric("Débit actuel (req/s)", f"{snap['current_rps']:.1f}", delta=f"{snap['quota_errors']} quota" if snap['quota_errors'] else None, delta_color="inverse")
+    if snap['failed']:
+        st.warning(f"{snap['failed']} zones en échec")
+        if st.button("🔁 Relancer les échecs"):
+            engine.retry_failed()
+            st.rerun()
 
 # --- MAIN PAGE ---
 st.title("🗺️ Scraper")
 
 # --- MODE SÉLECTION DE ZONE (Avant lancement) ---
-if not st.session_state['queue'] and not st.session_state['processed']:
+if engine is None or (not snap['queue_len'] and not len(snap['processed']) and not snap['in_flight']):
     
     # Zone d'information et toggle
     col_info, col_check = st.columns([3, 1])
@@ -200,7 +275,7 @@ if not st.session_state['queue'] and not st.session_state['processed']:
     m = folium.Map(location=st.session_state['selected_center'], zoom_start=9)
     
     # Grille de prévisualisation
-    preview_boxes = get_grid_boxes(st.session_state['selected_center'][0], st.session_state['selected_center'][1], grid_n)
+    preview_boxes = utils.get_grid_boxes(st.session_state['selected_center'][0], st.session_state['selected_center'][1], grid_n)
     
     # Centre (Marker)
     folium.Marker(
@@ -235,54 +310,91 @@ if not st.session_state['queue'] and not st.session_state['processed']:
 
 # --- MODE RECHERCHE EN COURS ---
 else:
-    if st.session_state['queue']:
-        focus = st.session_state['queue'][0]
+    if snap['queue_preview']:
+        focus = snap['queue_preview'][0]
         start_loc = [(focus[0]+focus[2])/2, (focus[1]+focus[3])/2]
-    elif st.session_state['processed']:
-         last = st.session_state['processed'][-1]['coords']
-         start_loc = [(last[0]+last[2])/2, (last[1]+last[3])/2]
+    elif len(snap['processed']):
+         last = snap['processed'][-1]
+         start_loc = [(last['min_lat']+last['max_lat'])/2, (last['min_lng']+last['max_lng'])/2]
     else:
         start_loc = st.session_state['selected_center']
 
-    m = folium.Map(location=start_loc, zoom_start=10)
+    # Zones traitées, file d'attente et résultats: rebuilt every
+    # `render_every` polls while the engine runs, reused in between. The base
+    # map never changes, so st_folium only swaps the layers.
+    view = st.session_state['map_view']
+    st.session_state['render_tick'] += 1
+    layers = st.session_state['map_layers']
+    if layers is None or not snap['running'] or st.session_state['render_tick'] % render_every == 0:
+        layers = [
+            map_render.coverage_layer(snap['processed'], view['zoom'], view['bounds']),
+            map_render.queue_layer(snap['queue_preview'], highlight=limit_rps),
+            map_render.places_layer(snap['results'], place_mode, view['zoom'], view['bounds']),
+        ]
+        st.session_state['map_layers'] = layers
 
-    # Zones déjà traitées
-    for box in st.session_state['processed']:
-        folium.Rectangle(
-            [[box['coords'][0], box['coords'][1]], [box['coords'][2], box['coords'][3]]],
-            color=box['color'], fill=True, fill_opacity=0.1, weight=1
-        ).add_to(m)
-
-    # File d'attente
-    for i, q_box in enumerate(st.session_state['queue'][:50]):
-        color = "blue" if i < limit_rps else "gray" 
-        folium.Rectangle(
-            [[q_box[0], q_box[1]], [q_box[2], q_box[3]]], 
-            color=color, fill=False, weight=1
-        ).add_to(m)
-
-    # Résultats
-    for p in st.session_state['results']:
-        loc = p.get('geometry', {}).get('location')
-        if loc: folium.CircleMarker([loc['lat'], loc['lng']], radius=2, color="red", fill=True).add_to(m)
-
-    st_folium(m, width=1200, height=600)
+    m = folium.Map(location=st.session_state['selected_center'], zoom_start=10)
+    output = st_folium(m, key="crawl_map", width=1200, height=600, center=start_loc if follow else None,
+                       feature_group_to_add=layers, returned_objects=['zoom', 'bounds'])
+    if output and output.get('zoom') and (output['zoom'], output.get('bounds')) != (view['zoom'], view['bounds']):
+        # Caps and tile sizes depend on the view: redraw for the new one.
+        st.session_state['map_view'] = {'zoom': output['zoom'], 'bounds': output.get('bounds')}
+        st.session_state['map_layers'] = None
+        st.rerun()
 
 # CONTROLS
 st.divider()
+for err in snap['errors'][-3:]: st.error(f"Error: {err}")
+
+metrics = snap['metrics']
+if metrics is not None and metrics['requests']:
+    with st.expander("📊 Métriques du crawl"):
+        m1, m2, m3, m4 = st.columns(4)
+        pct = lambda v: f"{v:.0%}" if v is not None else "–"
+        ms = lambda v: f"{v * 1000:.0f} ms" if v is not None else "–"
+        m1.metric("Workers occupés", pct(metrics['worker_utilisation']))
+        m2.metric("Débit utilisé", pct(metrics['limiter_utilisation']))
+        m3.metric("Doublons", pct(metrics['duplicate_ratio']))
+        m4.metric("Lieux / s", metrics['places_per_second'] or 0)
+        st.caption(f"HTTP p50 {ms(metrics['http_latency']['p50'])} · p99 {ms(metrics['http_latency']['p99'])} — "
+                   f"attente débit p50 {ms(metrics['limiter_wait']['p50'])} · p99 {ms(metrics['limiter_wait']['p99'])} — "
+                   f"attente page p50 {ms(metrics['page_wait']['p50'])} — "
+                   f"zone p50 {ms(metrics['box_latency']['p50'])} · p99 {ms(metrics['box_latency']['p99'])}")
+        g1, g2 = st.columns(2)
+        if metrics['queue']:
+            g1.caption("File d'attente")
+            g1.line_chart({'File': {t: q for t, q, _, _ in metrics['queue']},
+                           'En cours': {t: f for t, _, f, _ in metrics['queue']}})
+        if metrics['depths']:
+            g2.caption("Zones par profondeur de découpage")
+            g2.bar_chart({outcome: {depth: counts.get(outcome, 0) for depth, counts in metrics['depths'].items()}
+                          for outcome in ('split', 'saved', 'failed')})
+        d1, d2 = st.columns(2)
+        d1.download_button("⬇️ Résumé (JSON)", json.dumps(metrics, indent=2), file_name=f"{snap['crawl_id'] or 'crawl'}-metrics.json")
+        d2.download_button("⬇️ Prometheus", to_prometheus(metrics, {'crawl_id': snap['crawl_id']}), file_name=f"{snap['crawl_id'] or 'crawl'}.prom")
+
 c1, c2 = st.columns([1, 4])
-is_empty = len(st.session_state['queue']) == 0
+is_empty = engine is None or (snap['queue_len'] == 0 and snap['in_flight'] == 0)
+
+if engine is not None:
+    engine.configure(api_key=api_key, min_radius=min_radius, max_rps=limit_rps)
 
 with c1:
     if st.button("👟 Pas à Pas (Batch)", disabled=is_empty):
         if api_key:
-            run_batch(api_key, keyword, min_radius, limit_rps)
+            engine.start(max_boxes=limit_rps)
             st.rerun()
 
 with c2:
     run_auto = st.checkbox("▶️ Auto-Run (Turbo)", disabled=is_empty)
 
-if run_auto and not is_empty:
-    if api_key:
-        run_batch(api_key, keyword, min_radius, limit_rps)
-        st.rerun()
\ No newline at end of file
+if engine is not None:
+    if run_auto and not is_empty and api_key:
+        engine.start()
+    elif not run_auto and snap['running'] and not engine.stepping:
+        engine.stop()
+
+    # The engine runs in the background: poll it while it has work in flight.
+    if engine.running:
+        time.sleep(1.0)
+        st.rerun()
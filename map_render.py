@@ -0,0 +1,126 @@
+"""
+Map layers for large crawls.
+
+Drawing one Leaflet object per box and per place stops scaling past a few
+thousand of each. These helpers aggregate before drawing:
+  - finished boxes smaller than a zoom-dependent tile are merged into
+    coverage tiles; larger ones are still drawn as they are,
+  - places are clustered or drawn as a heatmap client-side, or sampled down
+    to a zoom-dependent cap when drawn as points,
+  - only what falls in the current view (plus a margin) is sent.
+The layers are folium FeatureGroups, so st_folium can update them without
+re-rendering the base map.
+"""
+import folium
+import numpy as np
+from folium.plugins import FastMarkerCluster, HeatMap
+
+import frontier
+
+PLACE_MODES = ('clusters', 'heatmap', 'points')
+
+# Above this many boxes in view, small boxes are merged into coverage tiles.
+MAX_BOXES = 1500
+# Cap on places sent to the browser for the clustered and heatmap layers.
+MAX_PLACES = 20000
+
+STATE_COLORS = {
+    frontier.SPLIT: '#ff4b4b',
+    frontier.SAVED: '#0df2c9',
+    frontier.FAILED: '#ffa500',
+}
+
+
+def tile_size(zoom: int) -> float:
+    """Side in degrees of the coverage tiles: about 32 px on screen."""
+    return 360.0 / 2 ** (zoom or 10) / 8
+
+
+def point_cap(zoom: int) -> int:
+    """How many individual markers to draw at a given zoom."""
+    return 500 if (zoom or 10) < 12 else 2000
+
+
+def _in_view(lat, lng, bounds: dict, margin: float = 0.25):
+    """Boolean mask of the points inside the view bounds widened by `margin`."""
+    if not bounds or not bounds.get('_southWest'):
+        return np.ones(len(lat), dtype=bool)
+    south, west = bounds['_southWest']['lat'], bounds['_southWest']['lng']
+    north, east = bounds['_northEast']['lat'], bounds['_northEast']['lng']
+    d_lat, d_lng = (north - south) * margin, (east - west) * margin
+    return (lat >= south - d_lat) & (lat <= north + d_lat) & (lng >= west - d_lng) & (lng <= east + d_lng)
+
+
+def _sample(n: int, cap: int) -> np.ndarray:
+    """Evenly spaced indices keeping at most `cap` of `n` items."""
+    return np.arange(n) if n <= cap else np.linspace(0, n - 1, cap).astype(np.int64)
+
+
+def coverage_layer(processed: np.ndarray, zoom: int = None, bounds: dict = None) -> folium.FeatureGroup:
+    """Processed boxes (a frontier.LOG_DTYPE array), merged into tiles when there are too many."""
+    layer = folium.FeatureGroup(name="Zones traitées")
+    mid_lat = (processed['min_lat'] + processed['max_lat']) / 2
+    mid_lng = (processed['min_lng'] + processed['max_lng']) / 2
+    boxes = processed[_in_view(mid_lat, mid_lng, bounds)]
+
+    if len(boxes) <= MAX_BOXES:
+        for box in boxes.tolist():
+            folium.Rectangle([[box[0], box[1]], [box[2], box[3]]], color=STATE_COLORS[box[5]],
+                             fill=True, fill_opacity=0.1, weight=1).add_to(layer)
+        return layer
+
+    # Split boxes are covered by their children: only leaves count.
+    size = tile_size(zoom)
+    boxes = boxes[boxes['state'] != frontier.SPLIT]
+    large = (boxes['max_lat'] - boxes['min_lat']) >= size
+    while large.sum() > MAX_BOXES:
+        # Zoomed in on many mid-sized boxes: coarser tiles keep the cap.
+        size *= 2
+        large = (boxes['max_lat'] - boxes['min_lat']) >= size
+    for box in boxes[large].tolist():
+        folium.Rectangle([[box[0], box[1]], [box[2], box[3]]], color=STATE_COLORS[box[5]],
+                         fill=True, fill_opacity=0.1, weight=1).add_to(layer)
+
+    small = boxes[~large]
+    rows = np.floor((small['min_lat'] + small['max_lat']) / 2 / size).astype(np.int64)
+    cols = np.floor((small['min_lng'] + small['max_lng']) / 2 / size).astype(np.int64)
+    tiles, inverse = np.unique(np.stack([rows, cols], axis=1), axis=0, return_inverse=True)
+    # A tile shows as failed if any of its boxes failed.
+    failed = np.zeros(len(tiles), dtype=bool)
+    failed[inverse.ravel()[small['state'] == frontier.FAILED]] = True
+    for (row, col), tile_failed in zip(tiles.tolist(), failed.tolist()):
+        color = STATE_COLORS[frontier.FAILED if tile_failed else frontier.SAVED]
+        folium.Rectangle([[row * size, col * size], [(row + 1) * size, (col + 1) * size]], color=color,
+                         fill=True, fill_opacity=0.15, weight=0).add_to(layer)
+    return layer
+
+
+def places_layer(records: list, mode: str = 'clusters', zoom: int = None,
+                 bounds: dict = None) -> folium.FeatureGroup:
+    """Places (PlaceRecord list) as clusters, a heatmap or capped points."""
+    layer = folium.FeatureGroup(name="Lieux")
+    coords = np.array([(p.lat, p.lng) for p in records if p.lat is not None], dtype=np.float64).reshape(-1, 2)
+    coords = coords[_in_view(coords[:, 0], coords[:, 1], bounds)]
+
+    if mode == 'points':
+        for lat, lng in coords[_sample(len(coords), point_cap(zoom))].tolist():
+            folium.CircleMarker([lat, lng], radius=2, color="red", fill=True).add_to(layer)
+        return layer
+
+    data = coords[_sample(len(coords), MAX_PLACES)].tolist()
+    if not data:
+        return layer
+    if mode == 'heatmap':
+        HeatMap(data, radius=8, blur=10, min_opacity=0.3).add_to(layer)
+    else:
+        FastMarkerCluster(data).add_to(layer)
+    return layer
+
+
+def queue_layer(queue_preview: list, highlight: int = 0) -> folium.FeatureGroup:
+    """Next boxes of the frontier; the first `highlight` ones in blue."""
+    layer = folium.FeatureGroup(name="File d'attente")
+    for i, box in enumerate(queue_preview):
+        folium.Rectangle([[box[0], box[1]], [box[2], box[3]]], color="blue" if i < highlight else "gray",
+                         fill=False, weight=1).add_to(layer)
+    return layer
@@ -0,0 +1,246 @@
+"""
+Crawl metrics: where the time and the calls of a crawl go.
+
+The engine and its PlacesClient record, on the hot path, only cheap things:
+an observation in a fixed-bucket histogram or a counter increment. Derived
+figures (utilisation, duplicate ratio, calls per place, quantiles) are
+computed when a summary is asked for:
+  - http_latency     seconds per HTTP request to the Places API
+  - limiter_wait     seconds a request waited for a rate-limiter token
+  - page_wait        seconds a dense box waited for its next page token
+  - box_latency      seconds to query one box (every keyword of its mask)
+  - depths           boxes split / saved / failed at each split depth
+  - queue            (seconds, queued, in flight, pending pages) samples
+  - workers          busy seconds of the worker pool, against its capacity
+  - limiter          requests sent, against what the current rate allowed
+                     (plus the burst the bucket holds when a run starts)
+
+A summary is a plain dict (JSON-ready, the run summary file); `to_prometheus`
+renders it in the Prometheus text exposition format.
+"""
+import bisect
+import collections
+import json
+import threading
+import time
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PAGE_WAIT_BUCKETS = (0.5, 1.0, 2.0, 2.5, 3.0, 5.0, 10.0, 30.0, 60.0)
+
+# Queue samples kept (one per checkpoint interval: about an hour at 2 s).
+QUEUE_SAMPLES = 1800
+
+PROMETHEUS_PREFIX = "places_crawler"
+
+
+class Histogram:
+    """Fixed-bucket histogram; `bounds` are the upper bounds of the buckets."""
+
+    def __init__(self, bounds: tuple):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Estimate, interpolated inside the bucket the quantile falls in."""
+        if not self.count:
+            return None
+        rank, seen = q * self.count, 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lower = self.bounds[i - 1] if i else 0.0
+                if i == len(self.bounds):
+                    return lower
+                return lower + (self.bounds[i] - lower) * (rank - seen) / n
+            seen += n
+        return self.bounds[-1]
+
+    def summary(self) -> dict:
+        cumulative, total = [], 0
+        for bound, n in zip(self.bounds, self.counts):
+            total += n
+            cumulative.append([bound, total])
+        return {'count': self.count, 'sum': round(self.sum, 6),
+                'p50': self.quantile(0.5), 'p90': self.quantile(0.9), 'p99': self.quantile(0.99),
+                'buckets': cumulative}
+
+
+class CrawlMetrics:
+    def __init__(self):
+        # Written from the engine's loop thread, read from the UI thread.
+        self._lock = threading.Lock()
+        self.http_latency = Histogram(LATENCY_BUCKETS)
+        self.limiter_wait = Histogram(LATENCY_BUCKETS)
+        self.page_wait = Histogram(PAGE_WAIT_BUCKETS)
+        self.box_latency = Histogram(LATENCY_BUCKETS)
+        self.http_status = collections.Counter()
+        # (outcome, depth) -> boxes
+        self.depths = collections.Counter()
+        self.queue = collections.deque(maxlen=QUEUE_SAMPLES)
+        self.busy_seconds = 0.0
+        self.run_seconds = 0.0
+        self.worker_capacity = 0.0
+        self.requests = 0
+        self.limiter_capacity = 0.0
+        self._run_started = None
+        self._workers = 0
+        self._last_sample = None
+        self._requests_at_sample = 0
+
+    # --- HOT PATH ---
+    def observe_request(self, seconds: float, status: str):
+        with self._lock:
+            self.http_latency.observe(seconds)
+            self.http_status[status] += 1
+            self.requests += 1
+
+    def observe_limiter_wait(self, seconds: float):
+        with self._lock:
+            self.limiter_wait.observe(seconds)
+
+    def observe_page_wait(self, seconds: float):
+        with self._lock:
+            self.page_wait.observe(seconds)
+
+    def observe_box(self, seconds: float):
+        with self._lock:
+            self.box_latency.observe(seconds)
+
+    def observe_busy(self, seconds: float):
+        """A worker spent `seconds` on a box or a page."""
+        with self._lock:
+            self.busy_seconds += seconds
+
+    def observe_outcome(self, outcome: str, depth: int):
+        with self._lock:
+            self.depths[outcome, depth] += 1
+
+    # --- RUNS AND SAMPLES ---
+    def run_started(self, workers: int, burst: float = 0.0):
+        """`burst`: requests the rate limiter lets through at once when the run starts."""
+        with self._lock:
+            self._run_started = self._last_sample = time.monotonic()
+            self._workers = workers
+            # A full bucket is spent before the rate even applies.
+            self.limiter_capacity += burst
+
+    def run_stopped(self):
+        with self._lock:
+            if self._run_started is None:
+                return
+            elapsed = time.monotonic() - self._run_started
+            self.run_seconds += elapsed
+            self.worker_capacity += elapsed * self._workers
+            self._run_started = None
+
+    def sample(self, queued: int, in_flight: int, pending_pages: int, rate: float):
+        """Queue depth now, and how much of `rate` the requests since the last sample used."""
+        with self._lock:
+            now = time.monotonic()
+            if self._last_sample is not None:
+                self.limiter_capacity += (now - self._last_sample) * rate
+            self._last_sample = now
+            self._requests_at_sample = self.requests
+            self.queue.append((round(self._elapsed(now), 1), queued, in_flight, pending_pages))
+
+    def _elapsed(self, now: float) -> float:
+        return self.run_seconds + (now - self._run_started if self._run_started is not None else 0.0)
+
+    # --- SUMMARY ---
+    def summary(self, totals: dict) -> dict:
+        """
+        Every metric as a JSON-ready dict. `totals` are the engine's counters:
+        total_calls, places, raw_places, queue_len, in_flight, pending_pages.
+        """
+        with self._lock:
+            now = time.monotonic()
+            elapsed = self._elapsed(now)
+            capacity = self.worker_capacity
+            if self._run_started is not None:
+                capacity += (now - self._run_started) * self._workers
+            places, raw = totals['places'], totals['raw_places']
+            depths = {}
+            for (outcome, depth), n in sorted(self.depths.items(), key=lambda item: item[0][1]):
+                depths.setdefault(depth, {})[outcome] = n
+            return dict(
+                totals,
+                elapsed_seconds=round(elapsed, 3),
+                calls_per_place=round(totals['total_calls'] / places, 4) if places else None,
+                duplicate_ratio=round(1 - places / raw, 4) if raw else None,
+                places_per_second=round(places / elapsed, 2) if elapsed else None,
+                requests=self.requests,
+                http_status=dict(self.http_status),
+                worker_utilisation=round(self.busy_seconds / capacity, 4) if capacity else None,
+                worker_idle_seconds=round(max(capacity - self.busy_seconds, 0.0), 3),
+                limiter_utilisation=round(self._requests_at_sample / self.limiter_capacity, 4)
+                if self.limiter_capacity else None,
+                http_latency=self.http_latency.summary(),
+                limiter_wait=self.limiter_wait.summary(),
+                page_wait=self.page_wait.summary(),
+                box_latency=self.box_latency.summary(),
+                depths=depths,
+                queue=list(self.queue),
+            )
+
+
+def write_summary(summary: dict, path: str):
+    """Writes a run summary file (JSON)."""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
+
+
+def to_prometheus(summary: dict, labels: dict = None) -> str:
+    """A summary in the Prometheus text exposition format."""
+    def fmt(**extra) -> str:
+        pairs = dict(labels or {}, **extra)
+        return "{" + ",".join(f'{k}="{v}"' for k, v in pairs.items()) + "}" if pairs else ""
+
+    lines = []
+
+    def scalar(name: str, kind: str, help_text: str, value):
+        if value is None:
+            return
+        lines.extend([f"# HELP {PROMETHEUS_PREFIX}_{name} {help_text}", f"# TYPE {PROMETHEUS_PREFIX}_{name} {kind}",
+                      f"{PROMETHEUS_PREFIX}_{name}{fmt()} {value}"])
+
+    scalar("api_calls_total", "counter", "Billed Places API calls.", summary['total_calls'])
+    scalar("places", "gauge", "Unique places found.", summary['places'])
+    scalar("raw_places", "gauge", "Places returned, duplicates included.", summary['raw_places'])
+    scalar("calls_per_place", "gauge", "Billed calls per unique place.", summary['calls_per_place'])
+    scalar("duplicate_ratio", "gauge", "Share of returned places that were duplicates.", summary['duplicate_ratio'])
+    scalar("queue_depth", "gauge", "Boxes waiting in the frontier.", summary['queue_len'])
+    scalar("in_flight", "gauge", "Boxes and pages being queried.", summary['in_flight'])
+    scalar("pending_pages", "gauge", "Dense boxes waiting for a page token.", summary['pending_pages'])
+    scalar("run_seconds_total", "counter", "Seconds the engine ran.", summary['elapsed_seconds'])
+    scalar("worker_utilisation", "gauge", "Share of worker time spent on boxes.", summary['worker_utilisation'])
+    scalar("worker_idle_seconds_total", "counter", "Worker seconds spent waiting for work.",
+           summary['worker_idle_seconds'])
+    scalar("limiter_utilisation", "gauge", "Requests sent against what the rate limiter allowed.",
+           summary['limiter_utilisation'])
+
+    name = f"{PROMETHEUS_PREFIX}_http_requests_total"
+    lines.extend([f"# HELP {name} HTTP requests to the Places API by status.", f"# TYPE {name} counter"])
+    lines.extend(f"{name}{fmt(status=status)} {n}" for status, n in sorted(summary['http_status'].items()))
+
+    name = f"{PROMETHEUS_PREFIX}_boxes_total"
+    lines.extend([f"# HELP {name} Boxes processed by outcome and split depth.", f"# TYPE {name} counter"])
+    for depth, outcomes in summary['depths'].items():
+        lines.extend(f"{name}{fmt(outcome=outcome, depth=depth)} {n}"
+                     for outcome, n in sorted(outcomes.items()))
+
+    for key, help_text in (('http_latency', "Places API request latency."),
+                           ('limiter_wait', "Time waiting for a rate-limiter token."),
+                           ('page_wait', "Time a dense box waited for its next page."),
+                           ('box_latency', "Time to query one box.")):
+        hist, name = summary[key], f"{PROMETHEUS_PREFIX}_{key}_seconds"
+        lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} histogram"])
+        lines.extend(f"{name}_bucket{fmt(le=bound)} {n}" for bound, n in hist['buckets'])
+        lines.extend([f"{name}_bucket{fmt(le='+Inf')} {hist['count']}",
+                      f"{name}_sum{fmt()} {hist['sum']}", f"{name}_count{fmt()} {hist['count']}"])
+    return "\n".join(lines) + "\n"
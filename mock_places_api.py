@@ -0,0 +1,210 @@
+"""
+Local stand-in for the Places nearby-search endpoint, for offline benchmarks.
+
+Serves /maps/api/place/nearbysearch/json over a fixed set of places, either
+synthetic (clusters over a uniform background) or drawn from a population
+grid (X/Y/Z CSV, one place per `people_per_place` inhabitants). It mimics
+what the crawler depends on:
+  - places within `radius` of `location`, most prominent first, 20 per page
+    and at most 3 pages,
+  - a next_page_token that is only accepted `token_delay` seconds after it
+    was issued (INVALID_REQUEST before, like Google),
+  - injected latency, random OVER_QUERY_LIMIT answers and an optional
+    per-key queries-per-second quota,
+  - REQUEST_DENIED without a key.
+Every place matches every keyword. GET /stats returns the call counters.
+
+  python mock_places_api.py --port 8765 --places 50000
+  PlacesClient(key, base_url="http://127.0.0.1:8765/maps/api/place/nearbysearch/json")
+"""
+import argparse
+import asyncio
+import math
+import random
+import time
+import uuid
+
+import numpy as np
+from aiohttp import web
+
+NEARBY_PATH = "/maps/api/place/nearbysearch/json"
+
+PAGE_SIZE = 20
+MAX_PAGES = 3
+# Metres per degree of latitude
+_M_PER_DEG = 111320.0
+# Issued page tokens are forgotten after this many seconds.
+_TOKEN_TTL = 300.0
+
+
+def synthetic_places(center: tuple, half_size_km: float, count: int = 50000, clusters: int = 40,
+                     background: float = 0.3, seed: int = 0) -> tuple:
+    """
+    (lats, lngs) of `count` places around `center`: a `background` share
+    spread uniformly, the rest in Gaussian clusters of random size (towns).
+    """
+    rng = np.random.default_rng(seed)
+    lat0, lng0 = center
+    d_lat = half_size_km / 111.32
+    d_lng = half_size_km / (111.32 * math.cos(math.radians(lat0)))
+    n_background = int(count * background)
+    centers = rng.uniform([lat0 - d_lat, lng0 - d_lng], [lat0 + d_lat, lng0 + d_lng], (clusters, 2))
+    weights = rng.pareto(1.2, clusters) + 1
+    sizes = rng.multinomial(count - n_background, weights / weights.sum())
+    spreads = rng.uniform(0.005, 0.03, clusters)
+    points = [rng.normal(c, [s, s / math.cos(math.radians(lat0))], (n, 2)) for c, s, n in zip(centers, spreads, sizes)]
+    points.append(rng.uniform([lat0 - d_lat, lng0 - d_lng], [lat0 + d_lat, lng0 + d_lng], (n_background, 2)))
+    points = np.vstack(points)
+    return points[:, 0], points[:, 1]
+
+
+def population_places(csv_path: str, people_per_place: float = 400, jitter: float = 0.001, seed: int = 0) -> tuple:
+    """(lats, lngs) of places drawn from a population grid: Poisson(pop / people_per_place) per cell."""
+    import utils
+    analyzer = utils.PopulationAnalyzer(csv_path)
+    rng = np.random.default_rng(seed)
+    counts = rng.poisson(np.asarray(analyzer.pops, dtype=np.float64) / people_per_place)
+    lats = np.repeat(np.asarray(analyzer.lats, dtype=np.float64), counts)
+    lngs = np.repeat(np.asarray(analyzer.lons, dtype=np.float64), counts)
+    return lats + rng.uniform(-jitter, jitter, len(lats)), lngs + rng.uniform(-jitter, jitter, len(lngs))
+
+
+class MockPlacesAPI:
+    def __init__(self, lats, lngs, token_delay: float = 2.0, latency: float = 0.05, quota_rate: float = 0.0,
+                 qps: float = None, seed: int = 0):
+        """
+        lats, lngs  -- place coordinates; their order is their prominence
+        token_delay -- seconds before a next_page_token is accepted
+        latency     -- median response time in seconds (log-normal)
+        quota_rate  -- share of requests answered OVER_QUERY_LIMIT at random
+        qps         -- queries per second allowed per key (None: unlimited)
+        """
+        lats, lngs = np.asarray(lats, dtype=np.float64), np.asarray(lngs, dtype=np.float64)
+        # Sorted by latitude so a query only scans its latitude band.
+        self._order = np.argsort(lats, kind='stable')
+        self._lats, self._lngs = lats[self._order], lngs[self._order]
+        self._by_rank = np.empty(len(self._order), dtype=np.int64)
+        self._by_rank[self._order] = np.arange(len(self._order))
+        self.token_delay = token_delay
+        self.latency = latency
+        self.quota_rate = quota_rate
+        self.qps = qps
+        self._random = random.Random(seed)
+        self._tokens = {}
+        self._key_windows = {}
+        self.stats = {'requests': 0, 'billed': 0, 'quota_errors': 0, 'early_tokens': 0, 'places': len(lats)}
+
+    def query(self, lat: float, lng: float, radius: float) -> np.ndarray:
+        """Ranks (0 = most prominent) of the places within `radius` metres, most prominent first."""
+        d_lat = radius / _M_PER_DEG
+        lo, hi = np.searchsorted(self._lats, [lat - d_lat, lat + d_lat])
+        dy = (self._lats[lo:hi] - lat) * _M_PER_DEG
+        dx = (self._lngs[lo:hi] - lng) * _M_PER_DEG * math.cos(math.radians(lat))
+        inside = np.flatnonzero(dx * dx + dy * dy <= radius * radius)
+        return np.sort(self._order[lo + inside])
+
+    def _over_quota(self, key: str, now: float) -> bool:
+        if self.quota_rate and self._random.random() < self.quota_rate:
+            return True
+        if self.qps is None:
+            return False
+        # One-second sliding window per key
+        window = [t for t in self._key_windows.get(key, []) if now - t < 1.0]
+        over = len(window) >= self.qps
+        if not over: window.append(now)
+        self._key_windows[key] = window
+        return over
+
+    def page(self, params: dict) -> dict:
+        """The JSON answer to one nearbysearch request."""
+        now = time.monotonic()
+        self.stats['requests'] += 1
+        if not params.get('key'):
+            return {'status': 'REQUEST_DENIED', 'error_message': "The provided API key is invalid.", 'results': []}
+        if self._over_quota(params['key'], now):
+            self.stats['quota_errors'] += 1
+            return {'status': 'OVER_QUERY_LIMIT', 'error_message': "You have exceeded your rate-limit.", 'results': []}
+
+        if params.get('pagetoken'):
+            token = self._tokens.get(params['pagetoken'])
+            if token is None or now < token[2]:
+                if token is not None: self.stats['early_tokens'] += 1
+                return {'status': 'INVALID_REQUEST', 'results': []}
+            ranks, page, _ = token
+        else:
+            try:
+                lat, lng = (float(v) for v in params['location'].split(','))
+                radius = float(params['radius'])
+            except (KeyError, ValueError):
+                return {'status': 'INVALID_REQUEST', 'results': []}
+            ranks, page = self.query(lat, lng, min(radius, 50000.0)), 0
+
+        self.stats['billed'] += 1
+        data = {'status': 'OK' if len(ranks) else 'ZERO_RESULTS',
+                'results': [self._result(int(r)) for r in ranks[page * PAGE_SIZE:(page + 1) * PAGE_SIZE]]}
+        if len(ranks) > (page + 1) * PAGE_SIZE and page + 1 < MAX_PAGES:
+            token = uuid.uuid4().hex
+            self._tokens[token] = (ranks, page + 1, now + self.token_delay)
+            data['next_page_token'] = token
+        if len(self._tokens) > 10000:
+            self._tokens = {k: v for k, v in self._tokens.items() if now - v[2] < _TOKEN_TTL}
+        return data
+
+    def _result(self, rank: int) -> dict:
+        lat, lng = self._coords(rank)
+        return {
+            'place_id': f"mock-{rank}",
+            'name': f"Lieu {rank}",
+            'geometry': {'location': {'lat': lat, 'lng': lng}},
+            'rating': round(3 + (rank * 7919 % 20) / 10, 1),
+            'user_ratings_total': int(1000 / (1 + rank % 500)),
+            'types': ['point_of_interest', 'establishment'],
+            'vicinity': f"{rank} rue de l'Exemple",
+        }
+
+    def _coords(self, rank: int) -> tuple:
+        i = self._by_rank[rank]
+        return float(self._lats[i]), float(self._lngs[i])
+
+    # --- HTTP ---
+    async def handle_nearby(self, request: web.Request) -> web.Response:
+        if self.latency:
+            await asyncio.sleep(self._random.lognormvariate(math.log(self.latency), 0.5))
+        return web.json_response(self.page(dict(request.query)))
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats)
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get(NEARBY_PATH, self.handle_nearby)
+        app.router.add_get("/stats", self.handle_stats)
+        return app
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description="Local stand-in for the Places nearby-search endpoint")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--center", default="48.8566,2.3522", help="lat,lng of the synthetic dataset")
+    parser.add_argument("--size-km", type=float, default=70, help="side of the synthetic dataset")
+    parser.add_argument("--places", type=int, default=50000, help="synthetic places")
+    parser.add_argument("--population", help="population CSV (X/Y/Z) to draw the places from instead")
+    parser.add_argument("--people-per-place", type=float, default=400)
+    parser.add_argument("--token-delay", type=float, default=2.0)
+    parser.add_argument("--latency", type=float, default=0.05, help="median response time (s)")
+    parser.add_argument("--quota-rate", type=float, default=0.0, help="share of random OVER_QUERY_LIMIT")
+    parser.add_argument("--qps", type=float, help="queries per second allowed per key")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.population:
+        lats, lngs = population_places(args.population, args.people_per_place, seed=args.seed)
+    else:
+        center = tuple(float(v) for v in args.center.split(","))
+        lats, lngs = synthetic_places(center, args.size_km / 2, args.places, seed=args.seed)
+    api = MockPlacesAPI(lats, lngs, args.token_delay, args.latency, args.quota_rate, args.qps, args.seed)
+    web.run_app(api.app(), host="127.0.0.1", port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
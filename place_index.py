@@ -0,0 +1,91 @@
+"""
+In-memory index of the places found, deduplicated on ingest.
+
+Search circles cover the corners of their box, so neighbouring boxes return
+many of the same places. Each place is kept once, keyed by place_id, as a
+compact record: the fields the UI needs plus the full Google payload stored
+compressed and only decoded when `raw` is read. A place found again replaces
+the previous copy (the freshest one wins) and keeps the keywords it was
+found with.
+"""
+import json
+import zlib
+
+
+class PlaceRecord:
+    __slots__ = ('place_id', 'name', 'lat', 'lng', 'rating', 'user_ratings_total', 'sector_id', 'keywords',
+                 '_payload')
+
+    def __init__(self, place: dict, sector_id: int = None, keywords: tuple = ()):
+        loc = place.get('geometry', {}).get('location', {})
+        self.place_id = place.get('place_id')
+        self.name = place.get('name')
+        self.lat = loc.get('lat')
+        self.lng = loc.get('lng')
+        self.rating = place.get('rating')
+        self.user_ratings_total = place.get('user_ratings_total')
+        self.sector_id = sector_id
+        self.keywords = tuple(keywords)
+        self._payload = zlib.compress(json.dumps(place, separators=(',', ':')).encode('utf-8'))
+
+    @property
+    def raw(self) -> dict:
+        """The place as returned by Google (decoded on each access)."""
+        return json.loads(zlib.decompress(self._payload))
+
+    def __repr__(self):
+        return f"PlaceRecord({self.place_id!r}, {self.name!r})"
+
+
+class PlaceIndex:
+    def __init__(self):
+        self._records = {}
+        # Every place received, duplicates included
+        self.raw_count = 0
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, place_id: str) -> bool:
+        return place_id in self._records
+
+    def __iter__(self):
+        return iter(self._records.values())
+
+    def get(self, place_id: str) -> PlaceRecord:
+        return self._records.get(place_id)
+
+    def add(self, places: list, sector_id: int = None, keywords: tuple = ()) -> int:
+        """
+        Ingests a batch of place dicts found with `keywords` and returns how
+        many were new.
+        """
+        new = 0
+        for p in places:
+            place_id = p.get('place_id')
+            if not place_id:
+                continue
+            self.raw_count += 1
+            old = self._records.get(place_id)
+            if old is None:
+                new += 1
+                tags = keywords
+            else:
+                tags = old.keywords + tuple(k for k in keywords if k not in old.keywords)
+            self._records[place_id] = PlaceRecord(p, sector_id, tags)
+        return new
+
+    @property
+    def duplicates(self) -> int:
+        return self.raw_count - len(self._records)
+
+    def records(self) -> list:
+        return list(self._records.values())
+
+    def count_by_keyword(self) -> dict:
+        """Unique places found with each keyword (a place can count for several)."""
+        counts = {}
+        for record in self._records.values():
+            for keyword in record.keywords:
+                counts[keyword] = counts.get(keyword, 0) + 1
+        return counts
@@ -0,0 +1,204 @@
+"""
+Incremental store of the places found, keyed by place_id.
+
+Places are upserted in SQLite: a row is only written when the place is new or
+its content hash changed, so flushing a batch costs the size of the batch,
+not of the dataset. The crawler flushes at each checkpoint; CSV, Parquet and
+GeoJSON files are only produced on demand by `export`.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+from loguru import logger
+
+EXPORT_FORMATS = ('csv', 'parquet', 'geojson')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS places (
+    place_id   TEXT    PRIMARY KEY,
+    name       TEXT,
+    lat        REAL,
+    lng        REAL,
+    keyword    TEXT,
+    hash       INTEGER NOT NULL,
+    payload    TEXT    NOT NULL,
+    first_seen REAL    NOT NULL,
+    updated_at REAL    NOT NULL
+);
+CREATE TABLE IF NOT EXISTS crawl_places (
+    crawl_id  TEXT    NOT NULL,
+    place_id  TEXT    NOT NULL,
+    sector_id INTEGER NOT NULL,
+    PRIMARY KEY (crawl_id, place_id)
+);
+CREATE TABLE IF NOT EXISTS crawl_keywords (
+    crawl_id TEXT NOT NULL,
+    place_id TEXT NOT NULL,
+    keyword  TEXT NOT NULL,
+    PRIMARY KEY (crawl_id, place_id, keyword)
+);
+"""
+
+_UPSERT = """
+INSERT INTO places (place_id, name, lat, lng, keyword, hash, payload, first_seen, updated_at)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (place_id) DO UPDATE SET
+    name=excluded.name, lat=excluded.lat, lng=excluded.lng, keyword=excluded.keyword,
+    hash=excluded.hash, payload=excluded.payload, updated_at=excluded.updated_at
+WHERE places.hash != excluded.hash
+"""
+
+
+def _payload(place: dict) -> str:
+    # The sector is crawl bookkeeping, kept in crawl_places: finding the same
+    # place from a neighbouring box must not count as a change.
+    return json.dumps({k: v for k, v in place.items() if k != 'source_sector_id'},
+                      sort_keys=True, separators=(',', ':'))
+
+
+def _hash(payload: str) -> int:
+    return int.from_bytes(hashlib.blake2b(payload.encode('utf-8'), digest_size=8).digest(), 'big', signed=True)
+
+
+class PlaceStore:
+    def __init__(self, path: str = "places.sqlite"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM places").fetchone()[0]
+
+    def upsert(self, found: list, keyword: str = None, crawl_id: str = None) -> int:
+        """
+        Writes a batch of (sector_id, [place dicts]) in one transaction and
+        returns how many place rows were inserted or changed. With a
+        `crawl_id`, the places are linked to the crawl and tagged with
+        `keyword` (a place can be tagged with several keywords).
+        """
+        now = time.time()
+        rows, links, tags = [], [], []
+        for sector_id, places in found:
+            for p in places:
+                place_id = p.get('place_id')
+                if not place_id:
+                    continue
+                payload = _payload(p)
+                loc = p.get('geometry', {}).get('location', {})
+                rows.append((place_id, p.get('name'), loc.get('lat'), loc.get('lng'), keyword,
+                             _hash(payload), payload, now, now))
+                if crawl_id is not None: links.append((crawl_id, place_id, sector_id))
+                if crawl_id is not None and keyword is not None: tags.append((crawl_id, place_id, keyword))
+
+        with self._lock, self._conn:
+            before = self._conn.total_changes
+            self._conn.executemany(_UPSERT, rows)
+            written = self._conn.total_changes - before
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO crawl_places (crawl_id, place_id, sector_id) VALUES (?, ?, ?)", links)
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO crawl_keywords (crawl_id, place_id, keyword) VALUES (?, ?, ?)", tags)
+        return written
+
+    def count_by_crawl(self) -> dict:
+        """Number of unique places found by each crawl."""
+        with self._lock:
+            return dict(self._conn.execute("SELECT crawl_id, COUNT(*) FROM crawl_places GROUP BY crawl_id"))
+
+    def load_crawl(self, crawl_id: str) -> list:
+        """Returns the (sector_id, place dict) pairs found by a crawl, in discovery order."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT c.sector_id, p.payload FROM crawl_places c JOIN places p USING (place_id) "
+                "WHERE c.crawl_id=? ORDER BY c.rowid", (crawl_id,)).fetchall()
+        return [(sector_id, json.loads(payload)) for sector_id, payload in rows]
+
+    def keywords_by_place(self, crawl_id: str) -> dict:
+        """place_id -> keywords it was found with in a crawl."""
+        with self._lock:
+            rows = self._conn.execute("SELECT place_id, keyword FROM crawl_keywords WHERE crawl_id=? ORDER BY rowid",
+                                      (crawl_id,)).fetchall()
+        tags = {}
+        for place_id, keyword in rows:
+            tags.setdefault(place_id, []).append(keyword)
+        return tags
+
+    # --- EXPORT ---
+    def _iter_places(self, crawl_id: str = None, keyword: str = None):
+        # Keyword tags of the crawl (of every crawl without one); places
+        # stored before tagging fall back to the keyword of their last write.
+        scope = " AND k.crawl_id=?" if crawl_id is not None else ""
+        query = ("SELECT p.payload, p.keyword, (SELECT GROUP_CONCAT(keyword, '|') FROM (SELECT DISTINCT k.keyword "
+                 f"FROM crawl_keywords k WHERE k.place_id=p.place_id{scope})) FROM places p")
+        params = [crawl_id] if crawl_id is not None else []
+        where = []
+        if crawl_id is not None:
+            query += " JOIN crawl_places c USING (place_id)"
+            where.append("c.crawl_id=?")
+            params.append(crawl_id)
+        if keyword is not None:
+            where.append(f"COALESCE((SELECT MAX(k.keyword=?) FROM crawl_keywords k WHERE k.place_id=p.place_id{scope}), "
+                         "p.keyword=?)")
+            params += [keyword] + ([crawl_id] if crawl_id is not None else []) + [keyword]
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY p.first_seen", params).fetchall()
+        for payload, last_keyword, tags in rows:
+            place = json.loads(payload)
+            place['search_keywords'] = tags.split('|') if tags else [last_keyword]
+            yield place
+
+    def export(self, filename: str, fmt: str = None, crawl_id: str = None, keyword: str = None) -> int:
+        """
+        Writes the stored places to `filename` and returns how many were written.
+        The format (csv, parquet or geojson) defaults to the file extension;
+        `crawl_id` and `keyword` restrict the export.
+        """
+        fmt = (fmt or os.path.splitext(filename)[1].lstrip('.')).lower()
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format: {fmt} (expected one of {EXPORT_FORMATS})")
+        places = self._iter_places(crawl_id, keyword)
+
+        if fmt == 'geojson':
+            count = 0
+            with open(filename, 'w', encoding='utf-8') as f:
+                f.write('{"type": "FeatureCollection", "features": [\n')
+                for p in places:
+                    loc = p.get('geometry', {}).get('location')
+                    if not loc:
+                        continue
+                    feature = {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [loc['lng'], loc['lat']]},
+                               'properties': {k: v for k, v in p.items() if k != 'geometry'}}
+                    f.write((',\n' if count else '') + json.dumps(feature, ensure_ascii=False))
+                    count += 1
+                f.write('\n]}\n')
+        else:
+            # Same flattening as the CSV saves: nested dicts become dotted
+            # columns (geometry.location.lat, ...), lists stay as values.
+            df = pd.json_normalize(list(places))
+            count = len(df)
+            if fmt == 'csv':
+                df.to_csv(filename, index=False, encoding='utf-8')
+            else:
+                # Parquet needs one type per column: keep lists as JSON text.
+                for col in df.columns[df.dtypes == object]:
+                    if df[col].map(lambda v: isinstance(v, (list, dict))).any():
+                        df[col] = df[col].map(lambda v: json.dumps(v) if isinstance(v, (list, dict)) else v)
+                df.to_parquet(filename, index=False)
+
+        logger.info(f"Place store: exported {count} places to {filename}")
+        return count
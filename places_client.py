@@ -0,0 +1,238 @@
+"""
+Async HTTP client for the Places nearby-search endpoint.
+
+One aiohttp session is shared by every call of a client, so the TCP+TLS
+connection to maps.googleapis.com is kept alive and reused instead of being
+re-established for each page. A semaphore caps the number of requests in
+flight, every request has its own timeout, and transient failures are retried
+with exponential backoff and full jitter.
+
+When a rate limiter is attached, every HTTP request (pagination pages and
+retries included) takes a token first, and quota responses are reported back
+to it so the whole crawl slows down together. With a KeyPool attached, each
+request also waits for a token of one of the pool's keys and is sent with
+that key; quota responses only slow that key down. With CrawlMetrics
+attached, the time spent waiting for a token and on each request is recorded.
+
+With a ResponseCache attached, pages are served from disk when possible and
+successful live responses are stored for the next run. Its SQLite work runs
+in the loop's default executor, never on the loop itself.
+"""
+import asyncio
+import random
+import time
+
+import aiohttp
+from loguru import logger
+
+import utils
+from key_pool import KeyPool, NoUsableKeyError
+from metrics import CrawlMetrics
+from rate_limiter import AdaptiveTokenBucket
+from response_cache import ResponseCache
+
+NEARBY_SEARCH_URL = "https://maps.googleapis.com/maps/api/place/nearbysearch/json"
+
+# Google needs a moment to generate the next page behind a next_page_token.
+PAGE_TOKEN_DELAY = 2.0
+
+# Statuses worth retrying: the same request may succeed a moment later. Any
+# other HTTP error (4xx) fails at once.
+RETRYABLE_STATUSES = {'UNKNOWN_ERROR'}
+RETRYABLE_HTTP = range(500, 600)
+QUOTA_STATUSES = {'OVER_QUERY_LIMIT'}
+QUOTA_HTTP = {429}
+
+
+class PlacesAPIError(Exception):
+    """
+    Raised when a nearby-search call fails for good (after retries).
+    `retryable` is False when asking again later cannot help.
+    """
+
+    def __init__(self, message: str, status: str = None, retryable: bool = True):
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+
+
+class QuotaExceededError(PlacesAPIError):
+    """Raised when Google keeps answering OVER_QUERY_LIMIT / HTTP 429."""
+
+
+class CacheMissError(PlacesAPIError):
+    """Raised in replay mode when a response is not in the cache."""
+
+    def __init__(self, message: str):
+        super().__init__(message, status='CACHE_MISS', retryable=False)
+
+
+class PlacesClient:
+    """
+    Pooled async client. Use it as an async context manager, or call `close()`
+    once done, so the underlying connections are released.
+    """
+
+    def __init__(self, api_key: str, max_concurrency: int = 32, timeout: float = 10.0,
+                 retries: int = 3, backoff: float = 0.5, base_url: str = NEARBY_SEARCH_URL,
+                 limiter: AdaptiveTokenBucket = None, cache: ResponseCache = None, keys: KeyPool = None,
+                 metrics: CrawlMetrics = None, fresh_after: float = None):
+        self.api_key = api_key
+        self.keys = keys
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.base_url = base_url
+        self.limiter = limiter
+        self.cache = cache
+        self.metrics = metrics
+        # Cached responses fetched before this time (epoch seconds) are ignored.
+        self.fresh_after = fresh_after
+        # Billed requests (OK / ZERO_RESULTS), every request sent, cache hits
+        self.calls = 0
+        self.requests_sent = 0
+        self.cache_hits = 0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._session = None
+
+    async def __aenter__(self):
+        self._get_session()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=60, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        if self.cache is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self.cache.flush)
+
+    def _retry_delay(self, attempt: int) -> float:
+        # Full jitter: uniform in [0, backoff * 2^attempt]
+        return random.uniform(0, self.backoff * (2 ** attempt))
+
+    async def cached_page(self, keyword: str, lat: float, lng: float, radius: float, page: int = 0) -> dict:
+        """
+        Returns page `page` of a query from the cache, or None. Cached
+        responses carry `from_cache: True`: their next_page_token is stale,
+        so following pages must also come from the cache.
+        """
+        if self.cache is None:
+            return None
+        data = await asyncio.get_running_loop().run_in_executor(
+            None, self.cache.get, keyword, lat, lng, radius, page, self.fresh_after)
+        if data is None:
+            if self.cache.replay:
+                raise CacheMissError(f"Not in cache: {keyword} {lat},{lng} r={radius} page {page}")
+            return None
+        self.cache_hits += 1
+        data['from_cache'] = True
+        return data
+
+    async def fetch_page(self, keyword: str, lat: float, lng: float, radius: float, pagetoken: str = None,
+                         page: int = 0, use_cache: bool = True) -> dict:
+        """
+        Fetches a single page of results and returns the decoded JSON response.
+        `page` is the index of the page behind `pagetoken`, used as cache key.
+        Raises PlacesAPIError if the call still fails after `retries` attempts.
+        """
+        if use_cache:
+            data = await self.cached_page(keyword, lat, lng, radius, page)
+            if data is not None:
+                return data
+
+        params = {
+            'key': self.api_key,
+            'location': f"{lat},{lng}",
+            'radius': radius,
+            'keyword': keyword
+        }
+        if pagetoken:
+            params['pagetoken'] = pagetoken
+
+        last_error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(self._retry_delay(attempt))
+            waited = time.perf_counter()
+            if self.limiter is not None:
+                await self.limiter.acquire()
+            key = self.api_key
+            if self.keys is not None:
+                try:
+                    key = await self.keys.acquire()
+                except NoUsableKeyError as e:
+                    raise PlacesAPIError(str(e), status='REQUEST_DENIED')
+            params['key'] = key
+            sent = time.perf_counter()
+            if self.metrics is not None: self.metrics.observe_limiter_wait(sent - waited)
+            try:
+                async with self._semaphore:
+                    self.requests_sent += 1
+                    async with self._get_session().get(self.base_url, params=params) as response:
+                        if response.status in QUOTA_HTTP:
+                            self._observe(sent, str(response.status))
+                            last_error = self._quota_error(f"HTTP {response.status}", str(response.status), key)
+                            continue
+                        if response.status in RETRYABLE_HTTP:
+                            self._observe(sent, str(response.status))
+                            last_error = PlacesAPIError(f"HTTP {response.status}", status=str(response.status))
+                            continue
+                        if response.status >= 400:
+                            # Any other 4xx: the same request will fail the same way.
+                            self._observe(sent, str(response.status))
+                            raise PlacesAPIError(f"HTTP {response.status} {response.reason}",
+                                                 status=str(response.status), retryable=False)
+                        data = await response.json(content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self._observe(sent, type(e).__name__)
+                last_error = PlacesAPIError(f"{type(e).__name__}: {e}")
+                continue
+
+            status = data.get('status', 'OK')
+            self._observe(sent, status)
+            if status in ('OK', 'ZERO_RESULTS'):
+                self.calls += 1
+                if self.limiter is not None: self.limiter.on_success()
+                if self.keys is not None: self.keys.on_success(key)
+                utils.log_api_call(keyword, lat, lng, radius, response=data, page=page)
+                if self.cache is not None:
+                    await asyncio.get_running_loop().run_in_executor(
+                        None, self.cache.put, keyword, lat, lng, radius, page, data)
+                return data
+            if status in QUOTA_STATUSES:
+                last_error = self._quota_error(f"{status}: {data.get('error_message', '')}", status, key)
+                continue
+            if status == 'REQUEST_DENIED' and self.keys is not None:
+                # This key is unusable; the next attempt picks another one.
+                self.keys.disable(key, data.get('error_message', status))
+                last_error = PlacesAPIError(f"{status}: {data.get('error_message', '')}", status=status)
+                continue
+            # A page token that is not ready yet comes back as INVALID_REQUEST.
+            if status in RETRYABLE_STATUSES or (pagetoken and status == 'INVALID_REQUEST'):
+                last_error = PlacesAPIError(f"{status}: {data.get('error_message', '')}", status=status)
+                continue
+            raise PlacesAPIError(f"{status}: {data.get('error_message', '')}", status=status)
+
+        logger.error(f"API call failed after {self.retries + 1} attempts: {last_error}")
+        raise last_error
+
+    def _observe(self, sent: float, status: str):
+        if self.metrics is not None: self.metrics.observe_request(time.perf_counter() - sent, status)
+
+    def _quota_error(self, message: str, status: str, key: str = None) -> QuotaExceededError:
+        # With a key pool the quota is per key: only that key slows down.
+        if self.keys is not None and key is not None:
+            self.keys.on_quota_error(key)
+        elif self.limiter is not None:
+            self.limiter.on_quota_error()
+        return QuotaExceededError(message, status=status)
@@ -0,0 +1,84 @@
+"""
+Population-guided planning of the initial grid.
+
+A uniform grid of 70 km blocks makes every dense block pay for several
+split-only calls (20 results, split, repeat) before its boxes get small
+enough, and still queries empty blocks. The planner scores the grid with
+PopulationAnalyzer and, level by level, subdivides the blocks whose
+predicted number of places would saturate a query, and drops the cells whose
+population points all count 0 inhabitants, so the crawl starts close to the
+right resolution.
+
+Places are predicted from population with a single ratio (inhabitants per
+place for the keyword), so a block is only pre-split when the prediction is
+well above the saturation point; the crawler still splits whatever the
+planner under-estimated.
+"""
+import numpy as np
+
+import utils
+
+# A query saturates at 20 results (one page).
+SATURATION = 20
+# Order of magnitude for restaurants in France (~1 per 400 inhabitants).
+DEFAULT_PEOPLE_PER_PLACE = 400
+
+
+def plan_boxes(boxes: list, analyzer: 'utils.PopulationAnalyzer', people_per_place: float = DEFAULT_PEOPLE_PER_PLACE,
+               min_radius: float = 100, max_depth: int = 6, margin: float = 2.0, drop_empty: bool = True,
+               lattice: 'hex_coverage.HexLattice' = None):
+    """
+    Pre-splits and prunes (min_lat, min_lng, max_lat, max_lng) seed boxes.
+
+    A box is subdivided while its predicted place count exceeds
+    `margin` x SATURATION, its children stay above `min_radius` and it is
+    less than `max_depth` levels deep. With `drop_empty`, boxes within the
+    data whose population points sum to 0 are dropped. Boxes without any
+    point (outside the data, or inside its bounding box where it has no rows,
+    e.g. across a border) are kept as they are: no data is not the same as
+    nobody. With a `lattice`, the boxes are level 0 hexagonal cells and are
+    refined on it.
+
+    Returns (boxes, depths, stats), where stats counts the seeds, the
+    dropped cells and the pre-split boxes (each one a split call saved).
+    """
+    south, west, north, east = analyzer.bounds
+    planned, depths = [], []
+    stats = {'seeds': len(boxes), 'dropped': 0, 'presplit': 0, 'uncovered': 0}
+
+    level = [tuple(b) for b in boxes]
+    seen = set()
+    for depth in range(max_depth + 1):
+        if not level:
+            break
+        arr = np.asarray(level, dtype=np.float64)
+        within = (arr[:, 0] >= south) & (arr[:, 1] >= west) & (arr[:, 2] <= north) & (arr[:, 3] <= east)
+        pops, points = analyzer.get_population_many(arr, with_points=True)
+
+        next_level = []
+        for box, is_within, n_points, pop in zip(level, within.tolist(), points.tolist(), pops.tolist()):
+            if not n_points:
+                stats['uncovered'] += 1
+            elif pop <= 0 and drop_empty and is_within:
+                stats['dropped'] += 1
+                continue
+            elif depth < max_depth and pop / people_per_place > SATURATION * margin:
+                if lattice is not None:
+                    # Vertex children are shared with the neighbouring cells.
+                    keyed = [(key, c) for key, c in lattice.children(box, depth) if key not in seen]
+                    children = [c for _, c in keyed]
+                    radius = lattice.radius(box, depth + 1)
+                else:
+                    keyed = []
+                    children = utils.subdivide_box(*box)
+                    radius = utils.get_box_radius(*children[0])
+                if radius >= min_radius:
+                    seen.update(key for key, _ in keyed)
+                    next_level.extend(children)
+                    stats['presplit'] += 1
+                    continue
+            planned.append(box)
+            depths.append(depth)
+        level = next_level
+
+    return planned, depths, stats
@@ -0,0 +1,96 @@
+"""
+Adaptive token bucket shared by every outgoing Places call.
+
+The bucket refills at `rate` tokens per second up to `burst` tokens. Quota
+responses (OVER_QUERY_LIMIT / HTTP 429) halve the rate, and each successful
+call nudges it back up towards the target (AIMD), so the crawl settles just
+under the real quota instead of hammering it.
+"""
+import asyncio
+import threading
+import time
+
+
+class AdaptiveTokenBucket:
+    def __init__(self, rate: float, burst: float = None, min_rate: float = 0.2,
+                 decrease: float = 0.5, recovery: float = 0.5, cooldown: float = 2.0):
+        """
+        rate      -- target calls per second
+        burst     -- bucket capacity (defaults to one second worth of calls)
+        min_rate  -- floor the rate never goes below when backing off
+        decrease  -- multiplicative factor applied on a quota error
+        recovery  -- calls/second regained per second of clean traffic
+        cooldown  -- seconds during which further quota errors are ignored,
+                     so one burst of rejected in-flight calls only backs off once
+        """
+        self._lock = threading.Lock()
+        self.target = float(rate)
+        self.rate = float(rate)
+        self.burst = float(burst) if burst else max(1.0, float(rate))
+        self.min_rate = min_rate
+        self.decrease = decrease
+        self.recovery = recovery
+        self.cooldown = cooldown
+
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._cooldown_until = 0.0
+        self._queue_loop = None
+        self._queue = None
+        self.quota_errors = 0
+
+    def set_target(self, rate: float):
+        with self._lock:
+            self.target = float(rate)
+            self.rate = min(self.rate, self.target)
+            self.burst = max(1.0, self.target)
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_take(self, tokens: float = 1.0) -> float:
+        """
+        Takes `tokens` if they are available and returns 0, otherwise returns
+        how long to wait before they will be (at the current rate).
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate
+
+    async def acquire(self, tokens: float = 1.0):
+        # Waiters line up on an asyncio lock (FIFO) and the head re-checks the
+        # bucket after each sleep, so a rate change applies to queued callers
+        # immediately instead of after a backlog computed at the old rate.
+        async with self._waiters():
+            while True:
+                delay = self.try_take(tokens)
+                if delay <= 0:
+                    return
+                await asyncio.sleep(delay)
+
+    def _waiters(self) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        if self._queue_loop is not loop:
+            self._queue_loop, self._queue = loop, asyncio.Lock()
+        return self._queue
+
+    def on_success(self):
+        with self._lock:
+            if self.rate < self.target:
+                self.rate = min(self.target, self.rate + self.recovery / max(self.rate, 1.0))
+
+    def on_quota_error(self):
+        with self._lock:
+            self.quota_errors += 1
+            now = time.monotonic()
+            if now < self._cooldown_until:
+                return
+            self._refill(now)
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            # Drop the saved-up burst: the quota is telling us we are too fast.
+            self._tokens = min(self._tokens, 0.0)
+            self._cooldown_until = now + self.cooldown
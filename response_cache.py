@@ -0,0 +1,272 @@
+"""
+Persistent on-disk cache of nearby-search responses.
+
+Responses are stored in SQLite, keyed by the query geometry
+(keyword, lat, lng, radius, page) and indexed on it, so restarting a crawl or
+re-running an overlapping area does not pay twice for the same calls.
+
+Pages are keyed by their index (0, 1, 2) rather than by next_page_token:
+Google's tokens are single-use and expire after a few minutes, so they can
+never match on a later run.
+
+Every method blocks on SQLite: async callers run them in an executor (see
+PlacesClient). Hits only note their time in memory; the `last_used` column
+is updated in batches, with the next write or `flush()`.
+"""
+import csv
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from datetime import datetime
+
+from loguru import logger
+
+from api_log import list_segments, read_segment
+
+DEFAULT_TTL = 30 * 24 * 3600        # 30 days
+DEFAULT_MAX_BYTES = 512 * 1024 ** 2  # 512 MB of compressed responses
+
+# Responses logged within this delay after one carrying a next_page_token
+# for the same query are taken as its following page when importing logs.
+_IMPORT_PAGE_WINDOW = 120
+
+# Hits whose last_used is written at once, and rows evicted per statement.
+_TOUCH_BATCH = 256
+_EVICT_BATCH = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    keyword    TEXT    NOT NULL,
+    lat        REAL    NOT NULL,
+    lng        REAL    NOT NULL,
+    radius     REAL    NOT NULL,
+    page       INTEGER NOT NULL,
+    fetched_at REAL    NOT NULL,
+    last_used  REAL    NOT NULL,
+    size       INTEGER NOT NULL,
+    body       BLOB    NOT NULL,
+    PRIMARY KEY (keyword, lat, lng, radius, page)
+);
+CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used);
+CREATE INDEX IF NOT EXISTS responses_fetched_at ON responses (fetched_at);
+"""
+
+
+def _key(keyword: str, lat: float, lng: float, radius: float, page: int) -> tuple:
+    # Rounded so that the same box computed twice maps to the same row.
+    return (keyword.strip().lower(), round(float(lat), 7), round(float(lng), 7), round(float(radius), 2), int(page))
+
+
+class ResponseCache:
+    def __init__(self, path: str = "api_cache.sqlite", ttl: float = DEFAULT_TTL,
+                 max_bytes: int = DEFAULT_MAX_BYTES, replay: bool = False):
+        """
+        ttl       -- seconds a response stays valid (None: forever)
+        max_bytes -- least recently used responses are evicted above this size
+        replay    -- offline mode: a miss is an error instead of a live call
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.replay = replay
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        # key -> last hit time, not written yet
+        self._touched = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._flush_touched_locked()
+            self._conn.commit()
+            self._conn.close()
+
+    def flush(self):
+        """Writes the pending `last_used` updates."""
+        with self._lock:
+            self._flush_touched_locked()
+            self._conn.commit()
+
+    def _flush_touched_locked(self):
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE responses SET last_used=? WHERE keyword=? AND lat=? AND lng=? AND radius=? AND page=?",
+                [(used,) + key for key, used in self._touched.items()])
+            self._touched = {}
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    def get(self, keyword: str, lat: float, lng: float, radius: float, page: int = 0,
+            fetched_after: float = None) -> dict:
+        """
+        Returns the cached response, or None if it is missing or expired, or
+        was fetched before `fetched_after` (epoch seconds).
+        """
+        key = _key(keyword, lat, lng, radius, page)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT fetched_at, body FROM responses "
+                "WHERE keyword=? AND lat=? AND lng=? AND radius=? AND page=?", key).fetchone()
+            # Replay mode serves whatever was recorded, however old.
+            if row is None or (not self.replay and ((self.ttl is not None and now - row[0] > self.ttl)
+                                                    or row[0] < (fetched_after or 0))):
+                self.misses += 1
+                return None
+            self._touched[key] = now
+            if len(self._touched) >= _TOUCH_BATCH:
+                self._flush_touched_locked()
+                self._conn.commit()
+            self.hits += 1
+        return json.loads(zlib.decompress(row[1]))
+
+    def put(self, keyword: str, lat: float, lng: float, radius: float, page: int, response: dict,
+            fetched_at: float = None):
+        self._put_many([(_key(keyword, lat, lng, radius, page), response, fetched_at or time.time())])
+
+    def _put_many(self, rows: list):
+        """
+        Stores (key, response, fetched_at) rows, in any order: a stored row is
+        only replaced by a newer one. The pages of a query go together, so a
+        newer page 0 drops the query's pages fetched before it, and a page
+        older than the stored page 0 is not stored.
+        """
+        now = time.time()
+        with self._lock:
+            self._flush_touched_locked()
+            for key, response, fetched_at in rows:
+                query, page = key[:4], key[4]
+                first = self._conn.execute(
+                    "SELECT fetched_at FROM responses WHERE keyword=? AND lat=? AND lng=? AND radius=? AND page=0",
+                    query).fetchone()
+                if first is not None and fetched_at < first[0]:
+                    continue
+                old = self._conn.execute(
+                    "SELECT size FROM responses WHERE keyword=? AND lat=? AND lng=? AND radius=? AND page=?",
+                    key).fetchone()
+                body = zlib.compress(json.dumps(response, separators=(',', ':')).encode('utf-8'))
+                written = self._conn.execute(
+                    "INSERT INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (keyword, lat, lng, radius, page) DO UPDATE SET fetched_at=excluded.fetched_at, "
+                    "last_used=excluded.last_used, size=excluded.size, body=excluded.body "
+                    "WHERE excluded.fetched_at > responses.fetched_at",
+                    key + (fetched_at, now, len(body), body)).rowcount
+                if not written:
+                    continue
+                self._bytes += len(body) - (old[0] if old else 0)
+                if page == 0:
+                    where = "keyword=? AND lat=? AND lng=? AND radius=? AND page>0 AND fetched_at<?"
+                    stale = self._conn.execute(f"SELECT COALESCE(SUM(size), 0) FROM responses WHERE {where}",
+                                               query + (fetched_at,)).fetchone()[0]
+                    self._conn.execute(f"DELETE FROM responses WHERE {where}", query + (fetched_at,))
+                    self._bytes -= stale
+            self._conn.commit()
+            if self.max_bytes and self._bytes > self.max_bytes:
+                self._evict_locked()
+
+    def _evict_locked(self):
+        """
+        Drops expired rows, then least recently used ones down to 90% of
+        max_bytes, walking the fetched_at and last_used indexes.
+        """
+        if self.ttl is not None:
+            cutoff = time.time() - self.ttl
+            expired = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses WHERE fetched_at < ?",
+                                         (cutoff,)).fetchone()[0]
+            self._conn.execute("DELETE FROM responses WHERE fetched_at < ?", (cutoff,))
+            self._bytes -= expired
+        target = int(self.max_bytes * 0.9)
+        evicted = 0
+        while self._bytes > target:
+            rows = self._conn.execute("SELECT rowid, size FROM responses ORDER BY last_used LIMIT ?",
+                                      (_EVICT_BATCH,)).fetchall()
+            if not rows:
+                break
+            doomed = []
+            for rowid, size in rows:
+                if self._bytes <= target:
+                    break
+                doomed.append((rowid,))
+                self._bytes -= size
+            self._conn.executemany("DELETE FROM responses WHERE rowid=?", doomed)
+            evicted += len(doomed)
+        self._conn.commit()
+        if evicted: logger.info(f"Response cache: evicted {evicted} entries")
+
+    def import_api_logs(self, filepath: str = "api_logs.csv") -> int:
+        """
+        Loads the responses recorded by `utils.log_api_call` into the cache,
+        from an API log directory (see api_log.py) or a legacy api_logs.csv.
+        The CSV log does not record page numbers, so a row is taken as the
+        next page of the previous row for the same query when that row
+        carried a next_page_token and was logged shortly before, unless it
+        repeats a page of that chain (same first place): older crawls queried
+        page 0 of dense boxes twice.
+        """
+        if not os.path.exists(filepath):
+            raise FileNotFoundError(f"Log file not found: {filepath}")
+        if os.path.isdir(filepath):
+            return self._import_api_log_dir(filepath)
+
+        csv.field_size_limit(sys.maxsize)
+        last_seen = {}
+        rows = []
+        with open(filepath, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                if not row.get('response'):
+                    continue
+                try:
+                    response = json.loads(row['response'])
+                    ts = datetime.strptime(row['timestamp'], "%Y-%m-%d %H:%M:%S").timestamp()
+                    query = _key(row['keyword'], row['latitude'], row['longitude'], row['radius'], 0)[:4]
+                except (ValueError, KeyError):
+                    continue
+                if response.get('status', 'OK') not in ('OK', 'ZERO_RESULTS'):
+                    continue
+
+                results = response.get('results') or []
+                first = results[0].get('place_id') if results else None
+                page, firsts = 0, []
+                prev = last_seen.get(query)
+                if prev and ts - prev[2] <= _IMPORT_PAGE_WINDOW:
+                    if first is not None and first in prev[3]:
+                        # The same page again: the chain restarts from there.
+                        page = prev[3].index(first)
+                        firsts = prev[3][:page]
+                    elif prev[1]:
+                        page, firsts = prev[0] + 1, prev[3]
+                last_seen[query] = (page, bool(response.get('next_page_token')), ts, firsts + [first])
+                rows.append((query + (page,), response, ts))
+
+        self._put_many(rows)
+        logger.info(f"Response cache: imported {len(rows)} responses from {filepath}")
+        return len(rows)
+
+    def _import_api_log_dir(self, directory: str) -> int:
+        rows = []
+        for segment in list_segments(directory):
+            for entry in read_segment(segment):
+                response = entry.get('response')
+                if not response or response.get('status', 'OK') not in ('OK', 'ZERO_RESULTS'):
+                    continue
+                rows.append((_key(entry['keyword'], entry['lat'], entry['lng'], entry['radius'], entry['page']),
+                             response, entry['ts']))
+        self._put_many(rows)
+        logger.info(f"Response cache: imported {len(rows)} responses from {directory}")
+        return len(rows)
@@ -0,0 +1,92 @@
+"""
+Strategies to split a saturated box into children.
+
+  quadrant -- four equal quadrants (utils.subdivide_box), ignores the places
+  kd       -- four children cut at the median latitude and longitude of the
+              places the parent returned, so each child holds about a
+              quarter of the known places
+  cluster  -- the padded bounding box of the returned places as one child,
+              and the space around it in up to four strips; falls back to
+              `kd` when the places are spread over most of the box
+
+A child without any returned place is not known to be empty (Google only
+returned the 20 most prominent places), so every strategy still covers the
+whole parent box.
+"""
+import numpy as np
+
+import utils
+
+STRATEGIES = ('quadrant', 'kd', 'cluster')
+
+# Cuts stay this far (fraction of the side) from the parent edges: a median
+# right on the edge would make a sliver child.
+_MIN_CUT = 0.25
+# `cluster` pads the bounding box of the places by this fraction of the side,
+# and only isolates it when it covers less than this fraction of the parent.
+_CLUSTER_PAD = 0.05
+_CLUSTER_MAX_AREA = 0.5
+
+
+def places_inside(places: list, box: tuple) -> np.ndarray:
+    """(lat, lng) array of the places located inside `box`."""
+    min_lat, min_lng, max_lat, max_lng = box[:4]
+    coords = np.array([(loc['lat'], loc['lng']) for loc in
+                       (p.get('geometry', {}).get('location') for p in places) if loc],
+                      dtype=np.float64).reshape(-1, 2)
+    inside = ((coords[:, 0] >= min_lat) & (coords[:, 0] < max_lat) &
+              (coords[:, 1] >= min_lng) & (coords[:, 1] < max_lng))
+    return coords[inside]
+
+
+def _cut(lo: float, hi: float, value: float) -> float:
+    span = hi - lo
+    return min(max(value, lo + _MIN_CUT * span), hi - _MIN_CUT * span)
+
+
+def kd_split(box: tuple, coords: np.ndarray) -> list:
+    min_lat, min_lng, max_lat, max_lng = box[:4]
+    if len(coords) < 2:
+        return utils.subdivide_box(min_lat, min_lng, max_lat, max_lng)
+    mid_lat = _cut(min_lat, max_lat, float(np.median(coords[:, 0])))
+    mid_lng = _cut(min_lng, max_lng, float(np.median(coords[:, 1])))
+    return [
+        (min_lat, min_lng, mid_lat, mid_lng),  # Bottom Left
+        (min_lat, mid_lng, mid_lat, max_lng),  # Bottom Right
+        (mid_lat, min_lng, max_lat, mid_lng),  # Top Left
+        (mid_lat, mid_lng, max_lat, max_lng),  # Top Right
+    ]
+
+
+def cluster_split(box: tuple, coords: np.ndarray) -> list:
+    min_lat, min_lng, max_lat, max_lng = box[:4]
+    if len(coords) < 2:
+        return utils.subdivide_box(min_lat, min_lng, max_lat, max_lng)
+    pad_lat, pad_lng = (max_lat - min_lat) * _CLUSTER_PAD, (max_lng - min_lng) * _CLUSTER_PAD
+    c_min_lat = max(min_lat, float(coords[:, 0].min()) - pad_lat)
+    c_max_lat = min(max_lat, float(coords[:, 0].max()) + pad_lat)
+    c_min_lng = max(min_lng, float(coords[:, 1].min()) - pad_lng)
+    c_max_lng = min(max_lng, float(coords[:, 1].max()) + pad_lng)
+    area = (c_max_lat - c_min_lat) * (c_max_lng - c_min_lng)
+    if area > _CLUSTER_MAX_AREA * (max_lat - min_lat) * (max_lng - min_lng):
+        return kd_split(box, coords)
+
+    children = [
+        (c_min_lat, c_min_lng, c_max_lat, c_max_lng),  # Cluster
+        (min_lat, min_lng, c_min_lat, max_lng),        # South strip
+        (c_max_lat, min_lng, max_lat, max_lng),        # North strip
+        (c_min_lat, min_lng, c_max_lat, c_min_lng),    # West
+        (c_min_lat, c_max_lng, c_max_lat, max_lng),    # East
+    ]
+    return [c for c in children if c[2] > c[0] and c[3] > c[1]]
+
+
+def split_box(box: tuple, places: list, strategy: str = 'quadrant') -> list:
+    """Children (min_lat, min_lng, max_lat, max_lng) of a saturated box."""
+    if strategy == 'quadrant':
+        return utils.subdivide_box(*box[:4])
+    if strategy == 'kd':
+        return kd_split(box, places_inside(places, box))
+    if strategy == 'cluster':
+        return cluster_split(box, places_inside(places, box))
+    raise ValueError(f"Unknown split strategy: {strategy} (expected one of {STRATEGIES})")
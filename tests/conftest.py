@@ -0,0 +1,51 @@
+import asyncio
+import os
+import socket
+import sys
+import threading
+
+import pytest
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import api_log
+import crawler
+import places_client
+from mock_places_api import NEARBY_PATH, MockPlacesAPI, synthetic_places
+
+CENTER = (48.8566, 2.3522)
+TOKEN_DELAY = 0.05
+
+
+@pytest.fixture(autouse=True, scope="session")
+def _api_log_dir(tmp_path_factory):
+    # Responses of the mock never go to the working directory's api_logs/.
+    api_log.DEFAULT_DIR = str(tmp_path_factory.mktemp("api_logs"))
+    yield
+    api_log.default_log().close()
+
+
+@pytest.fixture(autouse=True)
+def _fast_page_tokens(monkeypatch):
+    monkeypatch.setattr(crawler, "PAGE_TOKEN_DELAY", TOKEN_DELAY)
+    monkeypatch.setattr(places_client, "PAGE_TOKEN_DELAY", TOKEN_DELAY)
+
+
+@pytest.fixture(scope="session")
+def mock_api():
+    """(MockPlacesAPI, nearby-search URL) of 5000 synthetic places served on a free port."""
+    lats, lngs = synthetic_places(CENTER, 35, 5000)
+    api = MockPlacesAPI(lats, lngs, token_delay=TOKEN_DELAY, latency=0.005)
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(api.app())
+    loop.run_until_complete(runner.setup())
+    loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", port).start())
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield api, f"http://127.0.0.1:{port}{NEARBY_PATH}"
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
@@ -0,0 +1,47 @@
+import time
+
+from crawl_store import IN_FLIGHT, PENDING, CrawlStore
+
+
+def _seed(store, n):
+    crawl_id = store.create_crawl("Restaurants")
+    ops = [('add', i, (48.0 + i, 2.0, 48.5 + i, 2.5), None, 0, None, True) for i in range(n)]
+    store.apply(crawl_id, ops, n, 0)
+    return crawl_id
+
+
+def test_expired_leases_are_taken_over(tmp_path):
+    store = CrawlStore(str(tmp_path / "crawls.sqlite"))
+    crawl_id = _seed(store, 3)
+
+    leased = store.lease(crawl_id, "a", 2, ttl=0.3)
+    assert [row[4] for row in leased] == [0, 1]
+    # Only the box nobody holds is left for the other worker.
+    assert [row[4] for row in store.lease(crawl_id, "b", 10, ttl=60)] == [2]
+    assert store.lease(crawl_id, "b", 10, ttl=60) == []
+
+    time.sleep(0.4)
+    # Worker a died: its boxes go to the next worker that asks.
+    assert sorted(row[4] for row in store.lease(crawl_id, "b", 10, ttl=60)) == [0, 1]
+    assert store.box_counts(crawl_id) == {IN_FLIGHT: 3}
+    assert store.release(crawl_id, "a") == 0
+    assert store.release(crawl_id, "b") == 3
+    assert store.box_counts(crawl_id) == {PENDING: 3}
+
+
+def test_load_requeues_only_expired_leases(tmp_path):
+    store = CrawlStore(str(tmp_path / "crawls.sqlite"))
+    crawl_id = _seed(store, 2)
+    store.lease(crawl_id, "a", 1, ttl=0.1)
+    store.lease(crawl_id, "b", 1, ttl=60)
+    time.sleep(0.2)
+
+    state = store.load(crawl_id)
+    # The box of the live worker stays in flight and is not resumed here.
+    assert [(box['sector_id'], box['state']) for box in state['boxes']] == [(0, PENDING)]
+    assert store.box_counts(crawl_id) == {PENDING: 1, IN_FLIGHT: 1}
+
+    # A renewed lease does not expire.
+    store.renew(crawl_id, "b", ttl=60)
+    assert store.lease(crawl_id, "c", 10, ttl=60)[0][4] == 0
+    assert store.lease(crawl_id, "c", 10, ttl=60) == []
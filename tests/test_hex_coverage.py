@@ -0,0 +1,54 @@
+import math
+import random
+
+from hex_coverage import HexLattice, hex_grid
+
+from conftest import CENTER
+
+
+def _inside_hexagon(lattice, level, q, r, x, y):
+    # Hexagons of level L have their vertices at 30 L + 30 degrees.
+    cx, cy = lattice.center(level, q, r)
+    apothem = lattice.cell_radius(level) * math.sqrt(3) / 2
+    for k in range(6):
+        angle = math.radians(30 * level + k * 60)
+        if (x - cx) * math.cos(angle) + (y - cy) * math.sin(angle) > apothem:
+            return False
+    return True
+
+
+def test_children_cover_their_parent():
+    lattice, boxes = hex_grid(*CENTER, 2, 20)
+    rng = random.Random(0)
+    cells = [(boxes[len(boxes) // 2], 0)]
+    # Follow a few refinements down, through centre and vertex children
+    for _ in range(3):
+        box, level = cells[-1]
+        key, child = lattice.children(box, level)[rng.randrange(7)]
+        cells.append((child, level + 1))
+
+    for box, level in cells:
+        _, q, r = lattice.key(box, level)
+        children = lattice.children(box, level)
+        assert len({key for key, _ in children}) == 7
+        assert lattice.key(children[0][1], level + 1) == children[0][0]
+        radius = lattice.cell_radius(level + 1)
+        assert math.isclose(radius, lattice.cell_radius(level) / math.sqrt(3))
+        centers = [lattice.center(*key) for key, _ in children]
+
+        cx, cy = lattice.center(level, q, r)
+        outer = lattice.cell_radius(level)
+        tested = 0
+        while tested < 2000:
+            x, y = cx + rng.uniform(-outer, outer), cy + rng.uniform(-outer, outer)
+            if not _inside_hexagon(lattice, level, q, r, x, y):
+                continue
+            tested += 1
+            assert min(math.hypot(x - px, y - py) for px, py in centers) <= radius * (1 + 1e-9), (level, x, y)
+
+
+def test_key_round_trips_through_the_box():
+    lattice = HexLattice(*CENTER, 5000)
+    for level in range(4):
+        for q, r in ((0, 0), (3, -2), (-5, 7)):
+            assert lattice.key(lattice.cell_box(level, q, r), level) == (level, q, r)
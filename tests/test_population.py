@@ -0,0 +1,36 @@
+import numpy as np
+
+from utils import PopulationAnalyzer
+
+
+def test_population_many_matches_brute_force(tmp_path):
+    rng = np.random.default_rng(0)
+    n = 20000
+    lons = rng.uniform(-1.0, 3.0, n).round(4)
+    lats = rng.uniform(45.0, 49.0, n).round(4)
+    pops = rng.integers(0, 500, n)
+    csv_path = tmp_path / "pop.csv"
+    with open(csv_path, "w") as f:
+        f.write("X,Y,Z\n")
+        for x, y, z in zip(lons, lats, pops):
+            f.write(f"{x},{y},{z}\n")
+
+    analyzer = PopulationAnalyzer(str(csv_path), cache_dir=str(tmp_path / "cache"))
+    boxes = []
+    for _ in range(300):
+        lat1, lat2 = sorted(rng.uniform(44.5, 49.5, 2))
+        lon1, lon2 = sorted(rng.uniform(-1.5, 3.5, 2))
+        boxes.append((lat1, lon1, lat2, lon2))
+    # A box with edges on data points, and one with no point at all
+    boxes.append((lats[0], lons[0], lats[1] if lats[1] > lats[0] else lats[0] + 0.5, lons[0] + 0.5))
+    boxes.append((10.0, 10.0, 11.0, 11.0))
+
+    totals, points = analyzer.get_population_many(boxes, with_points=True)
+
+    lat32, lon32, pop32 = analyzer.lats, analyzer.lons, analyzer.pops
+    for i, (min_lat, min_lon, max_lat, max_lon) in enumerate(boxes):
+        inside = ((lat32 >= np.float32(min_lat)) & (lat32 <= np.float32(max_lat)) &
+                  (lon32 >= np.float32(min_lon)) & (lon32 <= np.float32(max_lon)))
+        assert points[i] == inside.sum(), boxes[i]
+        assert np.isclose(totals[i], pop32[inside].sum(dtype=np.float64), rtol=1e-5), boxes[i]
+    assert points[-1] == 0
@@ -0,0 +1,49 @@
+import csv
+import json
+
+from response_cache import ResponseCache
+
+
+def _page(ids, token=None):
+    response = {'status': 'OK', 'results': [{'place_id': i} for i in ids]}
+    if token: response['next_page_token'] = token
+    return response
+
+
+def _write_log(path, rows):
+    with open(path, "w", newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(["timestamp", "keyword", "latitude", "longitude", "radius", "response"])
+        for ts, response in rows:
+            writer.writerow([ts, "Restaurants", 48.85, 2.35, 1000, json.dumps(response)])
+
+
+def test_csv_import_with_repeated_pages(tmp_path):
+    p0, p1, p2 = _page(["a", "b"], "t1"), _page(["c", "d"], "t2"), _page(["e"])
+    log = tmp_path / "api_logs.csv"
+    # Older crawls queried page 0 of dense boxes twice before paginating.
+    _write_log(log, [("2024-01-01 10:00:00", p0), ("2024-01-01 10:00:03", p0),
+                     ("2024-01-01 10:00:06", p1), ("2024-01-01 10:00:09", p2)])
+
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), ttl=None)
+    assert cache.import_api_logs(str(log)) == 4
+    assert len(cache) == 3
+    assert cache.get("Restaurants", 48.85, 2.35, 1000, 0)['results'] == p0['results']
+    assert cache.get("restaurants", 48.85, 2.35, 1000, 1)['results'] == p1['results']
+    assert cache.get("Restaurants", 48.85, 2.35, 1000, 2)['results'] == p2['results']
+    assert cache.get("Restaurants", 48.85, 2.35, 1000, 3) is None
+
+
+def test_newer_query_replaces_its_pages(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), ttl=None)
+    cache.put("Restaurants", 48.85, 2.35, 1000, 0, _page(["a"], "t1"), fetched_at=100)
+    cache.put("Restaurants", 48.85, 2.35, 1000, 1, _page(["b"]), fetched_at=101)
+    # An older response never overwrites a newer one.
+    cache.put("Restaurants", 48.85, 2.35, 1000, 0, _page(["old"]), fetched_at=50)
+    assert cache.get("Restaurants", 48.85, 2.35, 1000, 0)['results'] == [{'place_id': 'a'}]
+
+    # A newer page 0 drops the pages of the older chain.
+    cache.put("Restaurants", 48.85, 2.35, 1000, 0, _page(["z"]), fetched_at=200)
+    assert cache.get("Restaurants", 48.85, 2.35, 1000, 0)['results'] == [{'place_id': 'z'}]
+    assert cache.get("Restaurants", 48.85, 2.35, 1000, 1) is None
+    assert len(cache) == 1
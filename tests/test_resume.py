@@ -0,0 +1,37 @@
+import utils
+from crawl_store import CrawlStore
+from crawler import CrawlEngine
+from place_store import PlaceStore
+
+from conftest import CENTER
+
+
+def test_resume_finds_the_same_places(mock_api, tmp_path):
+    api, url = mock_api
+    box = utils.get_grid_boxes(*CENTER, 1)[0]
+
+    single = CrawlEngine("key", "Restaurants", max_rps=100, base_url=url)
+    single.seed([box])
+    single.start()
+    assert single.wait(120)
+    expected = len(single.snapshot(queue_preview=0)['results'])
+
+    store_path, places_path = str(tmp_path / "crawls.sqlite"), str(tmp_path / "places.sqlite")
+    first = CrawlEngine("key", "Restaurants", max_rps=100, base_url=url, store=CrawlStore(store_path),
+                        places=PlaceStore(places_path))
+    first.seed([box])
+    crawl_id = first.crawl_id
+    # Step mode: the engine stops on its own after 30 boxes.
+    first.start(max_boxes=30)
+    assert first.wait(120)
+    counts = CrawlStore(store_path).box_counts(crawl_id)
+    assert counts.get('pending'), counts
+    assert len(PlaceStore(places_path)) < expected
+
+    resumed = CrawlEngine.resume(CrawlStore(store_path), crawl_id, "key", places=PlaceStore(places_path),
+                                 base_url=url)
+    resumed.start()
+    assert resumed.wait(120)
+    assert set(CrawlStore(store_path).box_counts(crawl_id)) <= {'done', 'split'}
+    assert len(PlaceStore(places_path)) == expected
+    assert len(resumed.snapshot(queue_preview=0)['results']) == expected
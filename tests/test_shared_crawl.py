@@ -0,0 +1,33 @@
+import utils
+from crawl_store import CrawlStore
+from crawler import CrawlEngine
+from place_store import PlaceStore
+
+from conftest import CENTER
+
+
+def test_work_is_spread_across_workers(mock_api, tmp_path):
+    api, url = mock_api
+    store_path, places_path = str(tmp_path / "crawls.sqlite"), str(tmp_path / "places.sqlite")
+    seeder = CrawlEngine("key", "Restaurants", max_rps=100, store=CrawlStore(store_path), base_url=url)
+    seeder.seed([utils.get_grid_boxes(*CENTER, 1)[0]])
+    crawl_id = seeder.crawl_id
+
+    # Fast workers: far more coroutines each than there are boxes early on.
+    workers = [CrawlEngine.join(CrawlStore(store_path), crawl_id, "key", f"w{i}", places=PlaceStore(places_path),
+                                base_url=url, max_rps=100) for i in range(3)]
+    for engine in workers: engine.start()
+    for engine in workers: assert engine.wait(120)
+
+    processed = [len(engine.snapshot(queue_preview=0)['processed']) for engine in workers]
+    counts = CrawlStore(store_path).box_counts(crawl_id)
+    assert sum(processed) == sum(counts.values())
+    assert set(counts) <= {'done', 'split'}
+    # Nobody hoards the crawl: every worker got a real share of it.
+    assert min(processed) >= sum(processed) / 10, processed
+
+    single = CrawlEngine("key", "Restaurants", max_rps=100, base_url=url)
+    single.seed([utils.get_grid_boxes(*CENTER, 1)[0]])
+    single.start()
+    assert single.wait(120)
+    assert len(PlaceStore(places_path)) == len(single.snapshot(queue_preview=0)['results'])
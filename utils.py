@@ -1,54 +1,43 @@
 import unittest
 import dotenv
 import os
-from loguru import logger
-from datetime import datetime
 import json
-import csv
 import requests
 import time
 import math
 import pandas as pd
 
 import numpy as np
+
+import api_log
+
+# Side of the initial grid blocks, in km
+BLOCK_SIZE_KM = 70.0
+
 # Load the API key from the .env file
 def load_key() -> str:
     dotenv.load_dotenv()
     key = os.getenv("GOOGLE_KEY")
     return key
 
-def log_api_call(keyword: str, lat: float, lng: float, radius: float, filepath: str = "api_logs.csv", response: dict = None):
+def load_keys(path: str = None) -> list:
+    """
+    API keys for a KeyPool: one per line of `path` if given, else the
+    comma-separated GOOGLE_KEYS variable, else GOOGLE_KEY alone.
+    """
+    if path:
+        with open(path, encoding='utf-8') as f:
+            return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    dotenv.load_dotenv()
+    keys = [k.strip() for k in os.getenv("GOOGLE_KEYS", "").split(",") if k.strip()]
+    return keys or [k for k in [load_key()] if k]
+
+def log_api_call(keyword: str, lat: float, lng: float, radius: float, response: dict = None, page: int = 0):
     """
-    Logs the API call and the response to the standard logger and to a CSV file.
+    Records the API call and its response in the background API log
+    (see api_log.py); returns at once, the writing happens on its thread.
     """
-    # 1. Existing Logger
-    logger.info(f"API Call: {keyword} - {lat}, {lng} - {radius}")
-
-    # 2. CSV Handling
-    file_exists = os.path.isfile(filepath)
-    current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-    # Serialize the response dict to a JSON string
-    response_str = json.dumps(response) if response else ""
-
-    try:
-        with open(filepath, mode='a', newline='', encoding='utf-8') as csvfile:
-            fieldnames = ['timestamp', 'keyword', 'latitude', 'longitude', 'radius', 'response']
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-
-            if not file_exists:
-                writer.writeheader()
-
-            writer.writerow({
-                'timestamp': current_time,
-                'keyword': keyword,
-                'latitude': lat,
-                'longitude': lng,
-                'radius': radius,
-                'response': response_str
-            })
-    except IOError as e:
-        logger.error(f"Error writing to CSV: {e}")
+    api_log.default_log().record(keyword, lat, lng, radius, response, page)
 
 def search_places(api_key: str, keyword: str, lat: float, lng: float, radius: float, max_pages: int = 1) -> list:
     """
@@ -77,7 +66,7 @@ def search_places(api_key: str, keyword: str, lat: float, lng: float, radius: fl
             response.raise_for_status()
             data = response.json()
             
-            log_api_call(keyword, lat, lng, radius, response=data)
+            log_api_call(keyword, lat, lng, radius, response=data, page=page_num)
 
             current_results = data.get('results', [])
             all_places.extend(current_results)
@@ -95,16 +84,32 @@ def search_places(api_key: str, keyword: str, lat: float, lng: float, radius: fl
 
 # --- VERSION 2 : Classe Optimisée (Pour traiter toute la France) ---
 class PopulationAnalyzer:
-    def __init__(self, csv_path="france_population.csv"):
+    # Fichiers du cache binaire (un .npy par tableau, ouverts en memory-map)
+    _CACHE_ARRAYS = ('lats', 'lons', 'pops', '_offsets', '_sat', '_sat_n')
+    _CACHE_VERSION = 2
+
+    def __init__(self, csv_path="france_population.csv", cache_dir=None, use_cache=True):
         """
         Charge un fichier CSV (X, Y, Z) en mémoire RAM sous forme de matrices NumPy.
         Beaucoup plus simple et fiable que le TIFF.
+
+        Les tableaux et l'index spatial sont enregistrés en .npy dans
+        `cache_dir` (par défaut "<csv_path>.cache") et relus en memory-map
+        aux lancements suivants : chargement quasi instantané, et une seule
+        copie en RAM partagée par tous les processus. Le cache est reconstruit
+        dès que le CSV change (taille ou date de modification).
         """
-        print(f"⏳ Chargement du CSV population : {csv_path}...")
-        
         if not os.path.exists(csv_path):
             raise FileNotFoundError(f"❌ Fichier introuvable : {csv_path}")
 
+        self.cache_dir = cache_dir or csv_path + ".cache"
+        stamp = self._source_stamp(csv_path)
+        if use_cache and self._load_cache(stamp):
+            print(f"⚡ {self.count:,} points de population chargés depuis le cache : {self.cache_dir}")
+            return
+
+        print(f"⏳ Chargement du CSV population : {csv_path}...")
+
         # 1. Lecture rapide avec Pandas
         # On s'attend à : X (Lon), Y (Lat), Z (Pop)
         try:
@@ -123,6 +128,7 @@ class PopulationAnalyzer:
             self.lons = df['X'].to_numpy(dtype=np.float32)
             self.lats = df['Y'].to_numpy(dtype=np.float32)
             self.pops = df['Z'].to_numpy(dtype=np.float32)
+            del df
             
             self.count = len(self.lons)
             print(f"✅ {self.count:,} points de données chargés en mémoire !")
@@ -131,37 +137,176 @@ class PopulationAnalyzer:
             print(f"❌ Erreur lors de la lecture du CSV : {e}")
             raise
 
+        self._build_index()
+        if use_cache:
+            self._save_cache(stamp)
+
+    # --- CACHE BINAIRE ---
+    @staticmethod
+    def _source_stamp(csv_path) -> dict:
+        st = os.stat(csv_path)
+        return {'source': os.path.abspath(csv_path), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+    def _load_cache(self, stamp) -> bool:
+        meta_path = os.path.join(self.cache_dir, "meta.json")
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('version') != self._CACHE_VERSION or meta.get('stamp') != stamp:
+                return False
+            arrays = {name: np.load(os.path.join(self.cache_dir, f"{name}.npy"), mmap_mode='r')
+                      for name in self._CACHE_ARRAYS}
+        except (OSError, ValueError):
+            return False
+        for name, array in arrays.items():
+            setattr(self, name, array)
+        self.count = meta['count']
+        self._grid = tuple(meta['grid'])
+        return True
+
+    def _save_cache(self, stamp):
+        # Chaque fichier est écrit à côté puis renommé, et meta.json en dernier :
+        # un autre processus ne voit jamais un cache à moitié écrit.
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            for name in self._CACHE_ARRAYS:
+                path = os.path.join(self.cache_dir, f"{name}.npy")
+                tmp = f"{path}.{os.getpid()}.tmp"
+                with open(tmp, 'wb') as f:
+                    np.save(f, getattr(self, name))
+                os.replace(tmp, path)
+            meta = {'version': self._CACHE_VERSION, 'stamp': stamp, 'count': self.count, 'grid': list(self._grid)}
+            tmp = os.path.join(self.cache_dir, f"meta.json.{os.getpid()}.tmp")
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+            os.replace(tmp, os.path.join(self.cache_dir, "meta.json"))
+        except OSError as e:
+            print(f"⚠️ Cache population non enregistré : {e}")
+
+    # --- INDEX SPATIAL ---
+    # Les points sont rangés par case d'une grille régulière (tri CSR :
+    # les points de la case k sont dans [offsets[k], offsets[k+1])), et une
+    # table des sommes cumulées (summed-area table) donne la population de
+    # n'importe quel bloc de cases entières en O(1). Seules les cases coupées
+    # par le bord du rectangle sont parcourues point par point.
+    _POINTS_PER_BIN = 32
+    _MAX_BINS = 4_000_000
+    # Marge (en degrés) qui couvre l'arrondi float32 des coordonnées
+    _EDGE_EPS = 1e-5
+
+    def _build_index(self):
+        lat0 = float(self.lats.min()) if self.count else 0.0
+        lon0 = float(self.lons.min()) if self.count else 0.0
+        span_lat = max(float(self.lats.max()) - lat0, 1e-6) if self.count else 1e-6
+        span_lon = max(float(self.lons.max()) - lon0, 1e-6) if self.count else 1e-6
+
+        # Taille de case : ~_POINTS_PER_BIN points par case en moyenne,
+        # sans dépasser _MAX_BINS cases au total
+        step = math.sqrt(span_lat * span_lon / max(self.count / self._POINTS_PER_BIN, 1))
+        step = max(step, math.sqrt(span_lat * span_lon / self._MAX_BINS))
+        ny, nx = int(span_lat // step) + 1, int(span_lon // step) + 1
+
+        rows = np.floor((self.lats.astype(np.float64) - lat0) / step).astype(np.int64)
+        cols = np.floor((self.lons.astype(np.float64) - lon0) / step).astype(np.int64)
+        bins = rows * nx + cols
+        order = np.argsort(bins, kind='stable')
+        self.lats, self.lons, self.pops, bins = self.lats[order], self.lons[order], self.pops[order], bins[order]
+
+        self._offsets = np.zeros(ny * nx + 1, dtype=np.int64)
+        np.cumsum(np.bincount(bins, minlength=ny * nx), out=self._offsets[1:])
+        sums = np.bincount(bins, weights=self.pops.astype(np.float64), minlength=ny * nx).reshape(ny, nx)
+        self._sat = np.zeros((ny + 1, nx + 1), dtype=np.float64)
+        self._sat[1:, 1:] = sums.cumsum(axis=0).cumsum(axis=1)
+        # Même table pour le nombre de points (cases de la grille sans donnée)
+        self._sat_n = np.zeros((ny + 1, nx + 1), dtype=np.int64)
+        self._sat_n[1:, 1:] = np.diff(self._offsets).reshape(ny, nx).cumsum(axis=0).cumsum(axis=1)
+        self._grid = (lat0, lon0, step, ny, nx)
+
+    @property
+    def bounds(self) -> tuple:
+        """(min_lat, min_lon, max_lat, max_lon) couverts par les données."""
+        lat0, lon0, step, ny, nx = self._grid
+        return (lat0, lon0, lat0 + ny * step, lon0 + nx * step)
+
+    def _edge_bins(self, r0, r1, c0, c1, ri0, ri1, ci0, ci1) -> np.ndarray:
+        """Cases du rectangle [r0..r1] x [c0..c1] hors du bloc intérieur [ri0..ri1] x [ci0..ci1]."""
+        nx = self._grid[4]
+        cols = np.arange(c0, c1 + 1)
+        if ri0 > ri1 or ci0 > ci1:
+            return np.add.outer(np.arange(r0, r1 + 1) * nx, cols).ravel()
+        side_cols = np.concatenate([np.arange(c0, ci0), np.arange(ci1 + 1, c1 + 1)])
+        return np.concatenate([
+            np.add.outer(np.arange(r0, ri0) * nx, cols).ravel(),
+            np.add.outer(np.arange(ri1 + 1, r1 + 1) * nx, cols).ravel(),
+            np.add.outer(np.arange(ri0, ri1 + 1) * nx, side_cols).ravel(),
+        ])
+
+    def get_population_many(self, boxes, with_points: bool = False):
+        """
+        Population de chaque rectangle (min_lat, min_lon, max_lat, max_lon),
+        bords inclus. Calcul vectorisé : la somme des cases entièrement
+        couvertes vient de la table cumulée, les cases de bord sont filtrées
+        point par point en un seul passage pour tous les rectangles.
+        Avec `with_points`, renvoie (populations, nombre de points) : un
+        rectangle sans aucun point n'a pas de données, ce qui n'est pas une
+        population nulle.
+        """
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        lat0, lon0, step, ny, nx = self._grid
+        eps = self._EDGE_EPS
+
+        # Cases touchées par chaque rectangle, puis cases entièrement dedans
+        r0 = np.clip(np.floor((boxes[:, 0] - eps - lat0) / step), 0, ny - 1).astype(np.int64)
+        r1 = np.clip(np.floor((boxes[:, 2] + eps - lat0) / step), -1, ny - 1).astype(np.int64)
+        c0 = np.clip(np.floor((boxes[:, 1] - eps - lon0) / step), 0, nx - 1).astype(np.int64)
+        c1 = np.clip(np.floor((boxes[:, 3] + eps - lon0) / step), -1, nx - 1).astype(np.int64)
+        ri0 = np.maximum(np.ceil((boxes[:, 0] + eps - lat0) / step).astype(np.int64), r0)
+        ri1 = np.minimum(np.floor((boxes[:, 2] - eps - lat0) / step).astype(np.int64) - 1, r1)
+        ci0 = np.maximum(np.ceil((boxes[:, 1] + eps - lon0) / step).astype(np.int64), c0)
+        ci1 = np.minimum(np.floor((boxes[:, 3] - eps - lon0) / step).astype(np.int64) - 1, c1)
+
+        # 1. Blocs intérieurs : O(1) par rectangle
+        inner = (ri0 <= ri1) & (ci0 <= ci1)
+        a, b = np.where(inner, ri0, 0), np.where(inner, ri1 + 1, 0)
+        c, d = np.where(inner, ci0, 0), np.where(inner, ci1 + 1, 0)
+        totals = np.where(inner, self._sat[b, d] - self._sat[a, d] - self._sat[b, c] + self._sat[a, c], 0.0)
+        points = np.where(inner, self._sat_n[b, d] - self._sat_n[a, d] - self._sat_n[b, c] + self._sat_n[a, c], 0)
+
+        # 2. Cases de bord : on rassemble leurs points pour tous les rectangles
+        edge_bins, owners = [], []
+        for i in np.flatnonzero((r0 <= r1) & (c0 <= c1)):
+            e = self._edge_bins(r0[i], r1[i], c0[i], c1[i], ri0[i], ri1[i], ci0[i], ci1[i])
+            edge_bins.append(e)
+            owners.append(np.full(len(e), i, dtype=np.int64))
+        if edge_bins:
+            edge_bins, owners = np.concatenate(edge_bins), np.concatenate(owners)
+            starts = self._offsets[edge_bins]
+            counts = self._offsets[edge_bins + 1] - starts
+            ends = np.cumsum(counts)
+            idx = np.repeat(starts - ends + counts, counts) + np.arange(ends[-1] if len(ends) else 0)
+            owner = np.repeat(owners, counts)
+            # Comparaison en float32, comme les coordonnées stockées
+            box = boxes[owner].astype(np.float32)
+            inside = ((self.lats[idx] >= box[:, 0]) & (self.lats[idx] <= box[:, 2]) &
+                      (self.lons[idx] >= box[:, 1]) & (self.lons[idx] <= box[:, 3]))
+            totals += np.bincount(owner, weights=self.pops[idx] * inside, minlength=len(boxes))
+            points += np.bincount(owner, weights=inside, minlength=len(boxes)).astype(np.int64)
+
+        if with_points:
+            return totals.astype(np.int64), points
+        return totals.astype(np.int64)
+
     def get_population(self, lat: float, lon: float, size_km: float) -> int:
         """
-        Trouve tous les points dans le carré et fait la somme.
-        Utilise des filtres NumPy (très rapide).
+        Population du carré de côté size_km centré sur (lat, lon).
         """
-        # 1. Convertir la taille (km) en degrés (approximatif mais suffisant)
         # 1 degré Latitude ~= 111.32 km
         # 1 degré Longitude ~= 111.32 * cos(lat)
-        
         radius_km = size_km / 2.0
-        
         delta_lat = radius_km / 111.32
         delta_lon = radius_km / (111.32 * math.cos(math.radians(lat)))
-        
-        min_lat = lat - delta_lat
-        max_lat = lat + delta_lat
-        min_lon = lon - delta_lon
-        max_lon = lon + delta_lon
-        
-        # 2. Filtrage vectoriel (C'est ici que la magie opère)
-        # On crée un masque : "Garde les points qui sont entre min et max"
-        # C'est instantané grâce à NumPy
-        mask = (
-            (self.lats >= min_lat) & (self.lats <= max_lat) & 
-            (self.lons >= min_lon) & (self.lons <= max_lon)
-        )
-        
-        # 3. Somme des populations qui correspondent au masque
-        total_pop = np.sum(self.pops[mask])
-        
-        return int(total_pop)
+        box = (lat - delta_lat, lon - delta_lon, lat + delta_lat, lon + delta_lon)
+        return int(self.get_population_many([box])[0])
 
 def register_full_dataset_to_csv(new_places_list: list, filename: str = "full_places_dataset.csv"):
     """
@@ -252,4 +397,25 @@ def subdivide_box(min_lat, min_lng, max_lat, max_lng):
         (min_lat, mid_lng, mid_lat, max_lng),  # Bottom Right
         (mid_lat, min_lng, max_lat, mid_lng),  # Top Left
         (mid_lat, mid_lng, max_lat, max_lng)   # Top Right
-    ]
\ No newline at end of file
+    ]
+
+def get_grid_boxes(center_lat, center_lng, n_blocks, block_size_km=BLOCK_SIZE_KM):
+    """
+    Builds an N x N grid of square blocks centered on (center_lat, center_lng).
+    Returns a list of tuples: (min_lat, min_lng, max_lat, max_lng)
+    """
+    boxes = []
+    d_lat_deg = block_size_km / 111.32
+    d_lng_deg = block_size_km / (111.32 * math.cos(math.radians(center_lat)))
+    offset = (n_blocks - 1) / 2.0
+    start_lat = center_lat + (offset * d_lat_deg)
+    start_lng = center_lng - (offset * d_lng_deg)
+
+    for row in range(n_blocks):
+        for col in range(n_blocks):
+            b_lat = start_lat - (row * d_lat_deg)
+            b_lng = start_lng + (col * d_lng_deg)
+            half_lat = d_lat_deg / 2
+            half_lng = d_lng_deg / 2
+            boxes.append((b_lat - half_lat, b_lng - half_lng, b_lat + half_lat, b_lng + half_lng))
+    return boxes
\ No newline at end of file